@@ -3,6 +3,7 @@ Improved Zalanko Backend Application.
 Production-ready structure with proper error handling, logging, and configuration.
 """
 
+import asyncio
 from pathlib import Path
 from aiohttp import web
 from aiohttp_cors import setup as cors_setup, ResourceOptions
@@ -13,12 +14,18 @@ from config.settings import settings
 from utils.logger import setup_logging, get_logger, set_request_id
 from exceptions import ConfigurationError
 from prompts import FASHION_ASSISTANT_SYSTEM_MESSAGE
-from ragtools import attach_rag_tools
+from ragtools import attach_rag_tools, virtual_tryon_service
 from rtmt import RTMiddleTier
 from search_manager import SearchManager
 from image_tools.image_utils import ImageService
+from image_tools.image_pipeline import shutdown_executor
 from image_proxy import setup_image_routes
 from services.virtual_tryon_endpoint import setup_virtual_tryon_routes
+from services.session_state import session_state_store
+from services.tryon_jobs import tryon_job_queue
+from services.garment_cache import garment_cache, watch_catalog
+from services.tryon_result_store import tryon_result_store
+from services.person_photos import person_photo_store
 
 
 # Setup logging first
@@ -61,7 +68,22 @@ async def create_app() -> web.Application:
         # Attach RAG tools
         attach_rag_tools(rtmt, credentials=search_credential,
                         search_manager=search_manager, image_service=image_service)
+        rtmt.compile_session_config()
+        app["image_service"] = image_service
         rtmt.attach_to_app(app, "/realtime")
+        app.on_cleanup.append(_flush_session_state)
+        app.on_startup.append(_start_session_state_purge)
+        app.on_cleanup.append(_stop_session_state_purge)
+        app.on_cleanup.append(_shutdown_image_pool)
+        app.on_startup.append(_start_tryon_jobs)
+        app.on_cleanup.append(_stop_tryon_jobs)
+        app.on_startup.append(_start_garment_cache_warmer)
+        app.on_cleanup.append(_stop_garment_cache_warmer)
+        app.on_startup.append(_start_result_retention)
+        app.on_cleanup.append(_stop_result_retention)
+        app.on_startup.append(_start_person_photo_expiry)
+        app.on_cleanup.append(_stop_person_photo_expiry)
+        app.on_cleanup.append(_close_garment_uploads)
 
         # Setup routes
         _setup_routes(app)
@@ -129,6 +151,12 @@ def _setup_rtmt(llm_credential) -> RTMiddleTier:
         rtmt.max_tokens = 1200
         rtmt.system_message = FASHION_ASSISTANT_SYSTEM_MESSAGE
 
+        # Keep stale tool outputs from growing the realtime conversation, always keeping the latest search results
+        rtmt.context_budget_tokens = settings.realtime_context_budget_tokens
+        rtmt.context_keep_recent = settings.realtime_context_keep_recent
+        rtmt.context_pinned_tools = {"search"}
+        rtmt.send_session_on_connect = settings.realtime_send_session_on_connect
+
         logger.debug("RTMT configured successfully")
         return rtmt
 
@@ -161,6 +189,7 @@ def _setup_image_service() -> ImageService:
             storage_account=settings.azure_storage_account_name,
             container=settings.azure_storage_container_name
         )
+        logger.info(f"Product images served from the {settings.image_storage_backend} image backend")
         logger.debug("ImageService configured successfully")
         return image_service
 
@@ -169,6 +198,85 @@ def _setup_image_service() -> ImageService:
         raise ConfigurationError(f"ImageService setup failed: {e}")
 
 
+async def _flush_session_state(app: web.Application) -> None:
+    """Persist shopping session state on shutdown."""
+    session_state_store.flush()
+
+
+async def _start_session_state_purge(app: web.Application) -> None:
+    """Delete persisted shopping session state past its TTL in the background."""
+    if session_state_store.persist_dir is not None:
+        app["session_state_purge"] = asyncio.create_task(session_state_store.run_purge())
+
+
+async def _stop_session_state_purge(app: web.Application) -> None:
+    purge = app.get("session_state_purge")
+    if purge is not None:
+        purge.cancel()
+
+
+async def _start_tryon_jobs(app: web.Application) -> None:
+    """Start the virtual try-on job workers."""
+    tryon_job_queue.start()
+
+
+async def _stop_tryon_jobs(app: web.Application) -> None:
+    """Stop the virtual try-on job workers."""
+    await tryon_job_queue.stop()
+
+
+async def _start_garment_cache_warmer(app: web.Application) -> None:
+    """Warm the try-on garment cache from the catalog, and again whenever the catalog changes."""
+    catalog_path = settings.garment_cache_catalog_path
+    if not catalog_path or virtual_tryon_service is None:
+        return
+    app["garment_cache_warmer"] = asyncio.create_task(
+        watch_catalog(garment_cache, catalog_path, app["image_service"].get_product_image)
+    )
+
+
+async def _stop_garment_cache_warmer(app: web.Application) -> None:
+    warmer = app.get("garment_cache_warmer")
+    if warmer is not None:
+        warmer.cancel()
+
+
+async def _start_result_retention(app: web.Application) -> None:
+    """Enforce the try-on result store's quota and age limit in the background."""
+    app["result_retention"] = asyncio.create_task(
+        tryon_result_store.run_retention(settings.tryon_results_retention_interval_seconds)
+    )
+
+
+async def _stop_result_retention(app: web.Application) -> None:
+    retention = app.get("result_retention")
+    if retention is not None:
+        retention.cancel()
+
+
+async def _start_person_photo_expiry(app: web.Application) -> None:
+    """Evict person photos unused for longer than their TTL in the background."""
+    app["person_photo_expiry"] = asyncio.create_task(person_photo_store.run_expiry())
+
+
+async def _stop_person_photo_expiry(app: web.Application) -> None:
+    expiry = app.get("person_photo_expiry")
+    if expiry is not None:
+        expiry.cancel()
+
+
+async def _close_garment_uploads(app: web.Application) -> None:
+    """Cancel the garment uploads still in progress on shutdown."""
+    garment_uploads = getattr(virtual_tryon_service.backend, "garment_uploads", None) if virtual_tryon_service else None
+    if garment_uploads is not None:
+        await garment_uploads.close()
+
+
+async def _shutdown_image_pool(app: web.Application) -> None:
+    """Stop the image processing worker processes on shutdown."""
+    shutdown_executor()
+
+
 def _setup_routes(app: web.Application) -> None:
     """Setup application routes."""
     try:
@@ -43,6 +43,150 @@ class Settings:
     def azure_openai_voice_choice(self) -> str:
         return os.environ.get("AZURE_OPENAI_REALTIME_VOICE_CHOICE", "alloy")
 
+    @property
+    def realtime_context_budget_tokens(self) -> Optional[int]:
+        budget = int(os.environ.get("REALTIME_CONTEXT_BUDGET_TOKENS", "6000"))
+        return budget if budget > 0 else None
+
+    @property
+    def realtime_context_keep_recent(self) -> int:
+        return int(os.environ.get("REALTIME_CONTEXT_KEEP_RECENT", "2"))
+
+    @property
+    def realtime_send_session_on_connect(self) -> bool:
+        return os.environ.get("REALTIME_SEND_SESSION_ON_CONNECT", "false").lower() == "true"
+
+    # Session State Settings
+    @property
+    def session_state_max_sessions(self) -> int:
+        return int(os.environ.get("SESSION_STATE_MAX_SESSIONS", "1000"))
+
+    @property
+    def session_state_idle_ttl_seconds(self) -> int:
+        return int(os.environ.get("SESSION_STATE_IDLE_TTL_SECONDS", "1800"))
+
+    @property
+    def session_state_persist_dir(self) -> Optional[str]:
+        return os.environ.get("SESSION_STATE_PERSIST_DIR")
+
+    @property
+    def session_state_persist_ttl_seconds(self) -> int:
+        return int(os.environ.get("SESSION_STATE_PERSIST_TTL_SECONDS", str(7 * 24 * 3600)))
+
+    # Virtual Try-On Job Settings
+    @property
+    def tryon_job_workers(self) -> int:
+        return int(os.environ.get("TRYON_JOB_WORKERS", "4"))
+
+    @property
+    def tryon_queue_max_depth(self) -> int:
+        return int(os.environ.get("TRYON_QUEUE_MAX_DEPTH", "32"))
+
+    @property
+    def tryon_job_retention_seconds(self) -> int:
+        return int(os.environ.get("TRYON_JOB_RETENTION_SECONDS", "600"))
+
+    @property
+    def tryon_batch_max_products(self) -> int:
+        return int(os.environ.get("TRYON_BATCH_MAX_PRODUCTS", "4"))
+
+    @property
+    def person_photo_session_quota_mb(self) -> int:
+        return int(os.environ.get("PERSON_PHOTO_SESSION_MAX_MB", "8"))
+
+    @property
+    def person_photo_max_mb(self) -> int:
+        return int(os.environ.get("PERSON_PHOTO_MAX_MB", "256"))
+
+    @property
+    def person_photo_ttl_seconds(self) -> int:
+        return int(os.environ.get("PERSON_PHOTO_TTL_SECONDS", "1800"))
+
+    @property
+    def garment_cache_max_mb(self) -> int:
+        return int(os.environ.get("GARMENT_CACHE_MAX_MB", "64"))
+
+    @property
+    def garment_cache_catalog_path(self) -> Optional[str]:
+        return os.environ.get("GARMENT_CACHE_CATALOG_PATH")
+
+    @property
+    def tryon_results_dir(self) -> str:
+        return os.environ.get("TRYON_RESULTS_DIR", "virtual_tryon_results")
+
+    @property
+    def tryon_results_quota_mb(self) -> int:
+        return int(os.environ.get("TRYON_RESULTS_MAX_MB", "500"))
+
+    @property
+    def tryon_results_max_age_seconds(self) -> int:
+        return int(os.environ.get("TRYON_RESULTS_MAX_AGE_SECONDS", "604800"))
+
+    @property
+    def tryon_results_retention_interval_seconds(self) -> int:
+        return int(os.environ.get("TRYON_RESULTS_RETENTION_INTERVAL_SECONDS", "300"))
+
+    @property
+    def tryon_result_format(self) -> str:
+        return os.environ.get("VIRTUAL_TRYON_RESULT_FORMAT", "WEBP").upper()
+
+    @property
+    def tryon_result_cache_ttl_seconds(self) -> int:
+        return int(os.environ.get("TRYON_RESULT_CACHE_TTL_SECONDS", "604800"))
+
+    @property
+    def tryon_result_quality(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_RESULT_QUALITY", "85"))
+
+    @property
+    def tryon_preview_dimension(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_PREVIEW_DIMENSION", "384"))
+
+    @property
+    def tryon_preview_quality(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_PREVIEW_QUALITY", "70"))
+
+    @property
+    def tryon_max_concurrency(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_MAX_CONCURRENCY", "4"))
+
+    @property
+    def tryon_max_per_session(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_MAX_PER_SESSION", "2"))
+
+    @property
+    def tryon_max_waiting(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_MAX_WAITING", "16"))
+
+    # Virtual Try-On Backend Settings: vertex (Gemini on Vertex AI or the Gemini API) or local
+    @property
+    def tryon_backend(self) -> str:
+        return os.environ.get("VIRTUAL_TRYON_BACKEND", "vertex").lower()
+
+    @property
+    def google_genai_use_vertexai(self) -> bool:
+        return os.environ.get("GOOGLE_GENAI_USE_VERTEXAI", "true").lower() == "true"
+
+    @property
+    def tryon_garment_uploads(self) -> bool:
+        return os.environ.get("VIRTUAL_TRYON_GARMENT_UPLOADS", "true").lower() == "true"
+
+    @property
+    def tryon_garment_uploads_max(self) -> int:
+        return int(os.environ.get("VIRTUAL_TRYON_GARMENT_UPLOADS_MAX", "512"))
+
+    @property
+    def local_tryon_latency_ms(self) -> float:
+        return float(os.environ.get("LOCAL_TRYON_LATENCY_MS", "0"))
+
+    @property
+    def local_tryon_jitter_ms(self) -> float:
+        return float(os.environ.get("LOCAL_TRYON_JITTER_MS", "0"))
+
+    @property
+    def local_tryon_output_size(self) -> str:
+        return os.environ.get("LOCAL_TRYON_OUTPUT_SIZE", "768x1024")
+
     # Azure Search Settings
     @property
     def azure_search_service_name(self) -> str:
@@ -69,6 +213,61 @@ class Settings:
     def azure_storage_connection_string(self) -> Optional[str]:
         return os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
 
+    # Product Image Settings: azure (Blob Storage) or local (LOCAL_IMAGE_DIR, defaults to data/images)
+    @property
+    def image_storage_backend(self) -> str:
+        return os.environ.get("IMAGE_STORAGE_BACKEND", "azure").lower()
+
+    @property
+    def local_image_dir(self) -> Optional[str]:
+        return os.environ.get("LOCAL_IMAGE_DIR") or None
+
+    @property
+    def image_stream_chunk_kb(self) -> int:
+        return int(os.environ.get("IMAGE_STREAM_CHUNK_KB", "1024"))
+
+    @property
+    def image_cache_max_mb(self) -> int:
+        return int(os.environ.get("IMAGE_CACHE_MAX_MB", "64"))
+
+    @property
+    def image_cache_revalidate_seconds(self) -> float:
+        return float(os.environ.get("IMAGE_CACHE_REVALIDATE_SECONDS", "300"))
+
+    @property
+    def image_not_found_ttl_seconds(self) -> float:
+        return float(os.environ.get("IMAGE_NOT_FOUND_TTL_SECONDS", "60"))
+
+    @property
+    def image_disk_cache_dir(self) -> Optional[str]:
+        # Set to an empty value to disable the disk cache
+        return os.environ.get("IMAGE_DISK_CACHE_DIR", "image_cache") or None
+
+    @property
+    def image_disk_cache_max_mb(self) -> int:
+        return int(os.environ.get("IMAGE_DISK_CACHE_MAX_MB", "512"))
+
+    @property
+    def image_derivative_widths(self) -> Optional[str]:
+        return os.environ.get("IMAGE_DERIVATIVE_WIDTHS") or None
+
+    @property
+    def image_derivative_qualities(self) -> Optional[str]:
+        return os.environ.get("IMAGE_DERIVATIVE_QUALITIES") or None
+
+    @property
+    def image_derivative_cache_max_mb(self) -> int:
+        return int(os.environ.get("IMAGE_DERIVATIVE_CACHE_MAX_MB", "32"))
+
+    @property
+    def image_derivative_cache_dir(self) -> Optional[str]:
+        # Set to an empty value to disable the derivative disk cache
+        return os.environ.get("IMAGE_DERIVATIVE_CACHE_DIR", os.path.join("image_cache", "derivatives")) or None
+
+    @property
+    def image_derivative_disk_cache_max_mb(self) -> int:
+        return int(os.environ.get("IMAGE_DERIVATIVE_DISK_CACHE_MAX_MB", "256"))
+
     # Google Cloud Settings
     @property
     def google_cloud_api_key(self) -> Optional[str]:
@@ -118,6 +317,56 @@ class Settings:
         if missing:
             raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
 
+        if self.tryon_result_format not in ("WEBP", "JPEG", "PNG"):
+            raise ValueError(f"VIRTUAL_TRYON_RESULT_FORMAT must be WEBP, JPEG or PNG, got {self.tryon_result_format}")
+
+        if self.image_storage_backend not in ("azure", "local"):
+            raise ValueError(f"IMAGE_STORAGE_BACKEND must be azure or local, got {self.image_storage_backend}")
+
+        if self.tryon_backend not in ("vertex", "local"):
+            raise ValueError(f"VIRTUAL_TRYON_BACKEND must be vertex or local, got {self.tryon_backend}")
+
+        self._validate_numeric_settings()
+
+    def _validate_numeric_settings(self) -> None:
+        """Validate that the numeric tuning knobs parse and are within range."""
+        ranges = {
+            "VIRTUAL_TRYON_RESULT_QUALITY": (lambda: self.tryon_result_quality, 1, 100),
+            "VIRTUAL_TRYON_PREVIEW_DIMENSION": (lambda: self.tryon_preview_dimension, 1, None),
+            "VIRTUAL_TRYON_PREVIEW_QUALITY": (lambda: self.tryon_preview_quality, 1, 100),
+            "VIRTUAL_TRYON_MAX_CONCURRENCY": (lambda: self.tryon_max_concurrency, 1, None),
+            "VIRTUAL_TRYON_MAX_PER_SESSION": (lambda: self.tryon_max_per_session, 1, None),
+            "VIRTUAL_TRYON_MAX_WAITING": (lambda: self.tryon_max_waiting, 0, None),
+            "VIRTUAL_TRYON_GARMENT_UPLOADS_MAX": (lambda: self.tryon_garment_uploads_max, 1, None),
+            "LOCAL_TRYON_LATENCY_MS": (lambda: self.local_tryon_latency_ms, 0, None),
+            "LOCAL_TRYON_JITTER_MS": (lambda: self.local_tryon_jitter_ms, 0, None),
+            "IMAGE_STREAM_CHUNK_KB": (lambda: self.image_stream_chunk_kb, 1, None),
+            "IMAGE_CACHE_MAX_MB": (lambda: self.image_cache_max_mb, 0, None),
+            "IMAGE_CACHE_REVALIDATE_SECONDS": (lambda: self.image_cache_revalidate_seconds, 0, None),
+            "IMAGE_NOT_FOUND_TTL_SECONDS": (lambda: self.image_not_found_ttl_seconds, 0, None),
+            "IMAGE_DISK_CACHE_MAX_MB": (lambda: self.image_disk_cache_max_mb, 0, None),
+            "IMAGE_DERIVATIVE_CACHE_MAX_MB": (lambda: self.image_derivative_cache_max_mb, 0, None),
+            "IMAGE_DERIVATIVE_DISK_CACHE_MAX_MB": (lambda: self.image_derivative_disk_cache_max_mb, 0, None),
+        }
+
+        for key, (read, minimum, maximum) in ranges.items():
+            try:
+                value = read()
+            except ValueError:
+                raise ValueError(f"{key} must be a number, got {os.environ.get(key)}")
+            if value < minimum or (maximum is not None and value > maximum):
+                bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+                raise ValueError(f"{key} must be {bounds}, got {value}")
+
+        for key in ("IMAGE_DERIVATIVE_WIDTHS", "IMAGE_DERIVATIVE_QUALITIES"):
+            parts = [part.strip() for part in os.environ.get(key, "").split(",") if part.strip()]
+            if not all(part.isdigit() and int(part) > 0 for part in parts):
+                raise ValueError(f"{key} must be a comma separated list of positive integers, got {os.environ.get(key)}")
+
+        width, _, height = self.local_tryon_output_size.lower().partition("x")
+        if not (width.isdigit() and height.isdigit() and int(width) > 0 and int(height) > 0):
+            raise ValueError(f"LOCAL_TRYON_OUTPUT_SIZE must be WIDTHxHEIGHT, got {self.local_tryon_output_size}")
+
 
 # Global settings instance
 settings = Settings()
\ No newline at end of file
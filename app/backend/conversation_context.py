@@ -0,0 +1,201 @@
+"""
+Conversation context tracking for the realtime middle tier.
+Keeps the tool outputs the middle tier injects into the realtime conversation within a budget.
+"""
+
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger("voicerag")
+
+# Rough conversion used to estimate tokens from serialized output size
+BYTES_PER_TOKEN = 4
+
+# Prefix marking conversation items created by the middle tier
+ITEM_ID_PREFIX = "zlk_"
+
+# Upper bound for the compact summary that replaces a pruned output
+MAX_SUMMARY_CHARS = 400
+
+
+def new_item_id() -> str:
+    """Create a conversation item id owned by the middle tier (realtime ids are limited to 32 chars)."""
+    return f"{ITEM_ID_PREFIX}{uuid.uuid4().hex[:24]}"
+
+
+def is_own_item(item_id: Optional[str]) -> bool:
+    """Whether a conversation item id was created by the middle tier."""
+    return bool(item_id) and item_id.startswith(ITEM_ID_PREFIX)
+
+
+def summarize_tool_output(tool_name: str, output: str) -> str:
+    """
+    Build a compact summary of a tool output that is about to be pruned.
+
+    Search-like results keep product ids and titles so the model can still refer to them,
+    anything else is truncated.
+    """
+    summary = None
+    try:
+        payload = json.loads(output[output.index("{"):]) if "{" in output else None
+    except ValueError:
+        payload = None
+
+    if isinstance(payload, dict) and isinstance(payload.get("products"), list):
+        entries = []
+        for product in payload["products"]:
+            if not isinstance(product, dict):
+                continue
+            entry = str(product.get("id", "?"))
+            if product.get("title"):
+                entry += f" {product['title']}"
+            if product.get("price") is not None:
+                entry += f" ({product['price']})"
+            entries.append(entry)
+        summary = f"Earlier {tool_name} results (details pruned): " + "; ".join(entries)
+
+    if summary is None:
+        summary = f"Earlier {tool_name} output (pruned): {output}"
+
+    if len(summary) > MAX_SUMMARY_CHARS:
+        summary = summary[:MAX_SUMMARY_CHARS - 3] + "..."
+    return summary
+
+
+class TrackedItem:
+    """A function_call_output item created by the middle tier."""
+    item_id: str
+    call_id: str
+    tool_name: str
+    output: str
+    size: int
+    previous_item_id: Optional[str]
+    summarized: bool
+
+    def __init__(self, item_id: str, call_id: str, tool_name: str, output: str,
+                 previous_item_id: Optional[str] = None, summarized: bool = False):
+        self.item_id = item_id
+        self.call_id = call_id
+        self.tool_name = tool_name
+        self.output = output
+        self.size = len(output.encode("utf-8"))
+        self.previous_item_id = previous_item_id
+        self.summarized = summarized
+
+
+class ConversationContext:
+    """
+    Tracks the tool output items the middle tier added to a realtime conversation and
+    produces the events needed to keep them within a token budget.
+
+    The most recent outputs, and the latest output of every pinned tool (e.g. the last
+    search results), are never pruned so the current product context stays available.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: Optional[int] = None,
+        keep_recent: int = 2,
+        pinned_tools: Optional[set[str]] = None,
+        summarize: bool = True
+    ):
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.pinned_tools = pinned_tools or set()
+        self.summarize = summarize
+        self.items: "OrderedDict[str, TrackedItem]" = OrderedDict()
+        self.pruned_count = 0
+        self.evicted_summaries = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(item.size for item in self.items.values())
+
+    @property
+    def estimated_tokens(self) -> int:
+        return self.total_bytes // BYTES_PER_TOKEN
+
+    def track(self, item_id: str, call_id: str, tool_name: str, output: str,
+              previous_item_id: Optional[str] = None) -> TrackedItem:
+        """Record a function_call_output item created by the middle tier."""
+        item = TrackedItem(item_id, call_id, tool_name, output, previous_item_id)
+        self.items[item_id] = item
+        return item
+
+    def forget(self, item_id: str) -> None:
+        """Stop tracking an item, e.g. after the server reports it deleted."""
+        self.items.pop(item_id, None)
+
+    def _protected_ids(self) -> set[str]:
+        ordered = [item for item in self.items.values() if not item.summarized]
+        protected = {item.item_id for item in ordered[-self.keep_recent:]} if self.keep_recent > 0 else set()
+        latest_pinned: dict[str, str] = {}
+        for item in ordered:
+            if item.tool_name in self.pinned_tools:
+                latest_pinned[item.tool_name] = item.item_id
+        protected.update(latest_pinned.values())
+        return protected
+
+    def prune(self) -> list[dict[str, Any]]:
+        """
+        Return the realtime events that bring the tracked outputs back under budget.
+
+        Oldest unprotected outputs are deleted first; when summaries are enabled each
+        deleted output is replaced by a compact function_call_output for the same call.
+        Summaries count against the budget too, if they alone exceed it the oldest are deleted.
+        """
+        if self.budget_tokens is None or self.estimated_tokens <= self.budget_tokens:
+            return []
+
+        events: list[dict[str, Any]] = []
+        protected = self._protected_ids()
+        budget_bytes = self.budget_tokens * BYTES_PER_TOKEN
+        total = self.total_bytes
+
+        for item in list(self.items.values()):
+            if total <= budget_bytes:
+                break
+            if item.item_id in protected or item.summarized:
+                continue
+
+            events.append({"type": "conversation.item.delete", "item_id": item.item_id})
+            del self.items[item.item_id]
+            total -= item.size
+            self.pruned_count += 1
+
+            if self.summarize:
+                summary = summarize_tool_output(item.tool_name, item.output)
+                replacement = TrackedItem(new_item_id(), item.call_id, item.tool_name, summary,
+                                          item.previous_item_id, summarized=True)
+                create_event: dict[str, Any] = {
+                    "type": "conversation.item.create",
+                    "item": {
+                        "id": replacement.item_id,
+                        "type": "function_call_output",
+                        "call_id": item.call_id,
+                        "output": summary
+                    }
+                }
+                if item.previous_item_id:
+                    create_event["previous_item_id"] = item.previous_item_id
+                events.append(create_event)
+                self.items[replacement.item_id] = replacement
+                total += replacement.size
+
+        # Summaries are kept in the order their outputs were pruned, oldest first
+        for item in [item for item in self.items.values() if item.summarized]:
+            if total <= budget_bytes:
+                break
+            events.append({"type": "conversation.item.delete", "item_id": item.item_id})
+            del self.items[item.item_id]
+            total -= item.size
+            self.evicted_summaries += 1
+
+        if events:
+            logger.info("Pruned %d stale tool outputs, context now ~%d tokens",
+                        sum(1 for e in events if e["type"] == "conversation.item.delete"),
+                        total // BYTES_PER_TOKEN)
+        return events
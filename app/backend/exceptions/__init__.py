@@ -34,6 +34,19 @@ class ExternalServiceError(ZalankoError):
     pass
 
 
+class UploadsNotSupportedError(ExternalServiceError):
+    """Raised when a model provider does not accept file uploads."""
+    pass
+
+
+class QueueFullError(ZalankoError):
+    """Raised when work is rejected because a queue is at capacity."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 # Export all exceptions
 __all__ = [
     "ZalankoError",
@@ -41,5 +54,7 @@ __all__ = [
     "SearchError",
     "VirtualTryOnError",
     "ImageProcessingError",
-    "ExternalServiceError"
+    "ExternalServiceError",
+    "UploadsNotSupportedError",
+    "QueueFullError"
 ]
\ No newline at end of file
@@ -3,92 +3,340 @@ Image proxy service to serve authenticated Azure Storage blob images.
 Provides secure image access without exposing storage account keys.
 """
 
-import os
-from typing import Optional
-from aiohttp import web, ClientSession
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob.aio import BlobServiceClient
+import logging
+from typing import Any, Dict, Optional, Tuple
+from aiohttp import web
+from azure.core.exceptions import (AzureError, HttpResponseError, ResourceModifiedError, ResourceNotFoundError,
+                                   ResourceNotModifiedError)
 from dotenv import load_dotenv
 
+from exceptions import ImageProcessingError
+from image_tools.image_derivatives import ImageDerivatives, image_derivatives
+from image_tools.image_store import ImageStore, ProductImageStore, StoredImage, image_content_type, image_store
+
 load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
 class ImageProxy:
     """Proxy service for serving authenticated blob storage images."""
-    
-    def __init__(self):
-        self.storage_account = os.getenv("AZURE_STORAGE_ACCOUNT_NAME", "zalankoimages")
-        self.container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "product-images")
-        
-        # Use Azure AD authentication
-        self.credential = DefaultAzureCredential()
-        account_url = f"https://{self.storage_account}.blob.core.windows.net"
-        self.blob_service_client = BlobServiceClient(account_url, credential=self.credential)
-    
+
+    def __init__(self, store: Optional[ProductImageStore] = None, derivatives: Optional[ImageDerivatives] = None):
+        self.store = store or image_store
+        self.derivatives = derivatives or (image_derivatives if self.store is image_store else ImageDerivatives(self.store))
+        self.storage_account = self.store.storage_account
+        self.container_name = self.store.container
+        self.requests = 0
+        self.not_modified = 0
+        self.partial = 0
+        self.streamed_bytes = 0
+        self.files_served = 0
+
+    async def get_image(self, filename: str) -> Optional[StoredImage]:
+        """Image with its blob properties, served from the shared image store."""
+        return await self.store.get(filename)
+
     async def get_blob_stream(self, product_id: str, filename: str):
-        """Get blob data stream with authentication."""
-        try:
-            blob_name = filename
-            blob_client = self.blob_service_client.get_blob_client(
-                container=self.container_name, 
-                blob=blob_name
-            )
-            
-            # Download blob data
-            blob_data = await blob_client.download_blob()
-            content = await blob_data.readall()
-            
-            # Get content type from blob properties
-            properties = await blob_client.get_blob_properties()
-            content_type = properties.content_settings.content_type or "image/jpeg"
-            
-            return content, content_type
-            
-        except Exception as e:
-            print(f"Error fetching blob {filename}: {e}")
+        """Get blob data with authentication, served from the shared image store."""
+        image = await self.get_image(filename)
+        if image is None:
             return None, None
-    
+        return image.data, image.content_type
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "partial": self.partial,
+            "streamed_bytes": self.streamed_bytes,
+            "files_served": self.files_served,
+            "store": self.store.metrics(),
+            "derivatives": self.derivatives.metrics(),
+        }
+
     async def cleanup(self):
-        """Clean up the blob service client."""
-        if hasattr(self.blob_service_client, 'close'):
-            await self.blob_service_client.close()
+        """Clean up the shared blob service client."""
+        await self.store.close()
 
 
 # Global instance
 image_proxy = ImageProxy()
 
+
+def _is_not_modified(request: web.Request, image) -> bool:
+    """Whether the client's cached copy is current, If-None-Match taking precedence over If-Modified-Since."""
+    if request.if_none_match is not None:
+        etag = (image.etag or "").strip('"')
+        return any(tag.value in (etag, "*") for tag in request.if_none_match)
+    if request.if_modified_since is not None and image.last_modified is not None:
+        return image.last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _requested_range(request: web.Request) -> Optional[slice]:
+    """The requested byte range, None for the whole image (invalid or multiple ranges are ignored)."""
+    try:
+        byte_range = request.http_range
+    except ValueError:
+        return None
+    if byte_range.start is None and byte_range.stop is None:
+        return None
+    return byte_range
+
+
+def _if_range_etag(request: web.Request) -> Optional[str]:
+    """The strong ETag of an If-Range header, None if it is absent or carries a date or weak ETag."""
+    if_range = request.headers.get('If-Range')
+    if if_range is None or not if_range.startswith('"'):
+        return None
+    return if_range
+
+
+def _if_range_matches(request: web.Request, image) -> bool:
+    """Whether a range request still applies to this image, a changed image is sent whole."""
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    etag = _if_range_etag(request)
+    if etag is not None:
+        return image.etag is not None and etag.strip('"') == image.etag.strip('"')
+    # A date only validates if it is exactly the image's Last-Modified
+    return (request.if_range is not None and image.last_modified is not None
+            and image.last_modified.replace(microsecond=0) == request.if_range)
+
+
+def _resolve_range(byte_range: slice, size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a range within an image of this size, None if it is not satisfiable."""
+    start, stop = byte_range.start, byte_range.stop
+    if start < 0:
+        start, stop = max(size + start, 0), size
+    stop = size if stop is None else min(stop, size)
+    if start >= stop:
+        return None
+    return start, stop - 1
+
+
+def _validator_headers(response: web.StreamResponse, image) -> None:
+    if image.etag:
+        response.etag = image.etag.strip('"')
+    if image.last_modified is not None:
+        response.last_modified = image.last_modified
+
+
+def _not_modified_response(image, headers: Dict[str, str]) -> web.Response:
+    image_proxy.not_modified += 1
+    response = web.Response(status=304, headers=headers)
+    _validator_headers(response, image)
+    return response
+
+
+def _unsatisfiable_response(size: Optional[int], headers: Dict[str, str]) -> web.Response:
+    if size is not None:
+        headers = {**headers, 'Content-Range': f'bytes */{size}'}
+    return web.Response(text="Requested range not satisfiable", status=416, headers=headers)
+
+
+def _cached_response(request: web.Request, image: StoredImage, byte_range: Optional[slice],
+                     headers: Dict[str, str]) -> web.Response:
+    """Answer from a cached image, slicing it when a range was requested."""
+    if _is_not_modified(request, image):
+        return _not_modified_response(image, headers)
+    status = 200
+    body = image.data
+    if byte_range is not None and _if_range_matches(request, image):
+        resolved = _resolve_range(byte_range, len(image.data))
+        if resolved is None:
+            return _unsatisfiable_response(len(image.data), headers)
+        first, last = resolved
+        status = 206
+        body = image.data[first:last + 1]
+        headers = {**headers, 'Content-Range': f'bytes {first}-{last}/{len(image.data)}'}
+        image_proxy.partial += 1
+    response = web.Response(body=body, status=status, content_type=image.content_type, headers=headers)
+    _validator_headers(response, image)
+    return response
+
+
+async def _streamed_response(request: web.Request, store: ImageStore, filename: str, byte_range: Optional[slice],
+                             headers: Dict[str, str]) -> web.StreamResponse:
+    """
+    Relay an image from Blob Storage chunk by chunk with a single download request.
+    Content type, length and validators come from the download response, so no properties
+    request is made. Whole images that fit in a single chunk are kept, later requests are then
+    answered from the cache; larger ones are relayed without being buffered.
+    """
+    # Ranges with a date or weak If-Range validator cannot be checked before downloading, those
+    # clients get the whole image, as they would if the validator did not match
+    if_match = _if_range_etag(request) if byte_range is not None else None
+    if byte_range is not None and 'If-Range' in request.headers and if_match is None:
+        byte_range = None
+
+    offset = length = None
+    # Suffix ranges need the blob size before downloading, those clients get the whole image
+    if byte_range is not None and byte_range.start >= 0:
+        offset = byte_range.start
+        length = byte_range.stop - byte_range.start if byte_range.stop is not None else None
+    else:
+        if_match = None
+
+    # A single client ETag makes the download conditional, a match then costs no body transfer
+    etag = None
+    if request.if_none_match is not None and len(request.if_none_match) == 1:
+        tag = request.if_none_match[0]
+        if tag.value != "*" and not tag.is_weak:
+            etag = f'"{tag.value}"'
+
+    try:
+        try:
+            stream = await store.open_stream(filename, offset=offset, length=length, etag=etag, if_match=if_match)
+        except ResourceModifiedError:
+            # The If-Range validator no longer matches, the whole current image is sent
+            stream = await store.open_stream(filename, etag=etag)
+    except ResourceNotModifiedError:
+        image_proxy.not_modified += 1
+        response = web.Response(status=304, headers=headers)
+        response.etag = etag.strip('"')
+        return response
+    except ResourceNotFoundError:
+        return _not_found_response()
+    except HttpResponseError as e:
+        if e.status_code == 416:
+            return _unsatisfiable_response(None, headers)
+        logger.error(f"Error downloading image {filename}: {e}")
+        return web.Response(text="Image storage unavailable", status=502, headers=headers)
+    except AzureError as e:
+        logger.error(f"Error connecting to image storage for {filename}: {e}")
+        return web.Response(text="Image storage unavailable", status=502, headers=headers)
+
+    if _is_not_modified(request, stream):
+        return _not_modified_response(stream, headers)
+
+    response = web.StreamResponse(status=206 if stream.partial else 200, headers=headers)
+    response.content_type = stream.content_type
+    response.content_length = stream.size
+    if stream.partial:
+        last = stream.offset + stream.size - 1
+        response.headers['Content-Range'] = f'bytes {stream.offset}-{last}/{stream.total_size}'
+        image_proxy.partial += 1
+    _validator_headers(response, stream)
+    await response.prepare(request)
+
+    keep = not stream.partial and stream.size <= min(store.chunk_size, store.max_cache_bytes)
+    chunks = []
+    async for chunk in stream.chunks():
+        await response.write(chunk)
+        image_proxy.streamed_bytes += len(chunk)
+        if keep:
+            chunks.append(chunk)
+    await response.write_eof()
+    if keep:
+        await store.put(filename, StoredImage(b"".join(chunks), stream.content_type,
+                                              etag=stream.etag, last_modified=stream.last_modified))
+    return response
+
+
+def _derivative_request(request: web.Request) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """
+    Requested width and quality from the w and q query parameters, None when neither is given.
+
+    Raises:
+        ValueError: If a parameter is not a positive integer
+    """
+    width, quality = request.query.get('w'), request.query.get('q')
+    if width is None and quality is None:
+        return None
+    width = int(width) if width is not None else None
+    quality = int(quality) if quality is not None else None
+    if (width is not None and width < 1) or (quality is not None and not 1 <= quality <= 100):
+        raise ValueError("w must be a positive width and q a quality between 1 and 100")
+    return width, quality
+
+
+def _not_found_response() -> web.Response:
+    return web.Response(text="Image not found", status=404, headers={
+        'Cache-Control': f'public, max-age={image_proxy.store.not_found_max_age}',
+        'Access-Control-Allow-Origin': '*'
+    })
+
+
 async def serve_product_image(request):
-    """Serve product image through authenticated proxy."""
+    """
+    Serve product image through authenticated proxy.
+
+    Images carry the blob's strong ETag and Last-Modified, so browsers revalidate with a
+    conditional request and get a 304 without the body. Byte ranges are answered with 206, unless
+    an If-Range validator no longer matches and the whole image is sent.
+    Cached images are served from memory or disk, others are streamed from Blob Storage. With the
+    local image backend the files are sent as they are (sendfile), FileResponse handling the
+    validators and ranges.
+
+    With ?w= (width) and/or ?q= (quality) a resized derivative is served instead, as AVIF or WebP
+    when the Accept header allows; both are snapped to the allowed derivative sizes.
+    """
     product_id = request.match_info.get('product_id')
     filename = request.match_info.get('filename')
-    
+
     if not product_id or not filename:
         return web.Response(text="Missing product_id or filename", status=400)
-    
+
     # Security: basic validation
     if '..' in filename or '/' in filename:
         return web.Response(text="Invalid filename", status=400)
-    
-    content, content_type = await image_proxy.get_blob_stream(product_id, filename)
-    
-    if content is None:
-        return web.Response(text="Image not found", status=404)
-    
-    # Return image with appropriate headers
-    return web.Response(
-        body=content,
-        content_type=content_type,
-        headers={
-            'Cache-Control': 'public, max-age=3600',  # Cache for 1 hour
-            'Access-Control-Allow-Origin': '*'  # Allow frontend access
-        }
-    )
+
+    try:
+        derivative = _derivative_request(request)
+    except ValueError:
+        return web.Response(text="Invalid w or q parameter", status=400)
+
+    image_proxy.requests += 1
+    byte_range = _requested_range(request)
+    headers = {
+        'Cache-Control': 'public, max-age=3600',  # Cache for 1 hour
+        'Access-Control-Allow-Origin': '*',  # Allow frontend access
+        'Accept-Ranges': 'bytes'
+    }
+
+    if derivative is not None:
+        width, quality = derivative
+        try:
+            image = await image_proxy.derivatives.get(filename, width, quality, request.headers.get('Accept', ''))
+        except ImageProcessingError as e:
+            logger.warning(f"Serving original of {filename}, resizing failed: {e}")
+        else:
+            if image is None:
+                return _not_found_response()
+            return _cached_response(request, image, byte_range, {**headers, 'Vary': 'Accept'})
+
+    store = image_proxy.store
+    if store.serves_files:
+        path = await store.file_path(filename)
+        if path is None:
+            return _not_found_response()
+        image_proxy.files_served += 1
+        return web.FileResponse(path, chunk_size=store.chunk_size,
+                                headers={**headers, 'Content-Type': image_content_type(path)})
+
+    if store.streams(filename):
+        return await _streamed_response(request, store, filename, byte_range, headers)
+
+    image = await image_proxy.get_image(filename)
+    if image is None:
+        return _not_found_response()
+    return _cached_response(request, image, byte_range, headers)
+
+
+async def image_metrics_handler(request):
+    """Image proxy conditional responses and image cache hit ratios."""
+    return web.json_response(image_proxy.metrics())
+
 
 def setup_image_routes(app):
     """Add image proxy routes to the app."""
+    app.router.add_get('/api/images/metrics', image_metrics_handler)
     app.router.add_get('/api/images/{product_id}/{filename}', serve_product_image)
-    
+
     # Cleanup on app shutdown
     async def cleanup_image_proxy(app):
         await image_proxy.cleanup()
-    
-    app.on_cleanup.append(cleanup_image_proxy)
\ No newline at end of file
+
+    app.on_cleanup.append(cleanup_image_proxy)
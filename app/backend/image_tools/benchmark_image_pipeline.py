@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the try-on image preprocessing pipeline.
+Compares the legacy validate + preprocess path (two decodes) with the single-decode pipeline,
+in-process and in the process pool, on synthetic phone photos.
+
+Usage:
+    python3 image_tools/benchmark_image_pipeline.py --images 24 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+# Add the backend directory to the path so we can import our modules
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from PIL import Image
+
+from image_tools import image_pipeline
+
+
+def make_phone_photo(width: int = 4032, height: int = 3024, seed: int = 0) -> bytes:
+    """Create a noisy JPEG resembling a phone photo (noise defeats trivial compression)."""
+    noise = Image.effect_noise((width // 4, height // 4), 64 + seed % 32).convert("RGB")
+    img = noise.resize((width, height), Image.Resampling.BILINEAR)
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def legacy_preprocess(image_data: bytes) -> bytes:
+    """The previous path: validate (decode 1) then preprocess (decode 2) at full resolution."""
+    img = Image.open(BytesIO(image_data))
+    img.load()
+    img = Image.open(BytesIO(image_data)).convert("RGB")
+    ratio = 1024 / max(img.size)
+    img = img.resize(tuple(int(dim * ratio) for dim in img.size), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(name: str, elapsed: float, latencies) -> None:
+    print(f"{name:<28} {len(latencies) / elapsed:8.1f} img/s   "
+          f"p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:7.1f} ms")
+
+
+def run_sequential(name: str, func, images) -> None:
+    latencies = []
+    started = time.perf_counter()
+    for data in images:
+        t0 = time.perf_counter()
+        func(data)
+        latencies.append(time.perf_counter() - t0)
+    report(name, time.perf_counter() - started, latencies)
+
+
+async def run_concurrent(name: str, submit, images) -> None:
+    async def timed(data):
+        t0 = time.perf_counter()
+        await submit(data)
+        return time.perf_counter() - t0
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(data) for data in images))
+    report(name, time.perf_counter() - started, latencies)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark try-on image preprocessing")
+    parser.add_argument("--images", type=int, default=24, help="Number of photos to process")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Process pool size")
+    args = parser.parse_args()
+
+    os.environ["IMAGE_PROCESS_WORKERS"] = str(args.workers)
+    print(f"Generating {args.images} synthetic 4032x3024 phone photos...")
+    images = [make_phone_photo(seed=i) for i in range(args.images)]
+    print(f"Average photo size: {sum(map(len, images)) / len(images) / 1024:.0f} KB\n")
+
+    run_sequential("legacy (2 decodes)", legacy_preprocess, images)
+    run_sequential("pipeline (1 decode)", image_pipeline.process_image, images)
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=args.workers) as threads:
+        await run_concurrent(f"legacy, {args.workers} threads",
+                             lambda data: loop.run_in_executor(threads, legacy_preprocess, data), images)
+
+    # Warm the pool so worker start-up is not measured
+    await asyncio.gather(*(image_pipeline.process_image_async(images[0]) for _ in range(args.workers)))
+    await run_concurrent(f"pipeline, {args.workers} processes", image_pipeline.process_image_async, images)
+    image_pipeline.shutdown_executor()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Load benchmark of the virtual try-on pipeline without Vertex AI.
+Simulated users each run a realtime session and call the virtual_try_on tool one after another;
+each call goes through the job queue, the garment cache, the product image fetch, preprocessing,
+admission control and generation on the local try-on backend, and is timed until its job finishes.
+Reports throughput, p50/p99 latency and memory.
+
+Usage:
+    python3 image_tools/benchmark_tryon_pipeline.py --users 16 --requests 4 --latency-ms 800
+"""
+
+import argparse
+import asyncio
+import base64
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+# Add the backend directory to the path so we can import our modules
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from PIL import Image
+
+import ragtools
+from conversation_context import ConversationContext
+from image_tools.image_pipeline import get_executor, shutdown_executor
+from rtmt import RTSession, current_session
+from services.admission import AdmissionController
+from services.garment_cache import GarmentCache
+from services.tryon_backends import LocalTryOnBackend, parse_size
+from services.tryon_jobs import SUCCEEDED, TryOnJobQueue
+from services.tryon_result_cache import TryOnResultCache
+from services.tryon_result_store import TryOnResultStore
+from services.virtual_tryon_service import VirtualTryOnService
+
+
+def make_photo(seed: int, width: int = 3024, height: int = 4032) -> bytes:
+    """A noisy JPEG the size of a phone photo, different for every user."""
+    noise = Image.effect_noise((width // 8, height // 8), 40 + seed % 40).convert("RGB")
+    img = noise.resize((width, height), Image.Resampling.BILINEAR)
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def make_garment(seed: int) -> bytes:
+    img = Image.new("RGBA", (1200, 1600), (0, 0, 0, 0))
+    img.paste((40 * seed % 255, 90, 160, 255), (200, 200, 1000, 1400))
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class CatalogImages:
+    """Stands in for ImageService.get_product_image, serving synthetic garments after a fetch delay."""
+
+    def __init__(self, products: int, fetch_seconds: float):
+        self.images = {f"CLO{i:03d}": make_garment(i) for i in range(1, products + 1)}
+        self.fetch_seconds = fetch_seconds
+        self.fetches = 0
+
+    async def get_product_image(self, product_id: str):
+        self.fetches += 1
+        await asyncio.sleep(self.fetch_seconds)
+        return self.images.get(product_id)
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_user(user: int, requests: int, photo: bytes, product_ids, queue: TryOnJobQueue,
+                   images: CatalogImages, latencies, failures) -> None:
+    current_session.set(RTSession(f"bench-user-{user:04d}", ConversationContext()))
+    user_image = base64.b64encode(photo).decode("ascii")
+    for request in range(requests):
+        product_id = product_ids[(user + request) % len(product_ids)]
+        started = time.perf_counter()
+        result = await ragtools._virtual_try_on_tool({"product_id": product_id, "user_image": user_image}, images)
+        if result.is_error:
+            failures.append(result.text["error"])
+            continue
+        job = await queue.wait(result.text["job_id"])
+        if job.status == SUCCEEDED:
+            latencies.append(time.perf_counter() - started)
+        else:
+            failures.append(job.error)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the try-on pipeline on the local backend")
+    parser.add_argument("--users", type=int, default=16, help="Concurrent users")
+    parser.add_argument("--requests", type=int, default=4, help="Try-ons per user")
+    parser.add_argument("--products", type=int, default=8, help="Distinct garments")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Synthetic generation latency")
+    parser.add_argument("--jitter-ms", type=float, default=400, help="Synthetic latency jitter")
+    parser.add_argument("--fetch-ms", type=float, default=50, help="Product image fetch latency")
+    parser.add_argument("--output-size", default="768x1024", help="Generated image size")
+    parser.add_argument("--workers", type=int, default=8, help="Try-on job workers")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Generations in flight")
+    parser.add_argument("--cache", action="store_true", help="Serve repeated try-ons from the result cache")
+    args = parser.parse_args()
+
+    print(f"Preparing {args.users} user photos and {args.products} garments...")
+    photos = [make_photo(user) for user in range(args.users)]
+    images = CatalogImages(args.products, args.fetch_ms / 1000)
+    product_ids = list(images.images)
+
+    with tempfile.TemporaryDirectory() as results_dir:
+        store = TryOnResultStore(results_dir)
+        service = VirtualTryOnService(
+            result_store=store,
+            result_cache=TryOnResultCache(store) if args.cache else None,
+            admission=AdmissionController(max_concurrent=args.max_concurrency, max_per_session=2,
+                                          max_waiting=args.users * 2),
+            backend=LocalTryOnBackend(args.latency_ms / 1000, args.jitter_ms / 1000, parse_size(args.output_size))
+        )
+        queue = TryOnJobQueue(workers=args.workers, max_depth=args.users * 2, admission=service.admission)
+        # Run the tool on this harness's service, queue and garment cache
+        ragtools.virtual_tryon_service = service
+        ragtools.tryon_job_queue = queue
+        ragtools.garment_cache = GarmentCache()
+
+        get_executor()
+        latencies, failures = [], []
+        tracemalloc.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(user, args.requests, photos[user], product_ids, queue, images, latencies, failures)
+            for user in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await queue.stop()
+        shutdown_executor()
+
+        print(f"\nBackend: local, {args.latency_ms:.0f}+{args.jitter_ms:.0f} ms, {args.output_size}; "
+              f"{args.workers} job workers, {args.max_concurrency} generations in flight")
+        print(f"Users: {args.users} x {args.requests} try-ons, result cache {'on' if args.cache else 'off'}\n")
+        if latencies:
+            print(f"Completed        {len(latencies):8d}   failed {len(failures)}")
+            print(f"Throughput       {len(latencies) / elapsed:8.2f} try-ons/s")
+            print(f"Latency p50      {statistics.median(latencies) * 1000:8.0f} ms")
+            print(f"Latency p99      {percentile(latencies, 99) * 1000:8.0f} ms")
+        else:
+            print(f"All {len(failures)} try-ons failed: {failures[:3]}")
+        print(f"Peak traced      {peak / 1024 / 1024:8.1f} MB (event loop process)")
+        print(f"Max RSS          {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.1f} MB")
+        garments = ragtools.garment_cache.metrics()
+        print(f"Product fetches  {images.fetches:8d}   garment cache hits {garments['hits']}, misses {garments['misses']}")
+        print(f"Queue wait       {queue.metrics()['queue_wait_seconds']} s")
+        if failures:
+            print(f"Failures: {sorted(set(failures))[:3]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Peak memory of reading a try-on photo upload.
+Compares the JSON body with person_image_base64 against streamed multipart and raw binary
+uploads, measuring the peak traced allocation (tracemalloc) while each request is read.
+
+Usage:
+    python3 image_tools/benchmark_upload_memory.py --megabytes 8
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+# Add the backend directory to the path so we can import our modules
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from services.image_upload import read_image_upload
+
+
+def make_photo(megabytes: float) -> bytes:
+    """Create a JPEG of roughly the requested size (noise keeps it from compressing)."""
+    side = 1500
+    while True:
+        buffer = BytesIO()
+        Image.effect_noise((side, side), 80).convert("RGB").save(buffer, format="JPEG", quality=95)
+        if buffer.tell() >= megabytes * 1024 * 1024 or side >= 7000:
+            return buffer.getvalue()
+        side = int(side * 1.25)
+
+
+def measured(read):
+    """Wrap a body reader in a handler that reports the peak memory of reading the request."""
+    async def handler(request):
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        image = await read(request)
+        _, peak = tracemalloc.get_traced_memory()
+        return web.json_response({"bytes": len(image), "peak": peak - start})
+    return handler
+
+
+async def read_json_base64(request):
+    data = await request.json()
+    return base64.b64decode(data["person_image_base64"])
+
+
+async def read_streamed(request):
+    image, _ = await read_image_upload(request)
+    return image
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure upload peak memory")
+    parser.add_argument("--megabytes", type=float, default=8, help="Approximate photo size")
+    args = parser.parse_args()
+
+    photo = make_photo(args.megabytes)
+    print(f"Photo: {len(photo) / 1024 / 1024:.1f} MB\n")
+
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app.router.add_post("/json", measured(read_json_base64))
+    app.router.add_post("/stream", measured(read_streamed))
+
+    json_body = json.dumps({"product_id": "CLO001", "person_image_base64": base64.b64encode(photo).decode()})
+    tracemalloc.start()
+    async with TestClient(TestServer(app)) as client:
+        form = aiohttp.FormData()
+        form.add_field("product_id", "CLO001")
+        form.add_field("person_image", photo, filename="photo.jpg", content_type="image/jpeg")
+        requests = [
+            ("JSON + base64", client.post("/json", data=json_body, headers={"Content-Type": "application/json"})),
+            ("multipart/form-data", client.post("/stream", data=form)),
+            ("raw binary", client.post("/stream?product_id=CLO001", data=photo, headers={"Content-Type": "image/jpeg"})),
+        ]
+        for name, request in requests:
+            async with request as response:
+                result = await response.json()
+            print(f"{name:<22} peak {result['peak'] / 1024 / 1024:7.1f} MB   "
+                  f"({result['peak'] / result['bytes']:.1f}x photo size)")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Precompute resized variants of every product image at ingest time.
+
+Each product image in data/images is encoded at a fixed set of widths and formats in a process
+pool (one decode per image), the variants are written next to the original and uploaded to the
+product image container (or the local image directory), and recorded in data/clothing_data.json as the product's image_variants
+so ImageService can emit srcset URLs. Re-index the products afterwards (index_manager.py).
+
+Runs are incremental: a manifest keyed by image records the sha256 of the original and the
+variant settings, and unchanged images are skipped.
+
+Usage:
+    python3 image_tools/generate_image_variants.py --widths 320,640,960 --formats avif,webp
+    python3 image_tools/generate_image_variants.py --no-upload --force
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+# Add the backend directory to the path so we can import our modules
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from azure.storage.blob import ContentSettings
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from image_tools import image_pipeline
+from image_tools.image_store import image_store
+from image_tools.image_utils import VARIANT_MIME_TYPES, VARIANT_WIDTHS, variant_filename
+
+data_dir = backend_dir.parent.parent / "data"
+
+MANIFEST_NAME = "variants_manifest.json"
+
+
+def settings_key(widths: List[int], formats: List[str], quality: int) -> str:
+    """Variant settings an image was processed with, a change re-processes every image."""
+    return f"{','.join(map(str, sorted(widths)))}|{','.join(sorted(formats))}|q{quality}"
+
+
+def load_manifest(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+async def upload_variant(filename: str, data: bytes, content_type: str) -> None:
+    if image_store.backend == "local":
+        # The local backend serves the files of its directory, usually the images directory itself
+        path = image_store.directory / filename
+        if not path.exists() or path.read_bytes() != data:
+            await asyncio.to_thread(path.write_bytes, data)
+        return
+    blob_client = image_store.client.get_blob_client(container=image_store.container, blob=filename)
+    await blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type=content_type))
+
+
+async def process_image(image_path: Path, widths: List[int], formats: List[str], quality: int,
+                        upload: bool) -> List[Dict[str, Any]]:
+    """Encode, write and upload the variants of one image, returns their records."""
+    derivatives = await image_pipeline.run_in_pool(
+        image_pipeline.encode_derivatives, image_path.read_bytes(), widths, [f.upper() for f in formats], quality
+    )
+    records = []
+    for derivative in derivatives:
+        fmt = derivative.format.lower()
+        filename = variant_filename(image_path.name, derivative.width, fmt)
+        (image_path.parent / filename).write_bytes(derivative.data)
+        if upload:
+            await upload_variant(filename, derivative.data, VARIANT_MIME_TYPES[fmt])
+        records.append({"image": image_path.name, "file": filename, "width": derivative.width, "format": fmt})
+    return records
+
+
+async def generate_variants(args: argparse.Namespace) -> bool:
+    widths = [int(w) for w in args.widths.split(",") if w.strip()]
+    formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    if "avif" in formats and not image_pipeline.AVIF_SUPPORTED:
+        print("⚠️  This Pillow build cannot encode AVIF, skipping it")
+        formats.remove("avif")
+    unknown = [f for f in formats if f not in VARIANT_MIME_TYPES]
+    if unknown or not formats or not widths:
+        print(f"❌ Invalid widths or formats: {args.widths} / {args.formats}")
+        return False
+
+    products = json.loads(args.data.read_text(encoding="utf-8"))
+    manifest_path = args.images / MANIFEST_NAME
+    manifest = {} if args.force else load_manifest(manifest_path)
+    key = settings_key(widths, formats, args.quality)
+
+    print("🖼️  Generating product image variants...")
+    print("=" * 60)
+    print(f"Images: {args.images}")
+    print(f"Widths: {widths}  Formats: {formats}  Quality: {args.quality}")
+    print(f"Upload: {'yes' if args.upload else 'no'}")
+
+    # Group by image, so an image shared by several products is processed once
+    todo: Dict[str, Path] = {}
+    skipped = missing = 0
+    for product in products:
+        for image_name in product.get("images", []):
+            image_path = args.images / image_name
+            if not image_path.exists():
+                missing += 1
+                continue
+            digest = hashlib.sha256(image_path.read_bytes()).hexdigest()
+            entry = manifest.get(image_name)
+            if entry and entry.get("sha256") == digest and entry.get("settings") == key:
+                skipped += 1
+            else:
+                manifest[image_name] = {"sha256": digest, "settings": key, "variants": None}
+                todo[image_name] = image_path
+
+    print(f"\n📦 {len(todo)} images to process, {skipped} unchanged, {missing} missing locally")
+
+    failed = []
+    if todo:
+        names = list(todo)
+        results = await asyncio.gather(
+            *(process_image(todo[name], widths, formats, args.quality, args.upload) for name in names),
+            return_exceptions=True
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                print(f"  ❌ {name}: {result}")
+                failed.append(name)
+                # Left out of the manifest, so the next run retries it
+                del manifest[name]
+            else:
+                manifest[name]["variants"] = result
+                size = sum((args.images / r["file"]).stat().st_size for r in result)
+                print(f"  ✅ {name}: {len(result)} variants, {size / 1024:.0f} KB")
+        image_pipeline.shutdown_executor()
+        if args.upload:
+            await image_store.close()
+
+    # Record the variants in the product documents
+    for product in products:
+        product["image_variants"] = [
+            variant
+            for image_name in product.get("images", [])
+            for variant in (manifest.get(image_name) or {}).get("variants") or []
+        ]
+    args.data.write_text(json.dumps(products, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n", encoding="utf-8")
+
+    print(f"\n🎉 Done: {len(todo) - len(failed)} processed, {skipped} skipped, {len(failed)} failed")
+    print(f"📝 Recorded image_variants in {args.data}; re-index with: python index_manager.py")
+    return not failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute resized product image variants")
+    parser.add_argument("--data", type=Path, default=data_dir / "clothing_data.json", help="Product documents")
+    parser.add_argument("--images", type=Path, default=data_dir / "images", help="Original product images")
+    parser.add_argument("--widths", default=",".join(map(str, VARIANT_WIDTHS)), help="Comma-separated widths")
+    parser.add_argument("--formats", default="avif,webp", help="Comma-separated formats (avif, webp, jpeg, png)")
+    parser.add_argument("--quality", type=int, default=75, help="Encoder quality")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Process pool size")
+    parser.add_argument("--no-upload", dest="upload", action="store_false", help="Only write variants locally")
+    parser.add_argument("--force", action="store_true", help="Re-process images even if they are unchanged")
+    args = parser.parse_args()
+
+    os.environ["IMAGE_PROCESS_WORKERS"] = str(args.workers)
+    success = asyncio.run(generate_variants(args))
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Resized and re-encoded variants of product images for thumbnails.
+Derivatives are generated in the image process pool from the cached original and kept in
+memory and on disk, keyed by the original's ETag so a new version of a blob replaces them.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config.settings import settings
+from image_tools.image_pipeline import AVIF_SUPPORTED, MIME_TYPES, resize_image, run_in_pool
+from image_tools.image_store import DiskImageCache, ProductImageStore, StoredImage, image_store
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Widths and qualities derivatives are generated at; other requested values are snapped to these
+# so that arbitrary query strings cannot fill the cache
+DEFAULT_WIDTHS = (160, 320, 480, 640, 960, 1280)
+DEFAULT_QUALITIES = (50, 75, 90)
+DEFAULT_QUALITY = 75
+
+
+def _parse_sizes(value: Optional[str], default: Tuple[int, ...]) -> Tuple[int, ...]:
+    if not value:
+        return default
+    return tuple(sorted({int(part) for part in value.split(",") if part.strip()}))
+
+
+class ImageDerivatives:
+    """
+    Derivatives of the images in an image store, at a limited set of widths and qualities.
+
+    The output format is negotiated from the Accept header (AVIF, then WebP, otherwise the
+    original's format). Each derivative is generated once per version of its original, concurrent
+    requests for the same one share the work, and results are kept in a byte-bounded memory LRU
+    backed by an optional disk cache.
+    """
+
+    def __init__(self, store: Optional[ProductImageStore] = None, widths: Iterable[int] = DEFAULT_WIDTHS,
+                 qualities: Iterable[int] = DEFAULT_QUALITIES, default_quality: int = DEFAULT_QUALITY,
+                 max_cache_bytes: int = 32 * 1024 * 1024, disk_cache: Optional[DiskImageCache] = None,
+                 avif: bool = AVIF_SUPPORTED):
+        self.store = store or image_store
+        self.widths = tuple(sorted(widths))
+        self.qualities = tuple(sorted(qualities))
+        self.default_quality = default_quality
+        self.max_cache_bytes = max_cache_bytes
+        self.disk_cache = disk_cache
+        self.avif = avif
+        self._cache: "OrderedDict[str, StoredImage]" = OrderedDict()
+        self._cache_bytes = 0
+        self._pending: SingleFlight[StoredImage] = SingleFlight()
+
+        # Metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.generated = 0
+        self.failures = 0
+
+    def width(self, requested: Optional[int]) -> int:
+        """Smallest allowed width covering the requested one, or the largest allowed width."""
+        for width in self.widths:
+            if requested is not None and width >= requested:
+                return width
+        return self.widths[-1]
+
+    def quality(self, requested: Optional[int]) -> int:
+        """Allowed quality closest to the requested one."""
+        if requested is None:
+            requested = self.default_quality
+        return min(self.qualities, key=lambda quality: (abs(quality - requested), -quality))
+
+    def negotiate_format(self, accept: str, source_content_type: str) -> str:
+        """Best format the client accepts, falling back to the original's format."""
+        accept = accept.lower()
+        if self.avif and "image/avif" in accept:
+            return "AVIF"
+        if "image/webp" in accept:
+            return "WEBP"
+        return "PNG" if source_content_type == MIME_TYPES["PNG"] else "JPEG"
+
+    @staticmethod
+    def key(blob_name: str, width: int, quality: int, target_format: str) -> str:
+        return f"{blob_name}@{width}w-q{quality}.{target_format.lower()}"
+
+    async def get(self, blob_name: str, width: Optional[int] = None, quality: Optional[int] = None,
+                  accept: str = "") -> Optional[StoredImage]:
+        """
+        Derivative of an image for a requested width and quality, snapped to the allowed values.
+
+        Returns:
+            StoredImage with its own ETag, or None if the original does not exist
+
+        Raises:
+            ImageProcessingError: If the original cannot be resized
+        """
+        source = await self.store.get(blob_name)
+        if source is None:
+            return None
+
+        width = self.width(width)
+        quality = self.quality(quality)
+        target_format = self.negotiate_format(accept, source.content_type)
+        key = self.key(blob_name, width, quality, target_format)
+        etag = self._derived_etag(source, width, quality, target_format)
+
+        image = self._cache.get(key)
+        if image is not None and image.etag == etag:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return image
+
+        return await self._pending.run(key, lambda: self._load(key, etag, source, width, quality, target_format))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "generated": self.generated,
+            "failures": self.failures,
+            "cached": len(self._cache),
+            "cache_bytes": self._cache_bytes,
+            "disk_cached": len(self.disk_cache) if self.disk_cache is not None else 0,
+            "widths": list(self.widths),
+            "qualities": list(self.qualities),
+            "avif": self.avif,
+        }
+
+    async def _load(self, key: str, etag: str, source: StoredImage, width: int, quality: int,
+                    target_format: str) -> StoredImage:
+        if self.disk_cache is not None:
+            image = await self.disk_cache.get(key)
+            if image is not None and image.etag == etag:
+                self.disk_hits += 1
+                self._store(key, image)
+                return image
+
+        try:
+            derivative = await run_in_pool(resize_image, source.data, width, target_format, quality)
+        except Exception:
+            self.failures += 1
+            raise
+        self.generated += 1
+        logger.info(f"Generated {key}: {len(source.data)} -> {len(derivative.data)} bytes")
+
+        image = StoredImage(derivative.data, derivative.mime_type, etag=etag, last_modified=source.last_modified)
+        self._store(key, image)
+        if self.disk_cache is not None:
+            await self.disk_cache.put(key, image)
+        return image
+
+    @staticmethod
+    def _derived_etag(source: StoredImage, width: int, quality: int, target_format: str) -> str:
+        source_etag = (source.etag or "").strip('"')
+        return f'"{source_etag}-{width}w-q{quality}-{target_format.lower()}"'
+
+    def _store(self, key: str, image: StoredImage) -> None:
+        previous = self._cache.pop(key, None)
+        if previous is not None:
+            self._cache_bytes -= len(previous.data)
+        if len(image.data) > self.max_cache_bytes:
+            return
+        self._cache[key] = image
+        self._cache_bytes += len(image.data)
+        while self._cache_bytes > self.max_cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted.data)
+
+
+def _disk_cache_from_settings() -> Optional[DiskImageCache]:
+    if not settings.image_derivative_cache_dir:
+        return None
+    return DiskImageCache(settings.image_derivative_cache_dir,
+                          max_bytes=settings.image_derivative_disk_cache_max_mb * 1024 * 1024)
+
+
+# Global instance for easy importing
+image_derivatives = ImageDerivatives(
+    image_store,
+    widths=_parse_sizes(settings.image_derivative_widths, DEFAULT_WIDTHS),
+    qualities=_parse_sizes(settings.image_derivative_qualities, DEFAULT_QUALITIES),
+    max_cache_bytes=settings.image_derivative_cache_max_mb * 1024 * 1024,
+    disk_cache=_disk_cache_from_settings()
+)
@@ -0,0 +1,289 @@
+"""
+Image preprocessing pipeline for virtual try-on.
+Decodes each image once, validates it, applies EXIF orientation, resizes and encodes it,
+running the CPU-heavy work in a shared process pool.
+"""
+
+import asyncio
+import functools
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps, features
+
+from exceptions import ImageProcessingError
+
+# Limits applied to images accepted for try-on
+MAX_IMAGE_SIZE_MB = 10
+MIN_DIMENSION = 200
+MAX_SOURCE_DIMENSION = 8000
+
+# Longest side of images sent to the model
+MAX_OUTPUT_DIMENSION = 1024
+
+# Longest side of the preview variant of try-on results
+PREVIEW_DIMENSION = 384
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "AVIF": "image/avif"}
+
+# AVIF encoding needs a Pillow build with libavif
+AVIF_SUPPORTED = features.check_module("avif")
+
+
+class ProcessedImage:
+    """Encoded image plus the metadata gathered while processing it."""
+
+    def __init__(self, data: bytes, format: str, width: int, height: int,
+                 source_format: Optional[str], source_width: int, source_height: int, source_bytes: int):
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        self.source_format = source_format
+        self.source_width = source_width
+        self.source_height = source_height
+        self.source_bytes = source_bytes
+        self._digest: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the encoded image, computed once (cached images such as garments keep it)."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES.get(self.format, "application/octet-stream")
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "width": self.width,
+            "height": self.height,
+            "bytes": len(self.data),
+            "source_format": self.source_format,
+            "source_width": self.source_width,
+            "source_height": self.source_height,
+            "source_bytes": self.source_bytes,
+        }
+
+
+def sniff_format(image_data: bytes) -> Optional[str]:
+    """Format of encoded image bytes from their file signature, or None if it is not a known one."""
+    if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "WEBP"
+    if image_data[4:8] == b"ftyp" and image_data[8:12] in (b"avif", b"avis"):
+        return "AVIF"
+    return None
+
+
+def inspect_image(image_data: bytes, max_size_mb: int = MAX_IMAGE_SIZE_MB) -> Image.Image:
+    """
+    Open an image and validate its size and dimensions from the header, without decoding pixels.
+
+    Raises:
+        ImageProcessingError: If the image is too large, unreadable or out of range
+    """
+    if len(image_data) > max_size_mb * 1024 * 1024:
+        raise ImageProcessingError(f"Image too large: {len(image_data)} bytes")
+
+    try:
+        img = Image.open(BytesIO(image_data))
+    except Exception as e:
+        raise ImageProcessingError(f"Unreadable image: {e}")
+
+    width, height = img.size
+    if min(width, height) < MIN_DIMENSION or max(width, height) > MAX_SOURCE_DIMENSION:
+        raise ImageProcessingError(f"Image dimensions out of range: {width}x{height}")
+    return img
+
+
+def process_image(
+    image_data: bytes,
+    target_format: str = "JPEG",
+    max_dimension: int = MAX_OUTPUT_DIMENSION,
+    quality: int = 90,
+    max_size_mb: int = MAX_IMAGE_SIZE_MB
+) -> ProcessedImage:
+    """
+    Validate, orient, resize and encode an image with a single decode.
+
+    JPEG sources are decoded directly at a reduced scale (Image.draft) when they are much
+    larger than the output, which skips most of the decode work for phone photos.
+
+    Raises:
+        ImageProcessingError: If the image is invalid or cannot be processed
+    """
+    img = inspect_image(image_data, max_size_mb)
+    source_format = img.format
+    source_width, source_height = img.size
+
+    try:
+        scale = max_dimension / max(img.size)
+        if scale < 1 and img.format == "JPEG":
+            img.draft("RGB", (int(source_width * scale), int(source_height * scale)))
+
+        img = ImageOps.exif_transpose(img)
+
+        if target_format == "PNG":
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if max(img.size) > max_dimension:
+            ratio = max_dimension / max(img.size)
+            img = img.resize(tuple(max(1, int(dim * ratio)) for dim in img.size), Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        if target_format == "PNG":
+            img.save(buffer, format="PNG")
+        else:
+            img.save(buffer, format=target_format, quality=quality)
+    except Exception as e:
+        raise ImageProcessingError(f"Failed to process image: {e}")
+
+    return ProcessedImage(buffer.getvalue(), target_format, img.width, img.height,
+                          source_format, source_width, source_height, len(image_data))
+
+
+def encode_variants(
+    image_data: bytes,
+    target_format: str = "WEBP",
+    quality: int = 85,
+    preview_dimension: int = PREVIEW_DIMENSION,
+    preview_quality: int = 70
+) -> Tuple[ProcessedImage, ProcessedImage]:
+    """
+    Re-encode a generated image at full resolution and as a small preview, with a single decode.
+
+    Returns:
+        Tuple of (full, preview)
+
+    Raises:
+        ImageProcessingError: If the image cannot be decoded or encoded
+    """
+    try:
+        with Image.open(BytesIO(image_data)) as source:
+            source_format = source.format
+            img = source.convert("RGBA" if target_format == "PNG" else "RGB")
+
+        preview = img.copy()
+        preview.thumbnail((preview_dimension, preview_dimension), Image.Resampling.LANCZOS)
+
+        variants = []
+        for variant, variant_quality in ((img, quality), (preview, preview_quality)):
+            buffer = BytesIO()
+            if target_format == "PNG":
+                variant.save(buffer, format="PNG", optimize=True)
+            else:
+                variant.save(buffer, format=target_format, quality=variant_quality)
+            variants.append(ProcessedImage(buffer.getvalue(), target_format, variant.width, variant.height,
+                                           source_format, img.width, img.height, len(image_data)))
+    except Exception as e:
+        raise ImageProcessingError(f"Failed to encode image: {e}")
+
+    return variants[0], variants[1]
+
+
+def resize_image(image_data: bytes, width: int, target_format: str = "WEBP", quality: int = 75) -> ProcessedImage:
+    """
+    Scale an image down to a width and encode it, keeping transparency where the format allows.
+    Images narrower than the width keep their size.
+
+    Raises:
+        ImageProcessingError: If the image cannot be decoded or encoded
+    """
+    return encode_derivatives(image_data, [width], [target_format], quality, upscale=True)[0]
+
+
+def encode_derivatives(
+    image_data: bytes,
+    widths: Iterable[int],
+    formats: Iterable[str],
+    quality: int = 75,
+    upscale: bool = False
+) -> List[ProcessedImage]:
+    """
+    Encode an image at several widths and in several formats with a single decode.
+
+    Widths at or above the image's own width are skipped unless upscale is set, in which case
+    they produce the image at its own size.
+
+    Returns:
+        One ProcessedImage per width and format, widths in ascending order
+
+    Raises:
+        ImageProcessingError: If the image cannot be decoded or encoded
+    """
+    widths, formats = sorted(set(widths)), list(formats)
+    try:
+        img = Image.open(BytesIO(image_data))
+        source_format = img.format
+        source_width, source_height = img.size
+
+        scale = widths[-1] / source_width
+        if scale < 1 and img.format == "JPEG":
+            img.draft("RGB", (widths[-1], int(source_height * scale)))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+
+        derivatives = []
+        for width in widths:
+            if width >= img.width and not upscale:
+                continue
+            resized = img
+            if img.width > width:
+                resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+            for target_format in formats:
+                variant = resized.convert("RGB") if target_format == "JPEG" and resized.mode != "RGB" else resized
+                buffer = BytesIO()
+                if target_format == "PNG":
+                    variant.save(buffer, format="PNG", optimize=True)
+                else:
+                    variant.save(buffer, format=target_format, quality=quality)
+                derivatives.append(ProcessedImage(buffer.getvalue(), target_format, variant.width, variant.height,
+                                                  source_format, source_width, source_height, len(image_data)))
+    except Exception as e:
+        raise ImageProcessingError(f"Failed to resize image: {e}")
+
+    return derivatives
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Shared process pool for image work, sized by IMAGE_PROCESS_WORKERS."""
+    global _executor
+    if _executor is None:
+        workers = int(os.environ.get("IMAGE_PROCESS_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Run a picklable function in the image process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def process_image_async(image_data: bytes, target_format: str = "JPEG", **kwargs) -> ProcessedImage:
+    """Process an image in the shared process pool, keeping the event loop free."""
+    return await run_in_pool(process_image, image_data, target_format, **kwargs)
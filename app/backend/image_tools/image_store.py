@@ -0,0 +1,626 @@
+"""
+Shared product image access for Zalanko.
+One pooled blob client and one two-tier cache (memory, then local disk) serve the image proxy
+route, the image service and the virtual try-on path, all in-process. Alternatively images are
+read from a local directory (IMAGE_STORAGE_BACKEND=local), for offline use and edge deployments.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Protocol
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+from azure.identity.aio import DefaultAzureCredential
+from azure.storage.blob.aio import BlobServiceClient
+
+from config.settings import settings
+from single_flight import SingleFlight
+
+logger = logging.getLogger("image_store")
+
+# Returned by a conditional download when the cached copy is still current
+NOT_MODIFIED = object()
+
+# Product images shipped with the repo, served by the local backend by default
+DEFAULT_LOCAL_IMAGE_DIR = Path(__file__).resolve().parents[3] / "data" / "images"
+
+IMAGE_CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".gif": "image/gif",
+}
+
+
+def image_content_type(path: Path) -> str:
+    """Content type of an image file returned by file_path()."""
+    return IMAGE_CONTENT_TYPES[path.suffix.lower()]
+
+
+# Size of each GET of a blob, the first one included, which bounds how much of a streamed image is
+# held in memory at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class StoredImage:
+    """Image bytes with the blob properties needed to serve them."""
+
+    def __init__(self, data: bytes, content_type: str, etag: Optional[str] = None, last_modified=None,
+                 checked_at: Optional[float] = None):
+        self.data = data
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        # When the blob was last confirmed to be this version
+        self.checked_at = checked_at if checked_at is not None else time.time()
+
+
+class BlobStream:
+    """
+    A blob download in progress, read chunk by chunk.
+    Content type, length and validators come from the download response itself.
+    """
+
+    def __init__(self, downloader, offset: int = 0):
+        properties = downloader.properties
+        self.content_type = properties.content_settings.content_type or "image/jpeg"
+        self.etag = properties.etag
+        self.last_modified = properties.last_modified
+        self.offset = offset
+        # Bytes in this download, the requested range or the whole blob
+        self.size = downloader.size
+        self.total_size = int(properties.content_range.rsplit("/", 1)[-1]) if properties.content_range else self.size
+        self._downloader = downloader
+
+    @property
+    def partial(self) -> bool:
+        return self.size != self.total_size
+
+    def chunks(self) -> AsyncIterator[bytes]:
+        return self._downloader.chunks()
+
+
+class ProductImageStore(Protocol):
+    """What the image proxy, derivatives and image service need from an image store."""
+
+    backend: str
+    storage_account: str
+    container: str
+    chunk_size: int
+    # Whether images are files the proxy sends as they are, found with file_path()
+    serves_files: bool
+    # How long clients may cache a 404 for a missing image
+    not_found_max_age: int
+
+    async def get(self, blob_name: str) -> Optional[StoredImage]: ...
+
+    async def file_path(self, blob_name: str) -> Optional[Path]: ...
+
+    def streams(self, blob_name: str) -> bool: ...
+
+    async def get_product_image(self, product_id: str) -> Optional[StoredImage]: ...
+
+    def invalidate(self, blob_name: Optional[str] = None) -> None: ...
+
+    def metrics(self) -> Dict[str, Any]: ...
+
+    async def close(self) -> None: ...
+
+
+class DiskEntry:
+    def __init__(self, key: str, etag: Optional[str], content_type: str, last_modified: Optional[datetime],
+                 size: int, checked_at: float):
+        self.key = key
+        self.etag = etag
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.size = size
+        self.checked_at = checked_at
+
+
+class DiskImageCache:
+    """
+    Product images on local disk, keyed by blob name and ETag, bounded by bytes in LRU order.
+
+    Each image is written once as <key>.img next to a <key>.json with its blob properties, where
+    the key is derived from the blob name and ETag; a new version of a blob gets a new key and
+    replaces the old files. The index is rebuilt from the metadata files on startup.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, DiskEntry]" = OrderedDict()
+        self._bytes = 0
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, blob_name: str) -> bool:
+        return blob_name in self._index
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    @staticmethod
+    def key(blob_name: str, etag: Optional[str]) -> str:
+        return hashlib.sha256(f"{blob_name}|{etag}".encode("utf-8")).hexdigest()
+
+    async def get(self, blob_name: str) -> Optional[StoredImage]:
+        entry = self._index.get(blob_name)
+        if entry is None:
+            return None
+        self._index.move_to_end(blob_name)
+        try:
+            data = await asyncio.to_thread((self.directory / f"{entry.key}.img").read_bytes)
+        except OSError as e:
+            logger.warning(f"Dropping unreadable cached image {blob_name}: {e}")
+            self._forget(blob_name)
+            return None
+        return StoredImage(data, entry.content_type, entry.etag, entry.last_modified, entry.checked_at)
+
+    async def put(self, blob_name: str, image: StoredImage) -> None:
+        if len(image.data) > self.max_bytes:
+            return
+        stale = [self._forget(blob_name)]
+        entry = DiskEntry(self.key(blob_name, image.etag), image.etag, image.content_type, image.last_modified,
+                          len(image.data), image.checked_at)
+        self._index[blob_name] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            stale.append(self._forget(next(iter(self._index))))
+        try:
+            await asyncio.to_thread(self._write, blob_name, entry, image.data, [e for e in stale if e is not None])
+        except OSError as e:
+            logger.warning(f"Failed to cache image {blob_name} on disk: {e}")
+            if self._index.get(blob_name) is entry:
+                self._forget(blob_name)
+
+    def touch(self, blob_name: str, checked_at: float) -> None:
+        """Record a successful revalidation, kept in memory until the entry is rewritten."""
+        entry = self._index.get(blob_name)
+        if entry is not None:
+            entry.checked_at = checked_at
+
+    async def remove(self, blob_name: str) -> None:
+        entry = self._forget(blob_name)
+        if entry is not None:
+            await asyncio.to_thread(self._delete, [entry])
+
+    def _forget(self, blob_name: str) -> Optional[DiskEntry]:
+        entry = self._index.pop(blob_name, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _write(self, blob_name: str, entry: DiskEntry, data: bytes, stale: Iterable[DiskEntry]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "blob_name": blob_name,
+            "etag": entry.etag,
+            "content_type": entry.content_type,
+            "last_modified": entry.last_modified.isoformat() if entry.last_modified else None,
+            "checked_at": entry.checked_at,
+        }
+        for suffix, payload in ((".img", data), (".json", json.dumps(meta).encode("utf-8"))):
+            tmp_path = self.directory / f"{entry.key}{suffix}.{os.getpid()}.tmp"
+            tmp_path.write_bytes(payload)
+            os.replace(tmp_path, self.directory / f"{entry.key}{suffix}")
+        self._delete(e for e in stale if e.key != entry.key)
+
+    def _delete(self, entries: Iterable[DiskEntry]) -> None:
+        for entry in entries:
+            for suffix in (".json", ".img"):
+                try:
+                    (self.directory / f"{entry.key}{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _load_index(self) -> None:
+        if not self.directory.is_dir():
+            return
+        found = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                stat = meta_path.with_suffix(".img").stat()
+                last_modified = meta.get("last_modified")
+                entry = DiskEntry(meta_path.stem, meta.get("etag"), meta.get("content_type") or "image/jpeg",
+                                  datetime.fromisoformat(last_modified) if last_modified else None,
+                                  stat.st_size, meta.get("checked_at", 0.0))
+                found.append((stat.st_mtime, meta["blob_name"], entry))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, blob_name, entry in sorted(found, key=lambda item: item[0]):
+            self._forget(blob_name)
+            self._index[blob_name] = entry
+            self._bytes += entry.size
+        if self._index:
+            logger.info(f"Loaded {len(self._index)} cached product images from {self.directory}")
+
+
+class ImageStore:
+    """
+    Product images in Azure Blob Storage.
+
+    The blob client (and its connection pool) is created on first use and shared by all
+    callers. Downloaded images are kept in a byte-bounded memory LRU backed by a disk cache, and
+    concurrent requests for the same blob share one load. Cached images are served without a
+    round trip for revalidate_seconds; after that a conditional download (If-None-Match) confirms
+    them, and if Blob Storage cannot be reached the cached copy is served as is. Missing blobs are
+    remembered for not_found_ttl_seconds.
+    """
+
+    backend = "azure"
+    serves_files = False
+
+    def __init__(self, storage_account: Optional[str] = None, container: Optional[str] = None,
+                 max_cache_bytes: int = 64 * 1024 * 1024, disk_cache: Optional[DiskImageCache] = None,
+                 revalidate_seconds: float = 300, not_found_ttl_seconds: float = 60,
+                 max_not_found: int = 4096, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.storage_account = storage_account or os.getenv("AZURE_STORAGE_ACCOUNT_NAME", "zalankoimages")
+        self.container = container or os.getenv("AZURE_STORAGE_CONTAINER_NAME", "product-images")
+        self.max_cache_bytes = max_cache_bytes
+        self.disk_cache = disk_cache
+        self.revalidate_seconds = revalidate_seconds
+        self.not_found_ttl_seconds = not_found_ttl_seconds
+        self.max_not_found = max_not_found
+        self.chunk_size = chunk_size
+        self._client: Optional[BlobServiceClient] = None
+        self._credential = None
+        self._cache: "OrderedDict[str, StoredImage]" = OrderedDict()
+        self._cache_bytes = 0
+        # Blob name -> time until which it is known to be missing
+        self._not_found: "OrderedDict[str, float]" = OrderedDict()
+        self._downloads: SingleFlight[Optional[StoredImage]] = SingleFlight()
+
+        # Metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stale_served = 0
+        self.streamed = 0
+
+    @property
+    def client(self) -> BlobServiceClient:
+        if self._client is None:
+            # Use Azure AD authentication
+            self._credential = DefaultAzureCredential()
+            account_url = f"https://{self.storage_account}.blob.core.windows.net"
+            self._client = BlobServiceClient(account_url, credential=self._credential,
+                                             max_single_get_size=self.chunk_size,
+                                             max_chunk_get_size=self.chunk_size)
+        return self._client
+
+    async def get(self, blob_name: str) -> Optional[StoredImage]:
+        """Image stored under a blob name, or None if it does not exist or cannot be fetched."""
+        image = self._cache.get(blob_name)
+        if image is not None and self._is_fresh(image):
+            self._cache.move_to_end(blob_name)
+            self.hits += 1
+            return image
+
+        missing_until = self._not_found.get(blob_name)
+        if missing_until is not None:
+            if missing_until > time.monotonic():
+                self.negative_hits += 1
+                return None
+            del self._not_found[blob_name]
+
+        return await self._downloads.run(blob_name, lambda: self._load(blob_name, image))
+
+    @property
+    def not_found_max_age(self) -> int:
+        return int(self.not_found_ttl_seconds)
+
+    def has(self, blob_name: str) -> bool:
+        """Whether get() can answer from the cache: a cached copy, a known missing blob or a load in flight."""
+        return (blob_name in self._cache or blob_name in self._not_found or blob_name in self._downloads
+                or (self.disk_cache is not None and blob_name in self.disk_cache))
+
+    def streams(self, blob_name: str) -> bool:
+        """Whether a request should be relayed with open_stream() rather than answered by get()."""
+        return not self.has(blob_name)
+
+    async def file_path(self, blob_name: str) -> Optional[Path]:
+        """Blobs are not files."""
+        return None
+
+    async def open_stream(self, blob_name: str, offset: Optional[int] = None, length: Optional[int] = None,
+                          etag: Optional[str] = None, if_match: Optional[str] = None) -> BlobStream:
+        """
+        Start downloading a blob, or a byte range of it, without buffering it.
+        With an ETag the download is conditional and raises ResourceNotModifiedError if it still
+        matches; with if_match it raises ResourceModifiedError unless it still matches.
+
+        Raises:
+            ResourceNotFoundError: If the blob does not exist, it is then remembered as missing
+            ResourceNotModifiedError: If the blob still has the given ETag
+            ResourceModifiedError: If the blob no longer has the if_match ETag
+            HttpResponseError: If the range is not satisfiable or the download fails
+        """
+        blob_client = self.client.get_blob_client(container=self.container, blob=blob_name)
+        if if_match:
+            conditions = {"etag": if_match, "match_condition": MatchConditions.IfNotModified}
+        elif etag:
+            conditions = {"etag": etag, "match_condition": MatchConditions.IfModified}
+        else:
+            conditions = {}
+        try:
+            downloader = await blob_client.download_blob(offset=offset, length=length, **conditions)
+        except ResourceNotFoundError:
+            self._remember_not_found(blob_name)
+            raise
+        self.streamed += 1
+        return BlobStream(downloader, offset or 0)
+
+    async def put(self, blob_name: str, image: StoredImage) -> None:
+        """Cache an image downloaded outside get(), such as a streamed one."""
+        self._not_found.pop(blob_name, None)
+        self._store(blob_name, image)
+        if self.disk_cache is not None:
+            await self.disk_cache.put(blob_name, image)
+
+    async def get_product_image(self, product_id: str) -> Optional[StoredImage]:
+        """Main image of a product."""
+        return await self.get(f"{product_id}.png")
+
+    def invalidate(self, blob_name: Optional[str] = None) -> None:
+        """Drop images from the memory tier, the disk tier revalidates on its next use."""
+        if blob_name is None:
+            self._cache.clear()
+            self._cache_bytes = 0
+            self._not_found.clear()
+        else:
+            self._evict(blob_name)
+            self._not_found.pop(blob_name, None)
+            if self.disk_cache is not None:
+                self.disk_cache.touch(blob_name, 0.0)
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.negative_hits + self.misses
+        return {
+            "backend": self.backend,
+            "entries": len(self._cache),
+            "bytes": self._cache_bytes,
+            "max_bytes": self.max_cache_bytes,
+            "disk_entries": len(self.disk_cache) if self.disk_cache is not None else None,
+            "disk_bytes": self.disk_cache.bytes if self.disk_cache is not None else None,
+            "not_found_entries": len(self._not_found),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "stale_served": self.stale_served,
+            "streamed": self.streamed,
+            "hit_rate": round((self.hits + self.disk_hits + self.negative_hits) / lookups, 3) if lookups else None,
+        }
+
+    async def close(self) -> None:
+        """Close the blob client and its credential."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._credential is not None:
+            await self._credential.close()
+            self._credential = None
+
+    def _is_fresh(self, image: StoredImage) -> bool:
+        return time.time() - image.checked_at < self.revalidate_seconds
+
+    async def _load(self, blob_name: str, cached: Optional[StoredImage]) -> Optional[StoredImage]:
+        """Load a blob through the disk tier, revalidating a stale cached copy."""
+        if cached is None and self.disk_cache is not None:
+            cached = await self.disk_cache.get(blob_name)
+            if cached is not None and self._is_fresh(cached):
+                self.disk_hits += 1
+                self._store(blob_name, cached)
+                return cached
+
+        self.misses += 1
+        try:
+            image = await self._download(blob_name, cached.etag if cached is not None else None)
+        except Exception as e:
+            if cached is None:
+                logger.error(f"Error fetching blob {blob_name}: {e}")
+                return None
+            logger.warning(f"Error revalidating blob {blob_name}, serving the cached copy: {e}")
+            self.stale_served += 1
+            self._store(blob_name, cached)
+            return cached
+
+        if image is NOT_MODIFIED:
+            self.revalidated += 1
+            cached.checked_at = time.time()
+            self._store(blob_name, cached)
+            if self.disk_cache is not None:
+                self.disk_cache.touch(blob_name, cached.checked_at)
+            return cached
+
+        if image is None:
+            self._remember_not_found(blob_name)
+            if self.disk_cache is not None:
+                await self.disk_cache.remove(blob_name)
+            return None
+
+        self._store(blob_name, image)
+        if self.disk_cache is not None:
+            await self.disk_cache.put(blob_name, image)
+        return image
+
+    async def _download(self, blob_name: str, etag: Optional[str] = None):
+        """
+        Download a blob, conditionally when the ETag of a cached copy is given.
+
+        Returns:
+            StoredImage, NOT_MODIFIED if the blob still has the given ETag, or None if it does not exist
+        """
+        blob_client = self.client.get_blob_client(container=self.container, blob=blob_name)
+        try:
+            if etag is not None:
+                downloader = await blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfModified)
+            else:
+                downloader = await blob_client.download_blob()
+            data = await downloader.readall()
+        except ResourceNotModifiedError:
+            return NOT_MODIFIED
+        except ResourceNotFoundError:
+            logger.info(f"Image blob not found: {blob_name}")
+            return None
+        # The download response carries the blob properties, no separate properties request needed
+        properties = downloader.properties
+        return StoredImage(
+            data,
+            properties.content_settings.content_type or "image/jpeg",
+            etag=properties.etag,
+            last_modified=properties.last_modified
+        )
+
+    def _remember_not_found(self, blob_name: str) -> None:
+        self._not_found[blob_name] = time.monotonic() + self.not_found_ttl_seconds
+        self._not_found.move_to_end(blob_name)
+        while len(self._not_found) > self.max_not_found:
+            self._not_found.popitem(last=False)
+
+    def _store(self, blob_name: str, image: StoredImage) -> None:
+        if self._cache.get(blob_name) is image:
+            self._cache.move_to_end(blob_name)
+            return
+        self._evict(blob_name)
+        if len(image.data) > self.max_cache_bytes:
+            return
+        self._cache[blob_name] = image
+        self._cache_bytes += len(image.data)
+        while self._cache_bytes > self.max_cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted.data)
+
+
+    def _evict(self, blob_name: str) -> None:
+        image = self._cache.pop(blob_name, None)
+        if image is not None:
+            self._cache_bytes -= len(image.data)
+
+
+class LocalImageStore:
+    """
+    Product images in a local directory, named like their blobs.
+
+    Reads go through the OS page cache, so there are no cache tiers; the image proxy serves the
+    files themselves with sendfile. ETags are derived from the file's mtime and size the same way
+    aiohttp's FileResponse does, so 304s and derivative ETags agree across both paths.
+    """
+
+    backend = "local"
+    serves_files = True
+    # Missing files may appear at any time
+    not_found_max_age = 0
+
+    def __init__(self, directory=DEFAULT_LOCAL_IMAGE_DIR, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.directory = Path(directory).resolve()
+        self.storage_account = "local"
+        self.container = str(self.directory)
+        self.chunk_size = chunk_size
+
+        # Metrics
+        self.reads = 0
+        self.misses = 0
+
+    async def file_path(self, blob_name: str) -> Optional[Path]:
+        """File holding an image, None if it does not exist, is not an image or lies outside the directory."""
+        return await asyncio.to_thread(self._resolve, blob_name)
+
+    def streams(self, blob_name: str) -> bool:
+        """Files are sent as they are, never streamed."""
+        return False
+
+    @staticmethod
+    def etag(stat: os.stat_result) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    async def get(self, blob_name: str) -> Optional[StoredImage]:
+        """Image stored under a file name, or None if it does not exist."""
+        try:
+            image = await asyncio.to_thread(self._read, blob_name)
+        except OSError as e:
+            logger.warning(f"Failed to read image {blob_name}: {e}")
+            image = None
+        if image is None:
+            self.misses += 1
+            return None
+        self.reads += 1
+        return image
+
+    async def put(self, blob_name: str, image: StoredImage) -> None:
+        """Nothing to cache, the files are the images."""
+
+    async def get_product_image(self, product_id: str) -> Optional[StoredImage]:
+        """Main image of a product."""
+        return await self.get(f"{product_id}.png")
+
+    def invalidate(self, blob_name: Optional[str] = None) -> None:
+        """Nothing is cached."""
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "directory": str(self.directory),
+            "reads": self.reads,
+            "misses": self.misses,
+        }
+
+    async def close(self) -> None:
+        pass
+
+    def _resolve(self, blob_name: str) -> Optional[Path]:
+        path = (self.directory / blob_name).resolve()
+        if self.directory not in path.parents or path.suffix.lower() not in IMAGE_CONTENT_TYPES:
+            return None
+        return path if path.is_file() else None
+
+    def _read(self, blob_name: str) -> Optional[StoredImage]:
+        path = self._resolve(blob_name)
+        if path is None:
+            return None
+        stat = path.stat()
+        return StoredImage(path.read_bytes(), image_content_type(path), etag=self.etag(stat),
+                           last_modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+
+def _disk_cache_from_settings() -> Optional[DiskImageCache]:
+    if not settings.image_disk_cache_dir:
+        return None
+    return DiskImageCache(settings.image_disk_cache_dir, max_bytes=settings.image_disk_cache_max_mb * 1024 * 1024)
+
+
+def _image_store_from_settings() -> ProductImageStore:
+    """Image store of the configured backend (azure or local), tuned from the settings."""
+    chunk_size = settings.image_stream_chunk_kb * 1024
+    if settings.image_storage_backend == "local":
+        return LocalImageStore(settings.local_image_dir or DEFAULT_LOCAL_IMAGE_DIR, chunk_size=chunk_size)
+    return ImageStore(
+        max_cache_bytes=settings.image_cache_max_mb * 1024 * 1024,
+        disk_cache=_disk_cache_from_settings(),
+        revalidate_seconds=settings.image_cache_revalidate_seconds,
+        not_found_ttl_seconds=settings.image_not_found_ttl_seconds,
+        chunk_size=chunk_size
+    )
+
+
+# Global instance shared by the image proxy, the image service and virtual try-on
+image_store = _image_store_from_settings()
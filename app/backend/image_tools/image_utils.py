@@ -2,24 +2,48 @@
 Image utility service for handling product image URLs and Azure Storage integration.
 """
 import os
-import aiohttp
+from pathlib import PurePosixPath
 from typing import List, Dict, Any, Optional
 
+try:
+    from image_tools.image_store import ImageStore, ProductImageStore, image_store
+except ImportError:
+    # Imported as a top-level module by the scripts in this directory
+    from image_store import ImageStore, ProductImageStore, image_store
+
+# Widths of the srcset entries of product images, precomputed by generate_image_variants.py
+VARIANT_WIDTHS = (320, 640, 960)
+
+VARIANT_MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def variant_filename(image_filename: str, width: int, format: str) -> str:
+    """Blob name of a precomputed variant, stored next to its original: CLO001.png -> CLO001@320w.webp"""
+    return f"{PurePosixPath(image_filename).stem}@{width}w.{format.lower()}"
+
 
 class ImageService:
     """Service for converting product image filenames to full Azure Storage URLs."""
     
-    def __init__(self, storage_account: Optional[str] = None, container: Optional[str] = None):
+    def __init__(self, storage_account: Optional[str] = None, container: Optional[str] = None,
+                 store: Optional[ProductImageStore] = None):
         """
         Initialize ImageService with Azure Storage configuration.
         
         Args:
             storage_account: Azure Storage account name
             container: Container name for product images
+            store: Image store used to read image bytes, defaults to the shared store
         """
         self.storage_account = storage_account or os.getenv("AZURE_STORAGE_ACCOUNT_NAME", "zalankoimages")
         self.container = container or os.getenv("AZURE_STORAGE_CONTAINER_NAME", "product-images")
         self.base_url = f"https://{self.storage_account}.blob.core.windows.net/{self.container}"
+        if store is None:
+            same_container = (self.storage_account, self.container) == (image_store.storage_account, image_store.container)
+            # With the local backend every image service reads the same directory
+            shared = same_container or image_store.backend == "local"
+            store = image_store if shared else ImageStore(self.storage_account, self.container)
+        self.image_store = store
         
     def get_image_urls(self, product_id: str, image_filenames: List[str]) -> List[str]:
         """
@@ -42,28 +66,70 @@ class ImageService:
             for filename in image_filenames
             if filename and filename.strip()
         ]
+
+    def get_image_srcsets(self, product_id: str, image_filenames: List[str],
+                          variants: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, str]]:
+        """
+        srcset attribute values for each image, by MIME type.
+
+        Images with precomputed variants (the product's image_variants) get one srcset per
+        variant format. Others get a "default" srcset of resized derivatives (?w=), whose format
+        the image proxy negotiates from the Accept header.
+
+        Args:
+            product_id: Unique product identifier
+            image_filenames: List of image filenames
+            variants: Precomputed variants recorded in the product document
+
+        Returns:
+            List of {mime type or "default": srcset}, parallel to get_image_urls
+        """
+        if not image_filenames or not product_id:
+            return []
+
+        proxy_base = f"{os.getenv('BACKEND_URL', 'http://localhost:8765')}/api/images/{product_id}"
+        srcsets = []
+        for filename in image_filenames:
+            if not filename or not filename.strip():
+                continue
+            by_format: Dict[str, List[str]] = {}
+            for variant in sorted(variants or [], key=lambda v: v.get("width", 0)):
+                if variant.get("image") == filename:
+                    variant_url = f"{proxy_base}/{variant['file']}"
+                    mime_type = VARIANT_MIME_TYPES.get(variant.get("format", ""), "image/*")
+                    by_format.setdefault(mime_type, []).append(f"{variant_url} {variant['width']}w")
+            if not by_format:
+                by_format["default"] = [f"{proxy_base}/{filename}?w={width} {width}w" for width in VARIANT_WIDTHS]
+            srcsets.append({mime_type: ", ".join(entries) for mime_type, entries in by_format.items()})
+        return srcsets
     
     def enhance_product_with_images(self, product: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Add imageUrls field to product data while preserving original images field.
+        Add imageUrls and imageSrcsets fields to product data while preserving original images field.
         
         Args:
             product: Product dictionary from search results
             
         Returns:
-            Enhanced product dictionary with imageUrls field
+            Enhanced product dictionary with imageUrls and imageSrcsets fields
         """
         # Create a copy to avoid mutating the original
         enhanced_product = product.copy()
         
-        # Add imageUrls field if images exist
+        # Add imageUrls and imageSrcsets fields if images exist
         if 'images' in product and product['images']:
             enhanced_product['imageUrls'] = self.get_image_urls(
                 product.get('id', ''), 
                 product['images']
             )
+            enhanced_product['imageSrcsets'] = self.get_image_srcsets(
+                product.get('id', ''),
+                product['images'],
+                product.get('image_variants')
+            )
         else:
             enhanced_product['imageUrls'] = []
+            enhanced_product['imageSrcsets'] = []
             
         return enhanced_product
     
@@ -107,29 +173,11 @@ class ImageService:
         Returns:
             Image bytes if found, None otherwise
         """
-        try:
-            # Use local image proxy service for authenticated access
-            image_filename = f"{product_id}.png"
-            backend_base = os.getenv("BACKEND_URL", "http://localhost:8765")
-            proxy_url = f"{backend_base}/api/images/{product_id}/{image_filename}"
-
-            print(f"🔍 Attempting to fetch image via proxy: {proxy_url}")
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(proxy_url) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        print(f"✅ Successfully fetched image via proxy: {len(image_data)} bytes")
-                        return image_data
-                    else:
-                        print(f"❌ Failed to fetch image via proxy: HTTP {response.status}")
-
-                print(f"❌ No images found for {product_id}")
-                return None
-
-        except Exception as e:
-            print(f"💥 Error fetching product image for {product_id}: {e}")
+        image = await self.image_store.get_product_image(product_id)
+        if image is None:
+            print(f"❌ No images found for {product_id}")
             return None
+        return image.data
 
 
 # Global instance for easy importing
@@ -10,6 +10,7 @@ from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.models import (
     AzureOpenAIParameters,
     AzureOpenAIVectorizer,
+    ComplexField,
     HnswAlgorithmConfiguration,
     HnswParameters,
     SearchableField,
@@ -134,6 +135,17 @@ class IndexManager:
                 filterable=False,
                 facetable=False
             ),
+            # Precomputed resized variants of the images (image_tools/generate_image_variants.py)
+            ComplexField(
+                name="image_variants",
+                collection=True,
+                fields=[
+                    SimpleField(name="image", type="Edm.String"),
+                    SimpleField(name="file", type="Edm.String"),
+                    SimpleField(name="width", type="Edm.Int32"),
+                    SimpleField(name="format", type="Edm.String"),
+                ]
+            ),
 
             # Embedding vector field
             SearchField(
@@ -201,7 +213,9 @@ class IndexManager:
             await self.search_index_client.create_index(self.index)
             print(f"Index '{self.index_name}' created successfully.")
         else:
-            print(f"Index '{self.index_name}' already exists.")
+            # Adds fields introduced since the index was created, such as image_variants
+            await self.search_index_client.create_or_update_index(self.index)
+            print(f"Index '{self.index_name}' already exists, schema updated.")
 
     def _calculate_embedding(self, text: str) -> List[float]:
         response = self.azure_openai_client.embeddings.create(input=text, model=self.embedding_model)
@@ -3,7 +3,9 @@ Improved RAG Tools for Zalanko Fashion Assistant.
 Production-ready implementation with proper error handling, logging, and validation.
 """
 
+import asyncio
 import base64
+import os
 import time
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
@@ -13,20 +15,29 @@ from azure.core.credentials import AzureKeyCredential
 from azure.identity import DefaultAzureCredential
 
 from search_manager import SearchManager
-from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from rtmt import RTMiddleTier, RTSession, Tool, ToolResult, ToolResultDirection, get_current_session
+from services.session_state import session_state_store
+from services.garment_cache import garment_cache
+from services.person_photos import person_photo_store
+from services.tryon_jobs import SUCCEEDED, TryOnJob, tryon_job_queue
+from image_tools.image_pipeline import ProcessedImage
 from utils.logger import get_logger
-from exceptions import ExternalServiceError, VirtualTryOnError
+from exceptions import ExternalServiceError, QueueFullError, VirtualTryOnError
 
-# Import virtual_tryon_service with fallback
+# Import virtual_tryon_service with fallback (also covers missing Google Cloud credentials)
 try:
     from services.virtual_tryon_service import virtual_tryon_service
-except ImportError as e:
+except Exception as e:
     logger = get_logger(__name__)
     logger.warning(f"Virtual try-on service not available: {e}")
     virtual_tryon_service = None
 
 logger = get_logger(__name__)
 
+# Try-on jobs are dispatched within the service's generation caps
+if virtual_tryon_service is not None:
+    tryon_job_queue.set_admission(virtual_tryon_service.admission)
+
 
 async def fetch_image_from_url(url: str) -> bytes:
     """
@@ -262,7 +273,11 @@ _virtual_try_on_schema = {
             },
             "user_image": {
                 "type": "string",
-                "description": "Base64 encoded user image for virtual try-on (optional - if not provided, opens try-on modal)"
+                "description": "Base64 encoded user image for virtual try-on (optional - if not provided, the photo the user already uploaded in this session is used, or the try-on modal opens)"
+            },
+            "photo_id": {
+                "type": "string",
+                "description": "Handle of a photo the user uploaded earlier in this session (optional - defaults to the latest one)"
             }
         },
         "required": ["product_id"],
@@ -270,6 +285,28 @@ _virtual_try_on_schema = {
     }
 }
 
+_resolve_product_reference_schema = {
+    "type": "function",
+    "name": "resolve_product_reference",
+    "description": "Resolve a reference to a product the user has already been shown, such as 'the second one', 'the last one', 'the blue jacket' or 'the Nike one', without searching again. Use this before falling back to a new search.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "ordinal": {
+                "type": "integer",
+                "description": "Position in the latest results, 1-based (e.g. 2 for 'the second one', -1 for 'the last one')"
+            },
+            "color": {"type": "string", "description": "Color mentioned by the user"},
+            "brand": {"type": "string", "description": "Brand mentioned by the user"},
+            "category": {"type": "string", "description": "Category or item type mentioned by the user (e.g. 'jacket')"},
+            "max_price": {"type": "number", "description": "Upper price bound mentioned by the user"},
+            "min_price": {"type": "number", "description": "Lower price bound mentioned by the user"},
+            "keywords": {"type": "string", "description": "Other words describing the product (e.g. 'leather jacket')"}
+        },
+        "additionalProperties": False
+    }
+}
+
 _get_application_state_schema = {
     "type": "function",
     "name": "get_application_state",
@@ -288,6 +325,12 @@ _get_application_state_schema = {
 }
 
 
+def _current_session_id() -> Optional[str]:
+    """Session id of the realtime connection the tool runs for, None outside a realtime session."""
+    rt_session = get_current_session()
+    return rt_session.session_id if rt_session else None
+
+
 def _validate_product_data(product: Dict[str, Any]) -> Dict[str, Any]:
     """Validate and normalize product data."""
     return {
@@ -305,6 +348,7 @@ def _validate_product_data(product: Dict[str, Any]) -> Dict[str, Any]:
         "style_tags": product.get("style_tags", []),
         "ratings": product.get("ratings", {}),
         "images": product.get("images", []),
+        "image_variants": product.get("image_variants") or [],
         "availability": product.get("availability", "")
     }
 
@@ -387,6 +431,10 @@ async def _get_product_details_tool(args: Dict[str, Any]) -> ToolResult:
 
         logger.info(f"Switching main view to product: {product_id}")
 
+        session_id = _current_session_id()
+        if session_id:
+            session_state_store.set_current_product(session_id, product_id)
+
         # Return the product ID in the format that triggers frontend highlighting
         result = {"id": product_id}
 
@@ -411,6 +459,10 @@ async def _add_to_cart_tool(args: Dict[str, Any]) -> ToolResult:
 
         logger.info(f"Adding to cart: {product_id} (size: {size}, color: {color}, qty: {quantity})")
 
+        session_id = _current_session_id()
+        if session_id:
+            session_state_store.add_to_cart(session_id, product_id, size, color, quantity)
+
         result = {
             "action": "add_to_cart",
             "product_id": product_id,
@@ -443,6 +495,10 @@ async def _manage_wishlist_tool(args: Dict[str, Any]) -> ToolResult:
 
         logger.info(f"Managing wishlist: {action} product {product_id}")
 
+        session_id = _current_session_id()
+        if session_id:
+            session_state_store.update_wishlist(session_id, product_id, action)
+
         # Return the product ID in the format frontend expects for favorites
         result = {"favorite_id": product_id}
 
@@ -474,6 +530,10 @@ async def _navigate_page_tool(args: Dict[str, Any]) -> ToolResult:
         mapped_destination = page_mapping.get(destination, destination)
         logger.info(f"Navigating to: {destination} -> {mapped_destination}")
 
+        session_id = _current_session_id()
+        if session_id:
+            session_state_store.set_page(session_id, mapped_destination)
+
         # Return the requested page to navigate to in the format frontend expects
         result = {"navigate_to": mapped_destination}
 
@@ -526,19 +586,184 @@ async def _update_style_preferences_tool(args: Dict[str, Any]) -> ToolResult:
         return ToolResult({"error": f"Failed to update preferences: {str(e)}"}, ToolResultDirection.TO_CLIENT)
 
 
+async def _fetch_clothing_image(product_id: str, image_service=None) -> Union[ProcessedImage, bytes]:
+    """
+    Garment image for a try-on: the preprocessed product image from the garment cache, or the raw
+    test garment when the product image is unavailable.
+    """
+    if not image_service:
+        logger.warning("Image service not available")
+        raise VirtualTryOnError("Image service not configured")
+
+    garment = await garment_cache.get(product_id, image_service.get_product_image)
+    if garment is not None:
+        return garment
+
+    logger.warning(f"Could not fetch image for product {product_id} from blob storage")
+    # Fallback to test image if blob storage fails
+    from pathlib import Path
+    test_image_path = Path(__file__).parent / "tests" / "virtual_tryon_tests" / "data" / "item.png"
+    if not test_image_path.exists():
+        raise VirtualTryOnError(f"Product image not found for {product_id} and no fallback available")
+    with open(test_image_path, "rb") as f:
+        clothing_image_data = f.read()
+    logger.info(f"Fallback: Using test clothing image: {len(clothing_image_data)} bytes")
+    return clothing_image_data
+
+
+async def _run_virtual_try_on(
+    job: TryOnJob,
+    user_image_data: Union[bytes, ProcessedImage],
+    image_service=None,
+    garment: Optional[asyncio.Future] = None
+) -> Dict[str, Any]:
+    """
+    Work function of a try-on job: fetch the garment and generate the try-on image.
+    Batch jobs pass the preprocessed person photo and a garment fetch that is already under way.
+
+    Raises:
+        VirtualTryOnError: If the garment cannot be fetched or generation fails
+    """
+    if virtual_tryon_service is None:
+        logger.error("Virtual try-on service not available")
+        raise VirtualTryOnError("Virtual try-on service is not configured")
+
+    await job.set_progress("fetching_garment", 0.1)
+    try:
+        if garment is not None:
+            clothing_image_data = await garment
+        else:
+            clothing_image_data = await _fetch_clothing_image(job.product_id, image_service)
+    except VirtualTryOnError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to fetch product image: {e}")
+        raise VirtualTryOnError(f"Failed to get product image: {e}")
+
+    await job.set_progress("generating", 0.3)
+    outcome = await virtual_tryon_service.generate(
+        person_image=user_image_data,
+        clothing_image=clothing_image_data,
+        product_info={'id': job.product_id},
+        admission_key=job.admission_key
+    )
+    if outcome.retry_after is not None:
+        raise QueueFullError(f"Virtual try-on is busy, please try again in {outcome.retry_after:.0f} seconds",
+                             retry_after=outcome.retry_after)
+    if not outcome.success:
+        logger.error(f"Virtual try-on failed for product {job.product_id}: {outcome.error}")
+        raise VirtualTryOnError(f"Try-on generation failed: {outcome.error}")
+
+    logger.info(f"Virtual try-on completed successfully for product {job.product_id} (cached: {outcome.cached})")
+    result = {
+        "action": "virtual_try_on_result",
+        "product_id": job.product_id,
+        "job_id": job.id,
+        "cached": outcome.cached,
+        "timestamp": datetime.now().isoformat()
+    }
+    if outcome.result_id is not None:
+        # Stored results are served by URL, with long-lived cache headers
+        backend_base = os.getenv("BACKEND_URL", "http://localhost:8765")
+        result["result_id"] = outcome.result_id
+        result["image_url"] = f"{backend_base}{virtual_tryon_service.result_store.url(outcome.result_id)}"
+        if outcome.preview_id is not None:
+            result["preview_id"] = outcome.preview_id
+            result["preview_url"] = f"{backend_base}{virtual_tryon_service.result_store.url(outcome.preview_id)}"
+    else:
+        # Convert result image bytes to base64 for frontend
+        result["tryon_image"] = base64.b64encode(outcome.image).decode('utf-8')
+        result["tryon_image_type"] = outcome.content_type
+    return result
+
+
+def submit_virtual_try_on(
+    product_id: str,
+    user_image_data: Union[bytes, ProcessedImage],
+    image_service=None,
+    session_id: Optional[str] = None,
+    priority: str = "normal",
+    admission_key: Optional[str] = None
+) -> TryOnJob:
+    """
+    Queue a try-on job and return it immediately.
+
+    Without a session the job is capped under admission_key (e.g. the client address), else on its own.
+
+    Raises:
+        QueueFullError: If the try-on queue is at capacity
+    """
+    return tryon_job_queue.submit(
+        lambda job: _run_virtual_try_on(job, user_image_data, image_service),
+        product_id=product_id, session_id=session_id, priority=priority, admission_key=admission_key
+    )
+
+
+async def submit_virtual_try_on_batch(
+    product_ids: List[str],
+    user_image_data: Union[bytes, ProcessedImage],
+    image_service=None,
+    session_id: Optional[str] = None,
+    priority: str = "normal",
+    admission_key: Optional[str] = None
+) -> List[TryOnJob]:
+    """
+    Queue one try-on job per product for a single person photo.
+
+    The photo is preprocessed once while the garments are fetched concurrently; the jobs then run
+    on the try-on workers, which bound how many generations are in flight.
+
+    Raises:
+        VirtualTryOnError: If the service is not configured or the photo is invalid
+        QueueFullError: If the try-on queue cannot take the whole batch
+    """
+    if virtual_tryon_service is None:
+        logger.error("Virtual try-on service not available")
+        raise VirtualTryOnError("Virtual try-on service is not configured")
+
+    garments = {
+        product_id: asyncio.ensure_future(_fetch_clothing_image(product_id, image_service))
+        for product_id in product_ids
+    }
+    jobs = None
+    try:
+        if isinstance(user_image_data, ProcessedImage):
+            person, error = user_image_data, None
+        else:
+            person, error = await virtual_tryon_service.prepare_person_image(user_image_data)
+        if error:
+            raise VirtualTryOnError(error)
+        jobs = tryon_job_queue.submit_many([
+            (lambda job, garment=garments[product_id]: _run_virtual_try_on(job, person, image_service, garment),
+             product_id)
+            for product_id in product_ids
+        ], session_id=session_id, priority=priority, admission_key=admission_key)
+        return jobs
+    finally:
+        # Garment fetches only outlive this call when their jobs were queued
+        if jobs is None:
+            for garment in garments.values():
+                garment.cancel()
+
+
 async def _virtual_try_on_tool(args: Dict[str, Any], image_service=None) -> ToolResult:
     """
     Virtual try-on tool with proper error handling.
 
+    Generation takes tens of seconds, so the tool only queues a job; progress and the
+    result are pushed to the session's client when the job runs. Without a user_image the
+    photo the session uploaded earlier is used, a new user_image is kept for later try-ons.
+
     Args:
-        args: Arguments containing product_id and optional user_image
+        args: Arguments containing product_id and optional user_image or photo_id
 
     Returns:
-        ToolResult with try-on results or error
+        ToolResult with the queued job or an action for the client
     """
     try:
         product_id = args.get('product_id')
         user_image_b64 = args.get('user_image')
+        session_id = _current_session_id()
 
         if not product_id:
             logger.warning("Product ID not provided for virtual_try_on")
@@ -546,8 +771,9 @@ async def _virtual_try_on_tool(args: Dict[str, Any], image_service=None) -> Tool
 
         logger.info(f"Starting virtual try-on for product: {product_id}")
 
-        if not user_image_b64:
-            # No user image provided, return action to open upload modal
+        person = None if user_image_b64 else person_photo_store.get(session_id, args.get('photo_id'))
+        if not user_image_b64 and person is None:
+            # No user image provided or stored, return action to open upload modal
             logger.info("No user image provided, opening try-on modal")
             result = {
                 "action": "open_virtual_try_on_modal",
@@ -556,72 +782,45 @@ async def _virtual_try_on_tool(args: Dict[str, Any], image_service=None) -> Tool
             }
             return ToolResult(result, ToolResultDirection.TO_CLIENT)
 
-        try:
-            # Decode base64 image
-            user_image_data = base64.b64decode(user_image_b64)
-            logger.info(f"Decoded user image: {len(user_image_data)} bytes")
-        except Exception as e:
-            logger.error(f"Failed to decode user image: {e}")
-            raise VirtualTryOnError(f"Invalid image data: {e}")
-
-        # Process virtual try-on
-        try:
-            if virtual_tryon_service is None:
-                logger.error("Virtual try-on service not available")
-                raise VirtualTryOnError("Virtual try-on service is not configured")
-
-            # Fetch the actual product image from blob storage
+        if virtual_tryon_service is None:
+            logger.error("Virtual try-on service not available")
+            raise VirtualTryOnError("Virtual try-on service is not configured")
+
+        if person is None:
             try:
-                if image_service:
-                    clothing_image_data = await image_service.get_product_image(product_id)
-                    if not clothing_image_data:
-                        logger.warning(f"Could not fetch image for product {product_id} from blob storage")
-                        # Fallback to test image if blob storage fails
-                        from pathlib import Path
-                        test_image_path = Path(__file__).parent / "tests" / "virtual_tryon_tests" / "data" / "item.png"
-                        if test_image_path.exists():
-                            with open(test_image_path, "rb") as f:
-                                clothing_image_data = f.read()
-                            logger.info(f"Fallback: Using test clothing image: {len(clothing_image_data)} bytes")
-                        else:
-                            raise VirtualTryOnError(f"Product image not found for {product_id} and no fallback available")
-                    else:
-                        logger.info(f"Fetched product image from blob storage: {len(clothing_image_data)} bytes")
-                else:
-                    logger.warning("Image service not available")
-                    raise VirtualTryOnError("Image service not configured")
-
-                success, result_image, error = await virtual_tryon_service.generate_virtual_tryon(
-                    person_image=user_image_data,
-                    clothing_image=clothing_image_data,
-                    product_info={'id': product_id}
-                )
+                # Decode base64 image
+                user_image_data = base64.b64decode(user_image_b64)
+                logger.info(f"Decoded user image: {len(user_image_data)} bytes")
             except Exception as e:
-                logger.error(f"Failed to fetch product image: {e}")
-                raise VirtualTryOnError(f"Failed to get product image: {e}")
-
-            if success and result_image:
-                logger.info(f"Virtual try-on completed successfully for product {product_id}")
-
-                # Convert result image bytes to base64 for frontend
-                result_image_b64 = base64.b64encode(result_image).decode('utf-8')
-
-                result = {
-                    "action": "virtual_try_on_result",
-                    "product_id": product_id,
-                    "tryon_image": result_image_b64,
-                    "timestamp": datetime.now().isoformat()
-                }
-
-                return ToolResult(result, ToolResultDirection.TO_CLIENT)
-            else:
-                logger.error(f"Virtual try-on failed for product {product_id}: {error}")
-                raise VirtualTryOnError(f"Try-on generation failed: {error}")
+                logger.error(f"Failed to decode user image: {e}")
+                raise VirtualTryOnError(f"Invalid image data: {e}")
+
+            # Validate and preprocess once, later try-ons of the session reuse the photo
+            person, error = await virtual_tryon_service.prepare_person_image(user_image_data)
+            if error:
+                raise VirtualTryOnError(error)
+            if session_id:
+                try:
+                    person_photo_store.put(session_id, person)
+                except VirtualTryOnError as e:
+                    # The try-on still runs, the photo just has to be sent again next time
+                    logger.warning(f"Person photo not kept for session {session_id}: {e}")
 
-        except Exception as e:
-            logger.error(f"Virtual try-on processing failed: {e}")
-            raise VirtualTryOnError(f"Try-on processing failed: {e}")
+        job = submit_virtual_try_on(product_id, person, image_service,
+                                    session_id=session_id, priority="high")
+        result = {
+            "action": "virtual_try_on_started",
+            "product_id": product_id,
+            "job_id": job.id,
+            "status_url": f"/api/virtual-tryon/jobs/{job.id}",
+            "message": "The try-on is being generated, the result will appear on screen in a few seconds."
+        }
+        return ToolResult(result, ToolResultDirection.TO_CLIENT)
 
+    except QueueFullError as e:
+        logger.warning(f"Virtual try-on queue full: {e}")
+        return ToolResult({"error": f"Virtual try-on is busy, please try again in {e.retry_after:.0f} seconds."},
+                          ToolResultDirection.TO_CLIENT)
     except VirtualTryOnError as e:
         logger.error(f"Virtual try-on tool failed: {e}")
         return ToolResult({"error": str(e)}, ToolResultDirection.TO_CLIENT)
@@ -630,43 +829,135 @@ async def _virtual_try_on_tool(args: Dict[str, Any], image_service=None) -> Tool
         return ToolResult({"error": f"Virtual try-on failed: {str(e)}"}, ToolResultDirection.TO_CLIENT)
 
 
+def _push_try_on_job_events(rtmt: RTMiddleTier):
+    """Build the job listener that pushes try-on progress and results over the realtime websocket."""
+    async def push(job: TryOnJob, event: str) -> None:
+        if not job.session_id:
+            return
+        await rtmt.send_to_client(job.session_id, {
+            "type": "extension.tryon_job",
+            "event": event,
+            "job": job.to_dict(include_result=False)
+        })
+        if job.done:
+            # Tell the assistant so it can acknowledge the outcome, then deliver the outcome to the
+            # client the same way a synchronous tool result is delivered, after that conversation item
+            if job.status == SUCCEEDED:
+                note = f"The virtual try-on of product {job.product_id} is ready and now shown to the user."
+            else:
+                note = f"The virtual try-on of product {job.product_id} failed: {job.error}"
+            item_id = await rtmt.add_system_message(job.session_id, note)
+            await rtmt.send_to_client(job.session_id, {
+                "type": "extension.middle_tier_tool_response",
+                "previous_item_id": item_id,
+                "tool_name": "virtual_try_on",
+                "tool_result": ToolResult(job.result or {
+                    "action": "virtual_try_on_error",
+                    "product_id": job.product_id,
+                    "job_id": job.id,
+                    "error": job.error
+                }, ToolResultDirection.TO_CLIENT).to_text()
+            })
+    return push
+
+
 async def _get_application_state_tool(args: Dict[str, Any]) -> ToolResult:
     """
     Get current application state for AI awareness.
 
-    This tool allows the AI to query the current state of the user's session
-    to stay synchronized with manual actions taken through the UI.
+    The state is kept server-side per session, fed by the shopping tools and by the
+    client's UI state events, so the answer needs no round trip to the user.
 
     Args:
         args: Tool arguments containing optional parameters
 
     Returns:
-        ToolResult with instructions for AI to ask user about current state
+        ToolResult with the current page, product, cart and wishlist
     """
     try:
         include_details = args.get('include_details', False)
 
         logger.info(f"AI querying application state (include_details: {include_details})")
 
-        # Since the backend doesn't have direct access to the frontend state,
-        # inform the AI that it should ask the user about their current state
-        response_text = """I need to check your current application state to give you accurate information. Let me ask you directly:
-
-Could you please tell me:
-1. What page are you currently on? (main catalog, favorites, cart, or messages)
-2. Do you currently have any items in your favorites?
-3. Do you have any items in your shopping cart?
-4. Are you currently viewing a specific product?
-
-This will help me stay synchronized with any changes you've made manually through the interface."""
+        session_id = _current_session_id()
+        if not session_id:
+            return ToolResult("The application state is not available outside a live session.", ToolResultDirection.TO_SERVER)
 
-        return ToolResult(response_text, ToolResultDirection.TO_SERVER)
+        state = session_state_store.get(session_id).to_dict(include_details=include_details)
+        return ToolResult({"application_state": state}, ToolResultDirection.TO_SERVER)
 
     except Exception as e:
         logger.error(f"Get application state tool failed: {e}")
         return ToolResult(f"I encountered an error while trying to check the application state: {str(e)}", ToolResultDirection.TO_SERVER)
 
 
+async def _resolve_product_reference_tool(args: Dict[str, Any]) -> ToolResult:
+    """Resolve ordinal and attribute references against the products already shown in the session."""
+    try:
+        session_id = _current_session_id()
+        if not session_id:
+            return ToolResult({"matches": [], "message": "No products have been shown in this session."}, ToolResultDirection.TO_SERVER)
+
+        index = session_state_store.get(session_id).results
+        latest_ids = {p.id for p in index.latest}
+        matches = index.resolve(
+            ordinal=args.get('ordinal'),
+            color=args.get('color'),
+            brand=args.get('brand'),
+            category=args.get('category'),
+            max_price=args.get('max_price'),
+            min_price=args.get('min_price'),
+            keywords=args.get('keywords')
+        )
+
+        logger.info(f"Resolved product reference {args} to {[m.id for m in matches]}")
+
+        result = {"matches": [dict(m.to_dict(), from_earlier_results=m.id not in latest_ids) for m in matches[:5]]}
+        if not matches:
+            result["message"] = "No shown product matches this reference, ask the user to clarify or search again."
+        elif len(matches) > 1:
+            result["message"] = "Several shown products match, ask the user which one they mean."
+        else:
+            result["message"] = "Use get_product_details with this product id to focus it."
+        return ToolResult(result, ToolResultDirection.TO_SERVER)
+
+    except Exception as e:
+        logger.error(f"Resolve product reference tool failed: {e}")
+        return ToolResult({"error": f"Failed to resolve product reference: {str(e)}"}, ToolResultDirection.TO_SERVER)
+
+
+def _record_shown_products(rt_session: Optional[RTSession], args: Dict[str, Any], result: ToolResult) -> None:
+    """Index search results in the session's result context, including results served from cache."""
+    if rt_session is not None and isinstance(result.text, dict) and isinstance(result.text.get("products"), list):
+        session_state_store.get(rt_session.session_id).results.record_results(result.text["products"])
+
+
+async def _drop_person_photos(rt_session: RTSession) -> None:
+    """Forget the person photos of a session whose websocket closed."""
+    person_photo_store.drop_session(rt_session.session_id)
+
+
+async def _app_state_event_handler(rt_session: RTSession, message: Dict[str, Any]) -> None:
+    """Apply a UI state event sent by the client (extension.app_state) to the session state."""
+    try:
+        session_state_store.apply_ui_event(rt_session.session_id, message)
+    except Exception as e:
+        logger.warning(f"Failed to apply UI state event: {e}")
+
+
+def _products_shown(rt_session: RTSession) -> bool:
+    """
+    Product-specific tools only apply once the session has product ids to act on, from this
+    connection or from the session state it resumed (results, opened product, cart, wishlist).
+    """
+    return session_state_store.get(rt_session.session_id).has_products
+
+
+def _virtual_try_on_available(rt_session: RTSession) -> bool:
+    """Try-on needs a healthy try-on service and a product to try on."""
+    return virtual_tryon_service is not None and _products_shown(rt_session)
+
+
 def attach_rag_tools(
     rtmt: RTMiddleTier,
     credentials: Union[AzureKeyCredential, DefaultAzureCredential],
@@ -693,22 +984,52 @@ def attach_rag_tools(
             except Exception as e:
                 logger.warning(f"Failed to warm up credentials: {e}")
 
-        # Attach tools with error handling for each
+        # Each tool declares its availability policy (None means always offered, so sessions only
+        # receive the schemas that can apply) and how the registry middleware should execute it
         tools_to_attach = [
-            ("search", _search_tool_schema, lambda args: _search_tool(search_manager, image_service, args)),
-            ("get_product_details", _get_product_details_schema, _get_product_details_tool),
-            ("add_to_cart", _add_to_cart_schema, _add_to_cart_tool),
-            ("manage_wishlist", _manage_wishlist_schema, _manage_wishlist_tool),
-            ("navigate_page", _navigate_page_schema, _navigate_page_tool),
-            ("get_recommendations", _get_recommendations_schema, _get_recommendations_tool),
-            ("update_style_preferences", _update_style_preferences_schema, _update_style_preferences_tool),
-            ("virtual_try_on", _virtual_try_on_schema, lambda args: _virtual_try_on_tool(args, image_service)),
-            ("get_application_state", _get_application_state_schema, _get_application_state_tool),
+            ("search", Tool(
+                schema=_search_tool_schema,
+                target=lambda args: _search_tool(search_manager, image_service, args),
+                cacheable=True, cache_key_fields=("query", "filters"), cache_scope="global", cache_ttl=300,
+                idempotent=True, timeout=20, max_concurrency=16, on_result=_record_shown_products,
+                # Image variants and srcsets only matter to the client, they would cost the model tokens
+                model_hidden_fields=("image_variants", "imageSrcsets"))),
+            ("get_product_details", Tool(
+                schema=_get_product_details_schema, target=_get_product_details_tool,
+                is_available=_products_shown, timeout=5)),
+            ("add_to_cart", Tool(
+                schema=_add_to_cart_schema, target=_add_to_cart_tool,
+                is_available=_products_shown, timeout=5)),
+            ("manage_wishlist", Tool(
+                schema=_manage_wishlist_schema, target=_manage_wishlist_tool,
+                is_available=_products_shown, timeout=5)),
+            ("navigate_page", Tool(
+                schema=_navigate_page_schema, target=_navigate_page_tool, timeout=5)),
+            ("get_recommendations", Tool(
+                schema=_get_recommendations_schema, target=_get_recommendations_tool,
+                idempotent=True, timeout=10)),
+            ("update_style_preferences", Tool(
+                schema=_update_style_preferences_schema, target=_update_style_preferences_tool, timeout=5)),
+            # Try-on only queues a job, the generated image is pushed to the client when the job finishes
+            ("virtual_try_on", Tool(
+                schema=_virtual_try_on_schema,
+                target=lambda args: _virtual_try_on_tool(args, image_service),
+                is_available=_virtual_try_on_available, timeout=10)),
+            ("get_application_state", Tool(
+                schema=_get_application_state_schema, target=_get_application_state_tool,
+                timeout=5, destination=ToolResultDirection.TO_SERVER)),
+            ("resolve_product_reference", Tool(
+                schema=_resolve_product_reference_schema, target=_resolve_product_reference_tool,
+                is_available=_products_shown, timeout=5, destination=ToolResultDirection.TO_SERVER)),
         ]
 
-        for tool_name, schema, target_func in tools_to_attach:
+        rtmt.client_event_handlers["extension.app_state"] = _app_state_event_handler
+        rtmt.session_close_handlers.append(_drop_person_photos)
+        tryon_job_queue.listeners.append(_push_try_on_job_events(rtmt))
+
+        for tool_name, tool in tools_to_attach:
             try:
-                rtmt.tools[tool_name] = Tool(schema=schema, target=target_func)
+                rtmt.tools.register(tool_name, tool)
                 logger.debug(f"Successfully attached tool: {tool_name}")
             except Exception as e:
                 logger.error(f"Failed to attach tool {tool_name}: {e}")
@@ -1,40 +1,20 @@
 import asyncio
 import json
 import logging
-from enum import Enum
-from typing import Any, Callable, Optional
+import uuid
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
 
 import aiohttp
 from aiohttp import web
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 
-logger = logging.getLogger("voicerag")
-
-class ToolResultDirection(Enum):
-    TO_SERVER = 1
-    TO_CLIENT = 2
-
-class ToolResult:
-    text: str
-    destination: ToolResultDirection
-
-    def __init__(self, text: str, destination: ToolResultDirection):
-        self.text = text
-        self.destination = destination
-
-    def to_text(self) -> str:
-        if self.text is None:
-            return ""
-        return self.text if type(self.text) == str else json.dumps(self.text)
+from conversation_context import ConversationContext, is_own_item, new_item_id
+from session_tokens import SessionTokens, session_tokens
+from tool_registry import Tool, ToolRegistry, ToolResult, ToolResultDirection
 
-class Tool:
-    target: Callable[..., ToolResult]
-    schema: Any
-
-    def __init__(self, target: Any, schema: Any):
-        self.target = target
-        self.schema = schema
+logger = logging.getLogger("voicerag")
 
 class RTToolCall:
     tool_call_id: str
@@ -44,6 +24,37 @@ class RTToolCall:
         self.tool_call_id = tool_call_id
         self.previous_id = previous_id
 
+class RTSession:
+    """Per-connection state of a realtime session."""
+    session_id: str
+    tools_pending: dict[str, RTToolCall]
+    context: ConversationContext
+    # Names of the tools called so far, used by tool availability policies
+    tools_called: set[str]
+    # Tool set last sent upstream, None until the session has been configured
+    active_tools: Optional[tuple[str, ...]]
+    # Realtime API socket of the session, set while it is connected
+    server_ws: Optional[aiohttp.ClientWebSocketResponse]
+    # Whether a response is being generated, and whether another one was requested meanwhile
+    responding: bool
+    response_requested: bool
+
+    def __init__(self, session_id: str, context: ConversationContext):
+        self.session_id = session_id
+        self.tools_pending = {}
+        self.context = context
+        self.tools_called = set()
+        self.active_tools = None
+        self.server_ws = None
+        self.responding = False
+        self.response_requested = False
+
+# Session of the realtime connection being served, visible to tool targets running on its behalf
+current_session: ContextVar[Optional[RTSession]] = ContextVar("current_session", default=None)
+
+def get_current_session() -> Optional[RTSession]:
+    return current_session.get()
+
 class RTMiddleTier:
     endpoint: str
     deployment: str
@@ -51,7 +62,7 @@ class RTMiddleTier:
     
     # Tools are server-side only for now, though the case could be made for client-side tools
     # in addition to server-side tools that are invisible to the client
-    tools: dict[str, Tool] = {}
+    tools: ToolRegistry
 
     # Server-enforced configuration, if set, these will override the client's configuration
     # Typically at least the model name and system message will be set by the server
@@ -62,12 +73,47 @@ class RTMiddleTier:
     disable_audio: Optional[bool] = None
     voice_choice: Optional[str] = None
     api_version: str = "2024-10-01-preview"
-    _tools_pending = {}
+
+    # Conversation context budget for tool outputs injected by the middle tier, None disables pruning.
+    # The latest outputs and the latest output of each pinned tool are always kept.
+    context_budget_tokens: Optional[int] = None
+    context_keep_recent: int = 2
+    context_pinned_tools: set[str] = set()
+
+    # Handlers for middle-tier extension messages sent by the client (e.g. UI state events),
+    # these messages are consumed here and never forwarded to the realtime API
+    client_event_handlers: dict[str, Callable[[RTSession, dict[str, Any]], Awaitable[None]]] = {}
+
+    # Called when a session's client websocket closes, unless a newer socket took the session over
+    session_close_handlers: list[Callable[[RTSession], Awaitable[None]]] = []
+
+    # Send the full server-side session configuration upstream as soon as the realtime socket is
+    # connected instead of waiting for the client's first session.update
+    send_session_on_connect: bool = False
+
+    # Session ids are generated here, clients resume a session (e.g. after a reconnect) and
+    # identify it on HTTP requests with the token sent to them in an extension.session message
+    session_tokens: SessionTokens
+
+    # Server-enforced session fragments, compiled once per tool set and spliced into client session updates
+    _session_config_key: Optional[tuple] = None
+    _session_fragments: dict[tuple[str, ...], tuple[str, str]]
+    _session_fragment_keys: frozenset[str] = frozenset()
+    # Client websockets and sessions of the connected sessions, for messages pushed outside a tool call
+    _client_sockets: dict[str, web.WebSocketResponse]
+    _sessions: dict[str, RTSession]
     _token_provider = None
 
     def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential, voice_choice: Optional[str] = None):
         self.endpoint = endpoint
         self.deployment = deployment
+        self.tools = ToolRegistry()
+        self._session_fragments = {}
+        self._client_sockets = {}
+        self._sessions = {}
+        self.client_event_handlers = {}
+        self.session_close_handlers = []
+        self.session_tokens = session_tokens
         self.voice_choice = voice_choice
         if voice_choice is not None:
             logger.info("Realtime voice choice set to %s", voice_choice)
@@ -77,7 +123,145 @@ class RTMiddleTier:
             self._token_provider = get_bearer_token_provider(credentials, "https://cognitiveservices.azure.com/.default")
             self._token_provider() # Warm up during startup so we have a token cached when the first request arrives
 
-    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> Optional[str]:
+    def _available_tools(self, rt_session: Optional[RTSession] = None) -> tuple[str, ...]:
+        """Names of the tools the availability policies allow for a session, in registration order."""
+        return tuple(
+            name for name, tool in self.tools.items()
+            if rt_session is None or tool.is_available is None or tool.is_available(rt_session)
+        )
+
+    def _tools_config(self, tool_names: tuple[str, ...]) -> dict[str, Any]:
+        return {
+            "tool_choice": "auto" if len(tool_names) > 0 else "none",
+            "tools": [self.tools[name].schema for name in tool_names]
+        }
+
+    def _session_config(self, tool_names: tuple[str, ...]) -> dict[str, Any]:
+        """Session fields enforced by the server, these override whatever the client sends."""
+        config: dict[str, Any] = {}
+        if self.system_message is not None:
+            config["instructions"] = self.system_message
+        if self.temperature is not None:
+            config["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            config["max_response_output_tokens"] = self.max_tokens
+        if self.disable_audio is not None:
+            config["disable_audio"] = self.disable_audio
+        if self.voice_choice is not None:
+            config["voice"] = self.voice_choice
+        config.update(self._tools_config(tool_names))
+        return config
+
+    def _compiled_session_config(self, tool_names: Optional[tuple[str, ...]] = None) -> tuple[str, str]:
+        """
+        Return the serialized server-enforced session fragment (JSON members without the enclosing
+        braces) and the tools-only session.update frame for a tool set, defaulting to all tools.
+        Fragments are cached per tool set and only rebuilt when the tools or server-side settings change.
+        """
+        key = (
+            tuple((name, id(tool)) for name, tool in self.tools.items()),
+            self.system_message, self.temperature, self.max_tokens, self.disable_audio, self.voice_choice
+        )
+        if key != self._session_config_key:
+            self._session_fragments = {}
+            self._session_fragment_keys = frozenset(self._session_config(()))
+            self._session_config_key = key
+
+        if tool_names is None:
+            tool_names = tuple(self.tools)
+        compiled = self._session_fragments.get(tool_names)
+        if compiled is None:
+            fragment = json.dumps(self._session_config(tool_names))[1:-1]
+            tools_frame = json.dumps({"type": "session.update", "session": self._tools_config(tool_names)})
+            compiled = (fragment, tools_frame)
+            self._session_fragments[tool_names] = compiled
+            logger.info("Compiled realtime session configuration (%d tools, %d bytes)", len(tool_names), len(fragment))
+        return compiled
+
+    def compile_session_config(self, tool_names: Optional[tuple[str, ...]] = None) -> str:
+        """Serialize the server-enforced session fragment for a tool set, defaulting to all tools."""
+        return self._compiled_session_config(tool_names)[0]
+
+    def _splice_session_update(self, message: dict[str, Any], rt_session: Optional[RTSession] = None) -> str:
+        """Serialize a client session.update with the precompiled server fragment spliced in."""
+        tool_names = self._available_tools(rt_session)
+        fragment = self.compile_session_config(tool_names)
+        if rt_session is not None:
+            rt_session.active_tools = tool_names
+        client_session = {k: v for k, v in message.get("session", {}).items() if k not in self._session_fragment_keys}
+        session_json = json.dumps(client_session)[:-1]
+        if client_session and fragment:
+            session_json += ", "
+        session_json += fragment + "}"
+        envelope = json.dumps({k: v for k, v in message.items() if k != "session"})
+        return envelope[:-1] + ', "session": ' + session_json + "}"
+
+    def _tools_update(self, rt_session: RTSession) -> Optional[str]:
+        """Tools-only session.update frame if the session's available tool set changed, else None."""
+        if rt_session.active_tools is None:
+            return None
+        tool_names = self._available_tools(rt_session)
+        if tool_names == rt_session.active_tools:
+            return None
+        logger.info("Session tool set changed: %s", ", ".join(tool_names))
+        rt_session.active_tools = tool_names
+        return self._compiled_session_config(tool_names)[1]
+
+    async def _refresh_session_tools(self, rt_session: RTSession, server_ws: web.WebSocketResponse) -> None:
+        """Send a tools-only session.update upstream when the session's available tool set changed."""
+        tools_update = self._tools_update(rt_session)
+        if tools_update is not None:
+            await server_ws.send_str(tools_update)
+
+    async def send_to_client(self, session_id: str, message: dict[str, Any]) -> bool:
+        """Push a message to a connected session's client, returns False if it is not connected."""
+        ws = self._client_sockets.get(session_id)
+        if ws is None or ws.closed:
+            return False
+        try:
+            await ws.send_json(message)
+            return True
+        except ConnectionResetError:
+            return False
+
+    async def add_system_message(self, session_id: str, text: str) -> Optional[str]:
+        """
+        Add a system message to a connected session's conversation and have the assistant respond
+        to it, e.g. when a background job finished. Returns the item id, None if not connected.
+        """
+        rt_session = self._sessions.get(session_id)
+        if rt_session is None or rt_session.server_ws is None or rt_session.server_ws.closed:
+            return None
+        item_id = new_item_id()
+        try:
+            await rt_session.server_ws.send_json({
+                "type": "conversation.item.create",
+                "item": {
+                    "id": item_id,
+                    "type": "message",
+                    "role": "system",
+                    "content": [{"type": "input_text", "text": text}]
+                }
+            })
+            if rt_session.responding or rt_session.tools_pending:
+                # Only one response can be active, ask for this one when the current one is done
+                rt_session.response_requested = True
+            else:
+                await rt_session.server_ws.send_json({"type": "response.create"})
+        except ConnectionResetError:
+            return None
+        return item_id
+
+    def _create_session(self, session_id: Optional[str] = None) -> RTSession:
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        return RTSession(session_id, ConversationContext(
+            budget_tokens=self.context_budget_tokens,
+            keep_recent=self.context_keep_recent,
+            pinned_tools=set(self.context_pinned_tools)
+        ))
+
+    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, rt_session: RTSession) -> Optional[str]:
         message = json.loads(msg.data)
         updated_message = msg.data
 
@@ -100,12 +284,17 @@ class RTMiddleTier:
                 case "conversation.item.created":
                     if "item" in message and message["item"]["type"] == "function_call":
                         item = message["item"]
-                        if item["call_id"] not in self._tools_pending:
-                            self._tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
+                        if item["call_id"] not in rt_session.tools_pending:
+                            rt_session.tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
                         updated_message = None
                     elif "item" in message and message["item"]["type"] == "function_call_output":
                         updated_message = None
 
+                case "conversation.item.deleted":
+                    if is_own_item(message.get("item_id")):
+                        rt_session.context.forget(message["item_id"])
+                        updated_message = None
+
                 case "response.function_call_arguments.delta":
                     updated_message = None
                 
@@ -115,20 +304,27 @@ class RTMiddleTier:
                 case "response.output_item.done":
                     if "item" in message and message["item"]["type"] == "function_call":
                         item = message["item"]
-                        tool_call = self._tools_pending[message["item"]["call_id"]]
+                        tool_call = rt_session.tools_pending[message["item"]["call_id"]]
                         tool = self.tools[item["name"]]
                         args = item["arguments"]
                        
-                        result = await tool.target(json.loads(args))
+                        result = await self.tools.invoke(item["name"], json.loads(args), rt_session)
+                        rt_session.tools_called.add(item["name"])
                         
+                        output = "Here is the result as returned from the search tool, read them as they are" + tool.model_output(result) # if result.destination == ToolResultDirection.TO_SERVER else ""
+                        output_item_id = new_item_id()
                         await server_ws.send_json({
                             "type": "conversation.item.create",
                             "item": {
+                                "id": output_item_id,
                                 "type": "function_call_output",
                                 "call_id": item["call_id"],
-                                "output": "Here is the result as returned from the search tool, read them as they are" + result.to_text() # if result.destination == ToolResultDirection.TO_SERVER else ""
+                                "output": output
                             }
                         })
+                        rt_session.context.track(output_item_id, item["call_id"], item["name"], output, previous_item_id=item.get("id"))
+                        for event in rt_session.context.prune():
+                            await server_ws.send_json(event)
                         if result.destination == ToolResultDirection.TO_CLIENT:
                             # TODO: this will break clients that don't know about this extra message, rewrite 
                             # this to be a regular text message with a special marker of some sort
@@ -140,9 +336,15 @@ class RTMiddleTier:
                             })
                         updated_message = None
 
+                case "response.created":
+                    rt_session.responding = True
+
                 case "response.done":
-                    if len(self._tools_pending) > 0:
-                        self._tools_pending.clear()
+                    rt_session.responding = False
+                    if len(rt_session.tools_pending) > 0 or rt_session.response_requested:
+                        rt_session.tools_pending.clear()
+                        rt_session.response_requested = False
+                        await self._refresh_session_tools(rt_session, server_ws)
                         await server_ws.send_json({
                             "type": "response.create"
                         })
@@ -156,30 +358,47 @@ class RTMiddleTier:
 
         return updated_message
 
-    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse) -> Optional[str]:
+    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse, rt_session: Optional[RTSession] = None) -> Optional[str]:
+        # Most client traffic is audio, only parse the messages the middle tier rewrites or consumes
+        if '"session.update"' not in msg.data and '"extension.' not in msg.data:
+            return msg.data
+
         message = json.loads(msg.data)
         updated_message = msg.data
         if message is not None:
             match message["type"]:
                 case "session.update":
-                    session = message["session"]
-                    if self.system_message is not None:
-                        session["instructions"] = self.system_message
-                    if self.temperature is not None:
-                        session["temperature"] = self.temperature
-                    if self.max_tokens is not None:
-                        session["max_response_output_tokens"] = self.max_tokens
-                    if self.disable_audio is not None:
-                        session["disable_audio"] = self.disable_audio
-                    if self.voice_choice is not None:
-                        session["voice"] = self.voice_choice
-                    session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
-                    session["tools"] = [tool.schema for tool in self.tools.values()]
-                    updated_message = json.dumps(message)
+                    updated_message = self._splice_session_update(message, rt_session)
+
+                case str(message_type) if message_type in self.client_event_handlers:
+                    updated_message = None
+                    if rt_session is not None:
+                        await self.client_event_handlers[message_type](rt_session, message)
+                        # A client event can change which tools apply (e.g. a product was opened)
+                        updated_message = self._tools_update(rt_session)
 
         return updated_message
 
-    async def _forward_messages(self, ws: web.WebSocketResponse):
+    async def _forward_messages(self, ws: web.WebSocketResponse, session_id: Optional[str] = None):
+        rt_session = self._create_session(session_id)
+        current_session.set(rt_session)
+        self._client_sockets[rt_session.session_id] = ws
+        self._sessions[rt_session.session_id] = rt_session
+        try:
+            await ws.send_json({"type": "extension.session",
+                                "session_id": self.session_tokens.issue(rt_session.session_id)})
+            await self._relay(ws, rt_session)
+        finally:
+            if self._client_sockets.get(rt_session.session_id) is ws:
+                del self._client_sockets[rt_session.session_id]
+                del self._sessions[rt_session.session_id]
+                for handler in self.session_close_handlers:
+                    try:
+                        await handler(rt_session)
+                    except Exception:
+                        logger.exception("Session close handler failed for %s", rt_session.session_id)
+
+    async def _relay(self, ws: web.WebSocketResponse, rt_session: RTSession):
         async with aiohttp.ClientSession(base_url=self.endpoint) as session:
             params = { "api-version": self.api_version, "deployment": self.deployment}
             headers = {}
@@ -190,10 +409,14 @@ class RTMiddleTier:
             else:
                 headers = { "Authorization": f"Bearer {self._token_provider()}" } # NOTE: no async version of token provider, maybe refresh token on a timer?
             async with session.ws_connect("/openai/realtime", headers=headers, params=params) as target_ws:
+                rt_session.server_ws = target_ws
+                if self.send_session_on_connect:
+                    await target_ws.send_str(self._splice_session_update({"type": "session.update", "session": {}}, rt_session))
+
                 async def from_client_to_server():
                     async for msg in ws:
                         if msg.type == aiohttp.WSMsgType.TEXT:
-                            new_msg = await self._process_message_to_server(msg, ws)
+                            new_msg = await self._process_message_to_server(msg, ws, rt_session)
                             if new_msg is not None:
                                 await target_ws.send_str(new_msg)
                         else:
@@ -207,7 +430,7 @@ class RTMiddleTier:
                 async def from_server_to_client():
                     async for msg in target_ws:
                         if msg.type == aiohttp.WSMsgType.TEXT:
-                            new_msg = await self._process_message_to_client(msg, ws, target_ws)
+                            new_msg = await self._process_message_to_client(msg, ws, target_ws, rt_session)
                             if new_msg is not None:
                                 await ws.send_str(new_msg)
                         else:
@@ -218,11 +441,13 @@ class RTMiddleTier:
                 except ConnectionResetError:
                     # Ignore the errors resulting from the client disconnecting the socket
                     pass
+                finally:
+                    rt_session.server_ws = None
 
     async def _websocket_handler(self, request: web.Request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        await self._forward_messages(ws)
+        await self._forward_messages(ws, self.session_tokens.verify(request.query.get("session_id")))
         return ws
     
     def attach_to_app(self, app, path):
@@ -0,0 +1,178 @@
+"""
+Admission control for virtual try-on generations.
+Bounds the Vertex AI calls in flight per worker, overall and per session, and queues the excess in
+a bounded wait queue served round robin across sessions.
+"""
+
+import asyncio
+import statistics
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from exceptions import QueueFullError
+from services.tryon_jobs import latency_summary
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class AdmissionController:
+    """
+    Concurrency caps with a bounded, fair wait queue.
+
+    A call runs at once when both the global and its session's cap allow it and its session has no
+    one waiting already. Otherwise it waits; each freed slot goes to the next session in turn whose
+    own cap allows it, so one session's burst cannot starve the others. Calls arriving while the
+    wait queue is full are rejected immediately with a retry hint. Calls without a session are
+    each capped on their own, callers key anonymous requests themselves (e.g. by client address).
+
+    The try-on job queue checks can_run() when choosing the next job, so jobs of sessions at their
+    cap stay queued, and is told through release_listeners when slots free up.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_per_session: int = 2, max_waiting: int = 16):
+        self.max_concurrent = max_concurrent
+        self.max_per_session = max_per_session
+        self.max_waiting = max_waiting
+
+        self._active = 0
+        self._active_by_session: Dict[str, int] = {}
+        # Session -> its waiters, in round robin order
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._waiting_count = 0
+        # Called whenever a slot is released
+        self.release_listeners: List[Callable[[], None]] = []
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self._wait_times: deque = deque(maxlen=500)
+        self._hold_times: deque = deque(maxlen=500)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting_count
+
+    @asynccontextmanager
+    async def slot(self, session_id: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Hold a slot for the duration of the block.
+
+        Raises:
+            QueueFullError: If the call would have to wait and the wait queue is full
+        """
+        session = session_id or self._anonymous_key()
+        await self.acquire(session)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_times.append(time.monotonic() - started)
+            self.release(session)
+
+    def can_run(self, session_id: Optional[str] = None) -> bool:
+        """Whether a call of the session would run at once."""
+        session = session_id or self._anonymous_key()
+        return session not in self._waiting and self._can_run(session)
+
+    async def acquire(self, session: str) -> None:
+        if self.can_run(session):
+            self._grant(session)
+            self._wait_times.append(0.0)
+            return
+
+        if self._waiting_count >= self.max_waiting:
+            self.rejected += 1
+            retry_after = self._estimate_retry_after()
+            logger.warning(f"Try-on admission rejected ({self._active} active, {self._waiting_count} waiting)")
+            raise QueueFullError("Virtual try-on is at capacity", retry_after=retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(session, deque()).append(waiter)
+        self._waiting_count += 1
+        started = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just before the cancellation, hand the slot on
+                self.release(session)
+            else:
+                self._discard(session, waiter)
+            raise
+        self._wait_times.append(time.monotonic() - started)
+
+    def release(self, session: str) -> None:
+        self._active -= 1
+        remaining = self._active_by_session.get(session, 1) - 1
+        if remaining > 0:
+            self._active_by_session[session] = remaining
+        else:
+            self._active_by_session.pop(session, None)
+        self._dispatch()
+        for listener in self.release_listeners:
+            listener()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "waiting": self._waiting_count,
+            "max_concurrent": self.max_concurrent,
+            "max_per_session": self.max_per_session,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds": latency_summary(self._wait_times),
+            "hold_seconds": latency_summary(self._hold_times),
+        }
+
+    @staticmethod
+    def _anonymous_key() -> str:
+        return f"anonymous:{uuid.uuid4().hex}"
+
+    def _can_run(self, session: str) -> bool:
+        return (self._active < self.max_concurrent
+                and self._active_by_session.get(session, 0) < self.max_per_session)
+
+    def _grant(self, session: str) -> None:
+        self._active += 1
+        self._active_by_session[session] = self._active_by_session.get(session, 0) + 1
+        self.admitted += 1
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting sessions in turn."""
+        while self._active < self.max_concurrent:
+            session = next((s for s in self._waiting if self._can_run(s)), None)
+            if session is None:
+                return
+            waiters = self._waiting.pop(session)
+            waiter = waiters.popleft()
+            self._waiting_count -= 1
+            if waiters:
+                # Back of the line for this session's next waiter
+                self._waiting[session] = waiters
+            if waiter.done():
+                continue
+            self._grant(session)
+            waiter.set_result(None)
+
+    def _discard(self, session: str, waiter: asyncio.Future) -> None:
+        waiters = self._waiting.get(session)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._waiting_count -= 1
+        if not waiters:
+            del self._waiting[session]
+
+    def _estimate_retry_after(self) -> float:
+        hold_time = statistics.median(self._hold_times) if self._hold_times else 15.0
+        return round(hold_time * (self._waiting_count + 1) / max(1, self.max_concurrent), 1)
@@ -0,0 +1,158 @@
+"""
+Preprocessed garment image cache for virtual try-on.
+Keeps the model-sized PNG of each product's garment image in memory, so a try-on only has to
+process the user's photo.
+"""
+
+import asyncio
+import json
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from config.settings import settings
+from image_tools.image_pipeline import ProcessedImage, process_image_async
+from single_flight import SingleFlight
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+GarmentFetcher = Callable[[str], Awaitable[Optional[bytes]]]
+
+
+def garment_version(product: Dict[str, Any]) -> str:
+    """Version of a product's garment image as known from the catalog."""
+    return str(product.get("image_version") or ",".join(product.get("images") or []))
+
+
+class GarmentEntry:
+    def __init__(self, version: Optional[str], image: ProcessedImage):
+        self.version = version
+        self.image = image
+
+
+class GarmentCache:
+    """
+    Memory-bounded LRU of preprocessed garment images keyed by product id and image version.
+
+    A lookup without a version accepts whatever version is cached; warming with the catalog
+    reloads the products whose image version changed. Concurrent loads of the same product
+    share one download and one preprocessing run.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, warm_concurrency: int = 4):
+        self.max_bytes = max_bytes
+        self.warm_concurrency = warm_concurrency
+        self._entries: "OrderedDict[str, GarmentEntry]" = OrderedDict()
+        self._loading: SingleFlight[Optional[ProcessedImage]] = SingleFlight()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, product_id: str, version: Optional[str] = None) -> Optional[ProcessedImage]:
+        entry = self._entries.get(product_id)
+        if entry is None or (version is not None and entry.version != version):
+            return None
+        return entry.image
+
+    async def get(self, product_id: str, fetch: GarmentFetcher, version: Optional[str] = None) -> Optional[ProcessedImage]:
+        """
+        Preprocessed garment image of a product, loading it with fetch on a miss.
+
+        Raises:
+            ImageProcessingError: If the fetched image cannot be processed
+        """
+        image = self.peek(product_id, version)
+        if image is not None:
+            self._entries.move_to_end(product_id)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        return await self._loading.run(product_id, lambda: self._load(product_id, fetch, version))
+
+    async def warm(self, products: Iterable[Dict[str, Any]], fetch: GarmentFetcher) -> int:
+        """Load the garments of catalog products that are missing or outdated, returns the number loaded."""
+        semaphore = asyncio.Semaphore(self.warm_concurrency)
+        stale = [(p["id"], garment_version(p)) for p in products
+                 if p.get("id") and self.peek(p["id"], garment_version(p)) is None]
+
+        async def load(product_id: str, version: str) -> bool:
+            async with semaphore:
+                try:
+                    return await self._load(product_id, fetch, version) is not None
+                except Exception as e:
+                    logger.warning(f"Failed to warm garment image for {product_id}: {e}")
+                    return False
+
+        loaded = sum(await asyncio.gather(*(load(pid, version) for pid, version in stale)))
+        if stale:
+            logger.info(f"Warmed {loaded}/{len(stale)} garment images ({self._bytes} bytes cached)")
+        return loaded
+
+    def invalidate(self, product_id: Optional[str] = None) -> None:
+        if product_id is None:
+            self._entries.clear()
+            self._bytes = 0
+        else:
+            entry = self._entries.pop(product_id, None)
+            if entry is not None:
+                self._bytes -= len(entry.image.data)
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    async def _load(self, product_id: str, fetch: GarmentFetcher, version: Optional[str]) -> Optional[ProcessedImage]:
+        raw = await fetch(product_id)
+        if not raw:
+            return None
+        image = await process_image_async(raw, "PNG")
+        self._store(product_id, GarmentEntry(version, image))
+        return image
+
+    def _store(self, product_id: str, entry: GarmentEntry) -> None:
+        self.invalidate(product_id)
+        self._entries[product_id] = entry
+        self._bytes += len(entry.image.data)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.image.data)
+
+
+def load_catalog(path: str) -> list:
+    """Products of a catalog JSON file (a list of product documents)."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+async def watch_catalog(cache: GarmentCache, path: str, fetch: GarmentFetcher, interval: float = 60) -> None:
+    """Warm the cache from the catalog file and re-warm whenever the file changes."""
+    catalog = Path(path)
+    last_mtime = None
+    while True:
+        try:
+            mtime = catalog.stat().st_mtime
+            if mtime != last_mtime:
+                products = await asyncio.to_thread(load_catalog, str(catalog))
+                await cache.warm(products, fetch)
+                last_mtime = mtime
+        except Exception as e:
+            # Keep watching, the next change of the catalog may fix it
+            logger.warning(f"Failed to warm garment cache from {path}: {e}")
+        await asyncio.sleep(interval)
+
+
+# Global instance for easy importing
+garment_cache = GarmentCache(max_bytes=settings.garment_cache_max_mb * 1024 * 1024)
@@ -0,0 +1,174 @@
+"""
+Registry of garment images uploaded to the model provider.
+A garment is uploaded once and referenced by its file URI in later try-on requests until the
+upload expires, instead of being sent inline with every request.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from exceptions import UploadsNotSupportedError
+from image_tools.image_pipeline import ProcessedImage
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# Files uploaded to the Gemini API are deleted after 48 hours
+GEMINI_FILE_TTL_SECONDS = 48 * 3600
+
+
+class GarmentHandle:
+    """Reference to an uploaded garment image."""
+
+    def __init__(self, uri: str, mime_type: str, expires_at: float, size: int):
+        self.uri = uri
+        self.mime_type = mime_type
+        self.expires_at = expires_at
+        self.size = size
+
+
+class GarmentUploader:
+    """Uploads an image to the model provider."""
+
+    async def upload(self, data: bytes, mime_type: str, name: str) -> GarmentHandle:
+        """
+        Raises:
+            UploadsNotSupportedError: If the provider does not accept uploads
+        """
+        raise UploadsNotSupportedError(f"{type(self).__name__} does not upload files")
+
+
+class GeminiFilesUploader(GarmentUploader):
+    """Uploads with the Gemini API Files service, which the Vertex AI client does not offer."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def upload(self, data: bytes, mime_type: str, name: str) -> GarmentHandle:
+        try:
+            file = await self.client.aio.files.upload(
+                file=BytesIO(data),
+                config={"mime_type": mime_type, "display_name": name}
+            )
+        except ValueError as e:
+            # Raised by the SDK when the client is a Vertex AI client
+            raise UploadsNotSupportedError(str(e))
+        if file.expiration_time is not None:
+            expires_at = file.expiration_time.timestamp()
+        else:
+            expires_at = time.time() + GEMINI_FILE_TTL_SECONDS
+        return GarmentHandle(file.uri, file.mime_type or mime_type, expires_at, len(data))
+
+
+class GarmentUploadRegistry:
+    """
+    Uploaded garment handles keyed by the digest of the preprocessed image.
+
+    A lookup returns a handle that stays valid for at least refresh_margin_seconds. Otherwise the
+    request sends the garment inline and an upload starts in the background, so the next request
+    for the same garment can reference it. Handles the provider rejects are invalidated and
+    uploaded again. Uploads stop for good if the provider does not support them.
+    """
+
+    def __init__(self, uploader: GarmentUploader, max_entries: int = 512, refresh_margin_seconds: float = 3600):
+        self.uploader = uploader
+        self.max_entries = max_entries
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.enabled = True
+        self._handles: "OrderedDict[str, GarmentHandle]" = OrderedDict()
+        self._uploads: Dict[str, asyncio.Task] = {}
+
+        # Metrics
+        self.hits = 0
+        self.inline = 0
+        self.expired = 0
+        self.rejected = 0
+        self.uploaded = 0
+        self.failures = 0
+        self.bytes_saved = 0
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    @staticmethod
+    def key(image: ProcessedImage) -> str:
+        return hashlib.sha256(image.data).hexdigest()
+
+    def lookup(self, image: ProcessedImage) -> Optional[GarmentHandle]:
+        """Usable handle of a garment, or None to send it inline while it is uploaded."""
+        key = self.key(image)
+        handle = self._handles.get(key)
+        if handle is not None:
+            if handle.expires_at - time.time() > self.refresh_margin_seconds:
+                self._handles.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += len(image.data)
+                return handle
+            del self._handles[key]
+            self.expired += 1
+
+        self.inline += 1
+        self._schedule_upload(key, image)
+        return None
+
+    def invalidate(self, image: ProcessedImage) -> None:
+        """Forget a handle the provider rejected."""
+        if self._handles.pop(self.key(image), None) is not None:
+            self.rejected += 1
+
+    async def wait_for_uploads(self) -> None:
+        """Wait for the uploads in progress."""
+        if self._uploads:
+            await asyncio.gather(*self._uploads.values(), return_exceptions=True)
+
+    async def close(self) -> None:
+        for task in list(self._uploads.values()):
+            task.cancel()
+        await self.wait_for_uploads()
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.inline
+        return {
+            "enabled": self.enabled,
+            "handles": len(self._handles),
+            "uploading": len(self._uploads),
+            "hits": self.hits,
+            "inline": self.inline,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "uploaded": self.uploaded,
+            "failures": self.failures,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def _schedule_upload(self, key: str, image: ProcessedImage) -> None:
+        if not self.enabled or key in self._uploads:
+            return
+        self._uploads[key] = asyncio.create_task(self._upload(key, image))
+
+    async def _upload(self, key: str, image: ProcessedImage) -> None:
+        try:
+            handle = await self.uploader.upload(image.data, image.mime_type, f"garment-{key[:16]}")
+        except UploadsNotSupportedError as e:
+            self.enabled = False
+            logger.warning(f"Garment uploads are not supported by the model provider, sending garments inline: {e}")
+            return
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Garment upload failed, it stays inline: {e}")
+            return
+        finally:
+            self._uploads.pop(key, None)
+
+        self._handles[key] = handle
+        self._handles.move_to_end(key)
+        self.uploaded += 1
+        while len(self._handles) > self.max_entries:
+            self._handles.popitem(last=False)
+        logger.info(f"Uploaded garment {key[:12]} ({handle.size} bytes) as {handle.uri}")
@@ -0,0 +1,136 @@
+"""
+Streaming image uploads for Zalanko.
+Reads an image from a multipart/form-data or raw binary request body chunk by chunk, enforcing
+the size and dimension limits while the body is still streaming, into a single buffer.
+"""
+
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+from PIL import Image
+
+from exceptions import ImageProcessingError
+from image_tools.image_pipeline import MAX_IMAGE_SIZE_MB, MAX_SOURCE_DIMENSION, MIN_DIMENSION
+
+CHUNK_SIZE = 64 * 1024
+
+# Image headers (including EXIF blocks) are expected within this prefix
+MAX_HEADER_BYTES = 1024 * 1024
+
+# Bound on the text fields accepted alongside a multipart upload
+MAX_FIELD_BYTES = 4096
+
+RAW_CONTENT_TYPES = ("image/", "application/octet-stream")
+
+
+class UploadRejected(ImageProcessingError):
+    """Raised when an upload is rejected, carrying the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_streamed_upload(request: web.Request) -> bool:
+    """Whether a request carries a multipart or raw binary image upload."""
+    content_type = request.content_type
+    return content_type == "multipart/form-data" or content_type.startswith(RAW_CONTENT_TYPES)
+
+
+class ImageUploadBuffer:
+    """Accumulates upload chunks and validates the image as soon as its header has arrived."""
+
+    def __init__(self, max_bytes: int = MAX_IMAGE_SIZE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size: Optional[Tuple[int, int]] = None
+        self._buffer = BytesIO()
+
+    @property
+    def length(self) -> int:
+        return self._buffer.tell()
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Append a chunk.
+
+        Raises:
+            UploadRejected: If the upload exceeds the size limit or its dimensions are out of range
+        """
+        if self.length + len(chunk) > self.max_bytes:
+            raise UploadRejected(f"Image larger than {self.max_bytes // (1024 * 1024)}MB", status=413)
+        self._buffer.write(chunk)
+        if self.size is None and self.length <= MAX_HEADER_BYTES:
+            self._check_header()
+
+    def getvalue(self) -> bytes:
+        """
+        The uploaded bytes, handed over from the buffer without an extra copy.
+
+        Raises:
+            UploadRejected: If nothing was uploaded or the image header could not be read
+        """
+        if self.length == 0:
+            raise UploadRejected("Empty image upload")
+        if self.size is None:
+            raise UploadRejected("Unreadable image upload")
+        return self._buffer.getvalue()
+
+    def _check_header(self) -> None:
+        try:
+            # Only the header is parsed, from a copy of the (small) prefix received so far
+            with Image.open(BytesIO(self._buffer.getbuffer())) as img:
+                width, height = img.size
+        except Exception:
+            # Header incomplete so far
+            return
+        if min(width, height) < MIN_DIMENSION or max(width, height) > MAX_SOURCE_DIMENSION:
+            raise UploadRejected(f"Image dimensions out of range: {width}x{height}")
+        self.size = (width, height)
+
+
+async def read_image_upload(request: web.Request, file_field: str = "person_image",
+                            max_bytes: int = MAX_IMAGE_SIZE_MB * 1024 * 1024,
+                            file_required: bool = True) -> Tuple[Optional[bytes], Dict[str, str]]:
+    """
+    Stream an image upload into memory.
+
+    Multipart requests carry the image in file_field and any other form fields as text, raw
+    binary requests carry the image as the body and other fields as query parameters.
+
+    Returns:
+        Tuple of (image bytes, or None for a multipart request without the file when it is
+        not required; fields)
+
+    Raises:
+        UploadRejected: If the upload is missing, too large or not a valid image
+    """
+    buffer = ImageUploadBuffer(max_bytes)
+    fields: Dict[str, str] = dict(request.query)
+
+    if request.content_type == "multipart/form-data":
+        found = False
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == file_field:
+                found = True
+                while chunk := await part.read_chunk(CHUNK_SIZE):
+                    buffer.feed(chunk)
+            elif part.name:
+                value = bytearray()
+                while chunk := await part.read_chunk(1024):
+                    value.extend(chunk)
+                    if len(value) > MAX_FIELD_BYTES:
+                        raise UploadRejected(f"Form field {part.name} too large", status=413)
+                fields[part.name] = value.decode(part.get_charset("utf-8"))
+        if not found:
+            if not file_required:
+                return None, fields
+            raise UploadRejected(f"Missing {file_field} file")
+    else:
+        if request.content_length is not None and request.content_length > max_bytes:
+            raise UploadRejected(f"Image larger than {max_bytes // (1024 * 1024)}MB", status=413)
+        async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+            buffer.feed(chunk)
+
+    return buffer.getvalue(), fields
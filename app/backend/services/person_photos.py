@@ -0,0 +1,182 @@
+"""
+Session-scoped store of uploaded person photos for virtual try-on.
+A photo is validated and preprocessed once when it is uploaded; later try-ons of the session
+reference it by a short handle instead of sending the photo again.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config.settings import settings
+from exceptions import VirtualTryOnError
+from image_tools.image_pipeline import ProcessedImage
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class PersonPhoto:
+    def __init__(self, photo_id: str, image: ProcessedImage):
+        self.photo_id = photo_id
+        self.image = image
+        self.last_access = time.monotonic()
+
+
+class PersonPhotoStore:
+    """
+    Preprocessed person photos kept in memory per session.
+
+    Handles are derived from the preprocessed image, so uploading the same photo twice returns the
+    same handle, and only resolve within the session that uploaded them. Each session has a byte
+    quota (its least recently used photos make room for new ones), photos unused for the TTL
+    expire, and a session's photos are dropped when its websocket closes.
+    """
+
+    def __init__(self, session_quota_bytes: int = 8 * 1024 * 1024, max_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: float = 1800):
+        self.session_quota_bytes = session_quota_bytes
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # Session -> photo id -> photo, both in least recently used order
+        self._sessions: "OrderedDict[str, OrderedDict[str, PersonPhoto]]" = OrderedDict()
+        self._session_bytes: Dict[str, int] = {}
+        self._bytes = 0
+
+        # Metrics
+        self.uploads = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return sum(len(photos) for photos in self._sessions.values())
+
+    def put(self, session_id: str, image: ProcessedImage) -> str:
+        """
+        Store a preprocessed photo for a session and return its handle.
+
+        Raises:
+            VirtualTryOnError: If the photo alone exceeds the session quota, or the store is too
+                full to keep it
+        """
+        size = len(image.data)
+        if size > self.session_quota_bytes:
+            raise VirtualTryOnError("Photo is too large to keep for this session")
+
+        photo_id = "ph_" + hashlib.sha256(image.data).hexdigest()[:20]
+        photos = self._sessions.setdefault(session_id, OrderedDict())
+        self._sessions.move_to_end(session_id)
+        if photo_id in photos:
+            photos[photo_id].last_access = time.monotonic()
+            photos.move_to_end(photo_id)
+            return photo_id
+
+        photos[photo_id] = PersonPhoto(photo_id, image)
+        self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + size
+        self._bytes += size
+        self.uploads += 1
+
+        # Make room within the session first, then across sessions
+        while self._session_bytes[session_id] > self.session_quota_bytes:
+            self._remove(session_id, next(iter(photos)))
+            self.evicted += 1
+        while self._bytes > self.max_bytes:
+            oldest_session = next(iter(self._sessions))
+            self._remove(oldest_session, next(iter(self._sessions[oldest_session])))
+            self.evicted += 1
+        if photo_id not in self._sessions.get(session_id, ()):
+            raise VirtualTryOnError("Too many photos are stored right now, try again later")
+        logger.info(f"Stored person photo {photo_id} for session {session_id} ({size} bytes)")
+        return photo_id
+
+    def get(self, session_id: Optional[str], photo_id: Optional[str] = None) -> Optional[ProcessedImage]:
+        """The session's photo with this handle, or its latest photo when no handle is given."""
+        photos = self._sessions.get(session_id) if session_id else None
+        if photos:
+            if photo_id is None:
+                photo_id = next(reversed(photos))
+            photo = photos.get(photo_id)
+            if photo is not None and time.monotonic() - photo.last_access > self.ttl_seconds:
+                self._remove(session_id, photo_id)
+                self.expired += 1
+                photo = None
+            if photo is not None:
+                photo.last_access = time.monotonic()
+                photos.move_to_end(photo_id)
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                return photo.image
+        self.misses += 1
+        return None
+
+    def delete(self, session_id: str, photo_id: str) -> bool:
+        if photo_id not in self._sessions.get(session_id, {}):
+            return False
+        self._remove(session_id, photo_id)
+        return True
+
+    def drop_session(self, session_id: str) -> int:
+        """Forget all photos of a session, returns how many were dropped."""
+        photos = self._sessions.pop(session_id, None)
+        if not photos:
+            return 0
+        self._bytes -= self._session_bytes.pop(session_id, 0)
+        logger.info(f"Dropped {len(photos)} person photos of closed session {session_id}")
+        return len(photos)
+
+    def evict_expired(self) -> int:
+        """Remove the photos unused for longer than the TTL, returns how many were removed."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [
+            (session_id, photo_id)
+            for session_id, photos in self._sessions.items()
+            for photo_id, photo in photos.items()
+            if photo.last_access < cutoff
+        ]
+        for session_id, photo_id in expired:
+            self._remove(session_id, photo_id)
+        self.expired += len(expired)
+        return len(expired)
+
+    async def run_expiry(self, interval: float = 60) -> None:
+        """Evict expired photos periodically, runs until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.evict_expired()
+            if removed:
+                logger.info(f"Expired {removed} person photos")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "photos": len(self),
+            "bytes": self._bytes,
+            "session_quota_bytes": self.session_quota_bytes,
+            "uploads": self.uploads,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+    def _remove(self, session_id: str, photo_id: str) -> None:
+        photos = self._sessions[session_id]
+        size = len(photos.pop(photo_id).image.data)
+        self._bytes -= size
+        self._session_bytes[session_id] -= size
+        if not photos:
+            del self._sessions[session_id]
+            del self._session_bytes[session_id]
+
+
+# Global instance for easy importing
+person_photo_store = PersonPhotoStore(
+    session_quota_bytes=settings.person_photo_session_quota_mb * 1024 * 1024,
+    max_bytes=settings.person_photo_max_mb * 1024 * 1024,
+    ttl_seconds=settings.person_photo_ttl_seconds
+)
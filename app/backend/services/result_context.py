@@ -0,0 +1,107 @@
+"""
+Result context index for Zalanko sessions.
+Remembers the products already shown in a session so references like "the second one" or
+"the blue jacket" can be resolved locally instead of running a new search.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ShownProduct:
+    """Compact record of a product shown to the user."""
+
+    def __init__(self, product: Dict[str, Any], ordinal: int):
+        self.id = product.get("id", "")
+        self.ordinal = ordinal
+        self.title = product.get("title") or ""
+        self.brand = product.get("brand") or ""
+        self.category = product.get("category") or ""
+        self.colors = [c for c in product.get("colors") or [] if isinstance(c, str)]
+        self.price = product.get("price")
+        self.sale_price = product.get("sale_price")
+
+    @property
+    def effective_price(self) -> Optional[float]:
+        return self.sale_price if self.sale_price is not None else self.price
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "ordinal": self.ordinal,
+            "title": self.title,
+            "brand": self.brand,
+            "category": self.category,
+            "colors": self.colors,
+            "price": self.effective_price,
+        }
+
+
+class ResultContextIndex:
+    """
+    Per-session index of shown products.
+
+    Ordinals refer to the latest result list (1-based, negative values count from the end).
+    Attribute references are matched against the latest results first and then against
+    earlier results, which are kept up to a bounded number of products.
+    """
+
+    def __init__(self, max_products: int = 50):
+        self.max_products = max_products
+        self.latest: List[ShownProduct] = []
+        self._history: "OrderedDict[str, ShownProduct]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._history)
+
+    def record_results(self, products: List[Dict[str, Any]]) -> None:
+        """Record a freshly shown result list, replacing the latest list."""
+        self.latest = [ShownProduct(p, i) for i, p in enumerate(products, start=1) if p.get("id")]
+        for shown in self.latest:
+            self._history.pop(shown.id, None)
+            self._history[shown.id] = shown
+        while len(self._history) > self.max_products:
+            self._history.popitem(last=False)
+
+    def resolve(
+        self,
+        ordinal: Optional[int] = None,
+        color: Optional[str] = None,
+        brand: Optional[str] = None,
+        category: Optional[str] = None,
+        max_price: Optional[float] = None,
+        min_price: Optional[float] = None,
+        keywords: Optional[str] = None
+    ) -> List[ShownProduct]:
+        """Return the shown products matching an ordinal and/or attribute reference."""
+        if ordinal is not None:
+            index = ordinal - 1 if ordinal > 0 else len(self.latest) + ordinal
+            if not 0 <= index < len(self.latest):
+                return []
+            candidates = [self.latest[index]]
+        else:
+            candidates = self.latest
+
+        def matches(product: ShownProduct) -> bool:
+            if color and not any(color.lower() in c.lower() for c in product.colors):
+                return False
+            if brand and brand.lower() != product.brand.lower():
+                return False
+            if category and category.lower() not in product.category.lower():
+                return False
+            price = product.effective_price
+            if max_price is not None and (price is None or price > max_price):
+                return False
+            if min_price is not None and (price is None or price < min_price):
+                return False
+            if keywords:
+                text = f"{product.title} {product.brand} {product.category} {' '.join(product.colors)}".lower()
+                if not all(word in text for word in keywords.lower().split()):
+                    return False
+            return True
+
+        found = [p for p in candidates if matches(p)]
+        if not found and ordinal is None:
+            latest_ids = {p.id for p in self.latest}
+            found = [p for p in reversed(self._history.values()) if p.id not in latest_ids and matches(p)]
+        return found
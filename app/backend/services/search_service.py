@@ -4,11 +4,13 @@ Provides robust search functionality with proper error handling and logging.
 """
 
 import asyncio
+import time
 from typing import List, Dict, Any, Optional
 
 from openai import AzureOpenAI
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.search.documents.models import VectorizedQuery
 
 from config.settings import settings
@@ -18,12 +20,26 @@ from exceptions import SearchError, ConfigurationError, ExternalServiceError
 
 logger = get_logger(__name__)
 
+# Product fields returned by every search
+PRODUCT_FIELDS = ["id", "title", "description", "brand", "category", "price",
+                  "sale_price", "on_sale", "colors", "sizes", "materials",
+                  "style_tags", "ratings", "images", "availability"]
+
+# Fields added to the index later (index_manager.py updates the schema), selected once the
+# index has them so the service keeps working against an index that was not updated yet
+OPTIONAL_PRODUCT_FIELDS = ["image_variants"]
+
+# How long searches use the fallback fields before an unreadable index schema is read again
+SCHEMA_RETRY_SECONDS = 300
+
 
 class SearchService:
     """Enhanced search service with proper error handling and validation."""
 
     def __init__(self):
         """Initialize search service with configuration validation."""
+        self._select: Optional[List[str]] = None
+        self._select_retry_at: Optional[float] = None
         try:
             self._validate_configuration()
             self._initialize_clients()
@@ -53,6 +69,10 @@ class SearchService:
             index_name=settings.azure_search_index,
             credential=search_credential
         )
+        self.index_client = SearchIndexClient(
+            endpoint=search_endpoint,
+            credential=search_credential
+        )
 
         # Azure OpenAI client for embeddings
         self.openai_client = AzureOpenAI(
@@ -61,6 +81,26 @@ class SearchService:
             api_key=settings.azure_openai_api_key
         )
 
+    async def _select_fields(self) -> List[str]:
+        """
+        Fields to select, the optional ones only if the index schema has them.
+        When the schema cannot be read the fallback without optional fields is cached too, and the
+        schema is read again only after SCHEMA_RETRY_SECONDS.
+        """
+        if self._select is None or (self._select_retry_at is not None and time.monotonic() >= self._select_retry_at):
+            try:
+                index = await self.index_client.get_index(settings.azure_search_index)
+            except Exception as e:
+                logger.warning(f"Could not read the search index schema, leaving out optional fields "
+                               f"for {SCHEMA_RETRY_SECONDS}s: {e}")
+                self._select = PRODUCT_FIELDS
+                self._select_retry_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+                return self._select
+            present = {field.name for field in index.fields}
+            self._select = PRODUCT_FIELDS + [f for f in OPTIONAL_PRODUCT_FIELDS if f in present]
+            self._select_retry_at = None
+        return self._select
+
     async def _calculate_embedding(self, text: str) -> List[float]:
         """
         Calculate embedding for given text with error handling.
@@ -125,9 +165,7 @@ class SearchService:
             results = await self.search_client.search(
                 search_text=None,
                 vector_queries=[vector_query],
-                select=["id", "title", "description", "brand", "category", "price",
-                       "sale_price", "on_sale", "colors", "sizes", "materials",
-                       "style_tags", "ratings", "images", "availability"]
+                select=await self._select_fields()
             )
 
             # Process results
@@ -195,9 +233,7 @@ class SearchService:
                 search_text="*",
                 filter=filter_expression,
                 top=k,
-                select=["id", "title", "description", "brand", "category", "price",
-                       "sale_price", "on_sale", "colors", "sizes", "materials",
-                       "style_tags", "ratings", "images", "availability"]
+                select=await self._select_fields()
             )
 
             # Process results
@@ -282,9 +318,7 @@ class SearchService:
                 vector_queries=[vector_query],
                 filter=filter_expression,
                 top=k,
-                select=["id", "title", "description", "brand", "category", "price",
-                       "sale_price", "on_sale", "colors", "sizes", "materials",
-                       "style_tags", "ratings", "images", "availability"]
+                select=await self._select_fields()
             )
 
             # Process results
@@ -303,6 +337,7 @@ class SearchService:
         """Close search client connections."""
         try:
             await self.search_client.close()
+            await self.index_client.close()
             logger.info("SearchService connections closed")
         except Exception as e:
             logger.error(f"Error closing SearchService: {e}")
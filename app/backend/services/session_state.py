@@ -0,0 +1,271 @@
+"""
+Server-side shopping session state for Zalanko.
+Keeps cart, wishlist, current product and page per realtime session so the assistant can
+answer state questions without asking the user.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from services.result_context import ResultContextIndex
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class ShoppingSessionState:
+    """Shopping state of a single session."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.current_page = "main"
+        self.current_product_id: Optional[str] = None
+        self.cart: List[Dict[str, Any]] = []
+        self.wishlist: List[str] = []
+        # Product open in the virtual try-on modal, if any
+        self.tryon_product_id: Optional[str] = None
+        # Products shown in this session, kept in memory only
+        self.results = ResultContextIndex()
+        self.last_active = time.monotonic()
+
+    @property
+    def has_products(self) -> bool:
+        """Whether the session has product ids to act on: shown results, a product in view, cart or wishlist."""
+        return bool(len(self.results) or self.current_product_id or self.cart or self.wishlist)
+
+    def to_dict(self, include_details: bool = False) -> Dict[str, Any]:
+        """Serialize the state, cart lines are reduced to product ids unless details are requested."""
+        return {
+            "current_page": self.current_page,
+            "current_product_id": self.current_product_id,
+            "cart": [dict(line) for line in self.cart] if include_details else [line["product_id"] for line in self.cart],
+            "cart_item_count": sum(line.get("quantity", 1) for line in self.cart),
+            "wishlist": list(self.wishlist),
+            "tryon_product_id": self.tryon_product_id,
+        }
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict[str, Any]) -> "ShoppingSessionState":
+        state = cls(session_id)
+        state.current_page = data.get("current_page", "main")
+        state.current_product_id = data.get("current_product_id")
+        state.cart = [line for line in data.get("cart", []) if isinstance(line, dict) and line.get("product_id")]
+        state.wishlist = [pid for pid in data.get("wishlist", []) if isinstance(pid, str)]
+        state.tryon_product_id = data.get("tryon_product_id")
+        return state
+
+
+class SessionStateStore:
+    """
+    In-memory store of shopping session state.
+
+    Memory is bounded by the number of sessions (least recently active sessions are evicted
+    first) and by per-session cart and wishlist limits. Sessions idle for longer than the TTL
+    are evicted. When a persistence directory is configured, evicted sessions are written to
+    disk and reloaded on their next access, persisted sessions untouched for longer than the
+    persistence TTL are deleted.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl_seconds: float = 1800,
+        max_items: int = 100,
+        persist_dir: Optional[str] = None,
+        persist_ttl_seconds: float = 7 * 24 * 3600
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_items = max_items
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.persist_ttl_seconds = persist_ttl_seconds
+        self._sessions: "OrderedDict[str, ShoppingSessionState]" = OrderedDict()
+
+        if self.persist_dir:
+            self.persist_dir.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> ShoppingSessionState:
+        """Get (or create) the state for a session and mark it active."""
+        self._evict_idle()
+
+        state = self._sessions.get(session_id)
+        if state is None:
+            state = self._load(session_id) or ShoppingSessionState(session_id)
+            self._sessions[session_id] = state
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._persist(evicted)
+        else:
+            self._sessions.move_to_end(session_id)
+
+        state.last_active = time.monotonic()
+        return state
+
+    def peek(self, session_id: str) -> Optional[ShoppingSessionState]:
+        """Get the in-memory state for a session without creating or touching it."""
+        return self._sessions.get(session_id)
+
+    def discard(self, session_id: str) -> None:
+        """Drop a session's state, including its persisted copy."""
+        self._sessions.pop(session_id, None)
+        path = self._path(session_id)
+        if path and path.exists():
+            path.unlink()
+
+    def flush(self) -> None:
+        """Persist every in-memory session, e.g. on shutdown."""
+        for state in self._sessions.values():
+            self._persist(state)
+
+    def purge_persisted(self) -> int:
+        """Delete persisted sessions not written for longer than the persistence TTL, returns how many."""
+        if self.persist_dir is None:
+            return 0
+        cutoff = time.time() - self.persist_ttl_seconds
+        removed = 0
+        for path in self.persist_dir.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Failed to purge persisted session state {path.name}: {e}")
+        return removed
+
+    async def run_purge(self, interval: float = 3600) -> None:
+        """Purge expired persisted sessions periodically off the event loop, runs until cancelled."""
+        while True:
+            removed = await asyncio.to_thread(self.purge_persisted)
+            if removed:
+                logger.info(f"Purged {removed} persisted session states")
+            await asyncio.sleep(interval)
+
+    # State updates fed by the assistant tools and by client UI events
+
+    def add_to_cart(self, session_id: str, product_id: str, size: Optional[str] = None,
+                    color: Optional[str] = None, quantity: int = 1) -> ShoppingSessionState:
+        state = self.get(session_id)
+        for line in state.cart:
+            if (line["product_id"], line.get("size"), line.get("color")) == (product_id, size, color):
+                line["quantity"] = line.get("quantity", 1) + quantity
+                return state
+        if len(state.cart) < self.max_items:
+            state.cart.append({"product_id": product_id, "size": size, "color": color, "quantity": quantity})
+        return state
+
+    def remove_from_cart(self, session_id: str, product_id: str) -> ShoppingSessionState:
+        state = self.get(session_id)
+        state.cart = [line for line in state.cart if line["product_id"] != product_id]
+        return state
+
+    def update_wishlist(self, session_id: str, product_id: str, action: str) -> ShoppingSessionState:
+        state = self.get(session_id)
+        if action == "add":
+            if product_id not in state.wishlist and len(state.wishlist) < self.max_items:
+                state.wishlist.append(product_id)
+        elif action == "remove" and product_id in state.wishlist:
+            state.wishlist.remove(product_id)
+        return state
+
+    def set_current_product(self, session_id: str, product_id: Optional[str]) -> ShoppingSessionState:
+        state = self.get(session_id)
+        state.current_product_id = product_id
+        return state
+
+    def set_page(self, session_id: str, page: str) -> ShoppingSessionState:
+        state = self.get(session_id)
+        state.current_page = page
+        return state
+
+    def set_tryon_product(self, session_id: str, product_id: Optional[str]) -> ShoppingSessionState:
+        state = self.get(session_id)
+        state.tryon_product_id = product_id
+        return state
+
+    def apply_ui_event(self, session_id: str, event: Dict[str, Any]) -> ShoppingSessionState:
+        """
+        Apply a state event reported by the client UI.
+
+        Supported events: cart_add, cart_remove, wishlist_add, wishlist_remove, view_product,
+        navigate, tryon_open, tryon_close and sync (replaces the whole state with the client's
+        snapshot, cart lines already known keep their size, color and quantity).
+        """
+        name = event.get("event")
+        product_id = event.get("product_id")
+
+        if name == "sync":
+            current = self.get(session_id)
+            known_lines = {line["product_id"]: line for line in current.cart}
+            snapshot = ShoppingSessionState.from_dict(session_id, event.get("state", {}))
+            snapshot.cart = [known_lines.get(line["product_id"], line) for line in snapshot.cart[:self.max_items]]
+            snapshot.wishlist = snapshot.wishlist[:self.max_items]
+            snapshot.results = current.results
+            self._sessions[session_id] = snapshot
+            return snapshot
+        if name == "cart_add" and product_id:
+            return self.add_to_cart(session_id, product_id, event.get("size"), event.get("color"), int(event.get("quantity", 1)))
+        if name == "cart_remove" and product_id:
+            return self.remove_from_cart(session_id, product_id)
+        if name in ("wishlist_add", "wishlist_remove") and product_id:
+            return self.update_wishlist(session_id, product_id, name.split("_")[1])
+        if name == "view_product":
+            return self.set_current_product(session_id, product_id)
+        if name == "navigate" and event.get("page"):
+            return self.set_page(session_id, event["page"])
+        if name in ("tryon_open", "tryon_close"):
+            return self.set_tryon_product(session_id, product_id if name == "tryon_open" else None)
+
+        logger.warning(f"Ignoring unknown UI state event: {name}")
+        return self.get(session_id)
+
+    # Eviction and persistence
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_ttl_seconds
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if state.last_active >= cutoff:
+                break
+            del self._sessions[session_id]
+            self._persist(state)
+            logger.debug(f"Evicted idle session state: {session_id}")
+
+    def _path(self, session_id: str) -> Optional[Path]:
+        return self.persist_dir / f"{session_id}.json" if self.persist_dir else None
+
+    def _persist(self, state: ShoppingSessionState) -> None:
+        path = self._path(state.session_id)
+        if path is None:
+            return
+        try:
+            path.write_text(json.dumps(state.to_dict(include_details=True)))
+        except OSError as e:
+            logger.warning(f"Failed to persist session state {state.session_id}: {e}")
+
+    def _load(self, session_id: str) -> Optional[ShoppingSessionState]:
+        path = self._path(session_id)
+        if path is None or not path.exists():
+            return None
+        try:
+            return ShoppingSessionState.from_dict(session_id, json.loads(path.read_text()))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load session state {session_id}: {e}")
+            return None
+
+
+# Global instance for easy importing
+session_state_store = SessionStateStore(
+    max_sessions=settings.session_state_max_sessions,
+    idle_ttl_seconds=settings.session_state_idle_ttl_seconds,
+    persist_dir=settings.session_state_persist_dir,
+    persist_ttl_seconds=settings.session_state_persist_ttl_seconds
+)
@@ -0,0 +1,304 @@
+"""
+Try-on image generators behind VirtualTryOnService.
+The Vertex AI backend calls Gemini; the local backend composites the garment onto the person with
+PIL after a synthetic delay, so the pipeline can be load tested without paying for model calls.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from config.settings import settings
+from exceptions import ConfigurationError
+from image_tools.image_pipeline import ProcessedImage, run_in_pool
+from services.garment_uploads import GarmentHandle, GarmentUploadRegistry, GeminiFilesUploader
+
+logger = logging.getLogger("virtual_tryon")
+
+
+class TryOnBackend(ABC):
+    """Generates a try-on image from a preprocessed person and garment image."""
+
+    name = "base"
+
+    @property
+    def version(self) -> str:
+        """Identifies the generator in result cache keys, results of other versions are not reused."""
+        return self.name
+
+    @abstractmethod
+    async def generate(self, person: ProcessedImage, clothing: ProcessedImage, prompt: str) -> Optional[bytes]:
+        """
+        Generate the try-on image.
+
+        Returns:
+            Image bytes, or None when the generator produced no image
+        """
+
+    async def health_check(self) -> bool:
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"name": self.name}
+
+
+class VertexTryOnBackend(TryOnBackend):
+    """
+    Gemini 2.5 Flash Image Preview on Vertex AI, or on the Gemini API when
+    GOOGLE_GENAI_USE_VERTEXAI is false.
+
+    With the Gemini API, garment images are uploaded once and referenced by file URI while the
+    upload lasts (VIRTUAL_TRYON_GARMENT_UPLOADS); Vertex AI has no upload service, so garments
+    are always sent inline there.
+    """
+
+    name = "vertex"
+
+    def __init__(self, api_key: Optional[str] = None, project_id: Optional[str] = None,
+                 vertexai: Optional[bool] = None, garment_uploads: Optional[GarmentUploadRegistry] = None):
+        # Imported here so the local backend runs without the Google SDK
+        from google import genai
+
+        self.api_key = api_key or settings.google_cloud_api_key
+        self.project_id = project_id or settings.google_cloud_project_id
+        if vertexai is None:
+            vertexai = settings.google_genai_use_vertexai
+        self.vertexai = vertexai
+
+        if not self.api_key or (vertexai and not self.project_id):
+            raise ConfigurationError("Google Cloud credentials not found in environment")
+
+        try:
+            self.client = genai.Client(
+                vertexai=vertexai,
+                api_key=self.api_key
+            )
+            if vertexai:
+                # Use global location for image generation capability
+                self.model = f"projects/{self.project_id}/locations/global/publishers/google/models/gemini-2.5-flash-image-preview"
+            else:
+                self.model = "gemini-2.5-flash-image-preview"
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize Vertex AI client: {e}")
+            raise ConfigurationError(f"Failed to initialize Vertex AI client: {e}")
+
+        if garment_uploads is None and not vertexai and settings.tryon_garment_uploads:
+            garment_uploads = GarmentUploadRegistry(
+                GeminiFilesUploader(self.client),
+                max_entries=settings.tryon_garment_uploads_max
+            )
+        self.garment_uploads = garment_uploads
+
+    @property
+    def version(self) -> str:
+        return self.model
+
+    async def generate(self, person: ProcessedImage, clothing: ProcessedImage, prompt: str) -> Optional[bytes]:
+        from google.genai import errors
+
+        handle = self.garment_uploads.lookup(clothing) if self.garment_uploads is not None else None
+        try:
+            return await self._generate(person, clothing, handle, prompt)
+        except errors.ClientError as e:
+            if handle is None or e.code not in (400, 403, 404):
+                raise
+            # The upload expired or was deleted early, send the garment inline instead
+            logger.warning(f"⚠️ Garment file {handle.uri} was rejected ({e.code}), retrying inline")
+            self.garment_uploads.invalidate(clothing)
+            return await self._generate(person, clothing, None, prompt)
+
+    async def _generate(self, person: ProcessedImage, clothing: ProcessedImage,
+                        handle: Optional[GarmentHandle], prompt: str) -> Optional[bytes]:
+        from google.genai import types
+
+        if handle is not None:
+            garment_part = types.Part(
+                file_data=types.FileData(
+                    file_uri=handle.uri,
+                    mime_type=handle.mime_type
+                )
+            )
+        else:
+            garment_part = types.Part(
+                inline_data=types.Blob(
+                    data=clothing.data,
+                    mime_type=clothing.mime_type
+                )
+            )
+
+        # Create content with images and prompt
+        contents = [
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part(text=prompt),
+                    types.Part(
+                        inline_data=types.Blob(
+                            data=person.data,
+                            mime_type=person.mime_type
+                        )
+                    ),
+                    garment_part
+                ]
+            )
+        ]
+
+        # Configure generation parameters
+        generate_content_config = types.GenerateContentConfig(
+            temperature=0.7,
+            top_p=0.95,
+            max_output_tokens=32768,
+            response_modalities=["TEXT", "IMAGE"],
+            safety_settings=[
+                types.SafetySetting(
+                    category="HARM_CATEGORY_HATE_SPEECH",
+                    threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_DANGEROUS_CONTENT",
+                    threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                    threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_HARASSMENT",
+                    threshold="OFF"
+                )
+            ]
+        )
+
+        logger.info("📡 Sending request to Vertex AI...")
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=generate_content_config
+        )
+        logger.info("✅ Received response from Vertex AI")
+        return self._extract_image_from_response(response)
+
+    def _extract_image_from_response(self, response) -> Optional[bytes]:
+        """Extract image data from Vertex AI response."""
+        try:
+            if hasattr(response, 'candidates') and response.candidates:
+                for candidate in response.candidates:
+                    if hasattr(candidate, 'content') and candidate.content:
+                        if hasattr(candidate.content, 'parts'):
+                            for part in candidate.content.parts:
+                                if hasattr(part, 'inline_data') and part.inline_data:
+                                    if hasattr(part.inline_data, 'data'):
+                                        image_data = part.inline_data.data
+
+                                        # Handle different data types
+                                        if isinstance(image_data, str):
+                                            # Base64 string
+                                            return base64.b64decode(image_data)
+                                        elif isinstance(image_data, bytes):
+                                            # Already bytes
+                                            return image_data
+                                        else:
+                                            logger.warning(f"Unexpected image data type: {type(image_data)}")
+
+            return None
+
+        except Exception as e:
+            logger.error(f"Failed to extract image from response: {e}")
+            return None
+
+    async def health_check(self) -> bool:
+        # Verifies the client setup without calling the model
+        return bool(self.client and self.api_key and (self.project_id or not self.vertexai))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "garment_uploads": self.garment_uploads.metrics() if self.garment_uploads is not None else None,
+        }
+
+
+def composite_tryon(person_data: bytes, clothing_data: bytes, output_size: Tuple[int, int]) -> bytes:
+    """
+    Paste the garment over the person's torso and encode the result as PNG.
+    The output depends only on the inputs. Runs in the image process pool.
+    """
+    with Image.open(BytesIO(person_data)) as person:
+        canvas = person.convert("RGB")
+    # Cover the output frame, cropping the overflow around the center
+    scale = max(output_size[0] / canvas.width, output_size[1] / canvas.height)
+    canvas = canvas.resize((max(1, round(canvas.width * scale)), max(1, round(canvas.height * scale))),
+                           Image.Resampling.BILINEAR)
+    left = (canvas.width - output_size[0]) // 2
+    top = (canvas.height - output_size[1]) // 2
+    canvas = canvas.crop((left, top, left + output_size[0], top + output_size[1]))
+
+    with Image.open(BytesIO(clothing_data)) as clothing:
+        garment = clothing.convert("RGBA")
+    garment.thumbnail((output_size[0] * 11 // 20, output_size[1] * 9 // 20), Image.Resampling.LANCZOS)
+    position = ((output_size[0] - garment.width) // 2, output_size[1] * 3 // 10)
+    canvas.paste(garment, position, garment)
+
+    buffer = BytesIO()
+    canvas.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class LocalTryOnBackend(TryOnBackend):
+    """
+    Deterministic stand-in for the model: composites the garment onto the person.
+
+    Each call waits latency_seconds, plus up to jitter_seconds derived from the input images so
+    repeated runs see the same delays, then renders an output_size PNG in the image process pool.
+    """
+
+    name = "local"
+
+    def __init__(self, latency_seconds: float = 0.0, jitter_seconds: float = 0.0,
+                 output_size: Tuple[int, int] = (768, 1024)):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.output_size = output_size
+
+    @property
+    def version(self) -> str:
+        return f"local/{self.output_size[0]}x{self.output_size[1]}"
+
+    async def generate(self, person: ProcessedImage, clothing: ProcessedImage, prompt: str) -> Optional[bytes]:
+        delay = self.latency_seconds
+        if self.jitter_seconds:
+            seed = hashlib.sha256(person.data[:4096] + clothing.data[:4096]).digest()
+            delay += self.jitter_seconds * int.from_bytes(seed[:4], "big") / 0xFFFFFFFF
+        if delay:
+            await asyncio.sleep(delay)
+        return await run_in_pool(composite_tryon, person.data, clothing.data, self.output_size)
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """Parse WIDTHxHEIGHT."""
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def create_backend(name: Optional[str] = None) -> TryOnBackend:
+    """
+    Backend selected by name or VIRTUAL_TRYON_BACKEND (vertex or local).
+
+    Raises:
+        ConfigurationError: If the backend is unknown or not configured
+    """
+    name = (name or settings.tryon_backend).lower()
+    if name == "vertex":
+        return VertexTryOnBackend()
+    if name == "local":
+        return LocalTryOnBackend(
+            latency_seconds=settings.local_tryon_latency_ms / 1000,
+            jitter_seconds=settings.local_tryon_jitter_ms / 1000,
+            output_size=parse_size(settings.local_tryon_output_size)
+        )
+    raise ConfigurationError(f"Unknown virtual try-on backend: {name}")
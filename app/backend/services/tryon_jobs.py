@@ -0,0 +1,386 @@
+"""
+Asynchronous virtual try-on jobs for Zalanko.
+Submitting a try-on returns a job id immediately; a bounded pool of workers runs queued jobs by
+priority, taking turns between sessions and within the admission control caps, and publishes
+progress to subscribers (realtime websocket, SSE streams, pollers).
+"""
+
+import asyncio
+import statistics
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config.settings import settings
+from exceptions import QueueFullError
+from utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from services.admission import AdmissionController
+
+
+logger = get_logger(__name__)
+
+# Lower values run first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATES = (SUCCEEDED, FAILED)
+
+
+class TryOnJob:
+    """A queued or finished try-on job."""
+
+    def __init__(self, session_id: Optional[str], product_id: str, priority: str = "normal",
+                 admission_key: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.product_id = product_id
+        self.priority = priority
+        self.status = QUEUED
+        self.stage = "queued"
+        self.progress = 0.0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Key the job is scheduled and admitted under: its session, else the caller's (e.g. client
+        # address), else its own so anonymous jobs do not share one cap
+        self.admission_key = session_id or admission_key or f"job:{self.id}"
+        # Retry hint of a job turned away by admission control
+        self.retry_after: Optional[float] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._queue: Optional["TryOnJobQueue"] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    async def set_progress(self, stage: str, progress: float) -> None:
+        """Report progress from inside the job's work function."""
+        self.stage = stage
+        self.progress = max(0.0, min(1.0, progress))
+        if self._queue is not None:
+            await self._queue._publish(self, "progress")
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "product_id": self.product_id,
+            "priority": self.priority,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            data["error"] = self.error
+        if self.retry_after is not None:
+            data["retry_after"] = self.retry_after
+        if include_result and self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+JobWork = Callable[[TryOnJob], Awaitable[Dict[str, Any]]]
+JobListener = Callable[[TryOnJob, str], Awaitable[None]]
+
+
+class TryOnJobQueue:
+    """
+    Priority queue of try-on jobs served by a fixed number of workers.
+
+    Workers take the highest priority job that admission control would let run, taking turns
+    between the sessions with queued jobs of that priority; jobs of sessions at their cap stay
+    queued without tying up a worker. The admission slot itself is only taken around the model
+    call, by the try-on service. Submissions beyond the queue depth limit are rejected with
+    QueueFullError instead of waiting. Finished jobs stay pollable for the retention period.
+    """
+
+    def __init__(self, workers: int = 4, max_depth: int = 32, retention_seconds: float = 600, max_finished: int = 500,
+                 admission: Optional["AdmissionController"] = None):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self.listeners: List[JobListener] = []
+        self.admission: Optional["AdmissionController"] = None
+        if admission is not None:
+            self.set_admission(admission)
+
+        # Priority -> admission key -> queued job ids, keys in turn order
+        self._pending: Dict[int, "OrderedDict[str, Deque[str]]"] = {}
+        self._depth = 0
+        # Admission key -> its running jobs
+        self._running_by_key: Dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._work: Dict[str, JobWork] = {}
+        self._jobs: "OrderedDict[str, TryOnJob]" = OrderedDict()
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        # Metrics
+        self._started_at = time.monotonic()
+        self._busy_seconds = 0.0
+        self._running_since: Dict[str, float] = {}
+        self._queue_waits: deque = deque(maxlen=500)
+        self._run_times: deque = deque(maxlen=500)
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def set_admission(self, admission: "AdmissionController") -> None:
+        """Dispatch jobs within an admission controller's caps."""
+        self.admission = admission
+        admission.release_listeners.append(self._wake_workers)
+
+    def start(self) -> None:
+        """Start the workers on the running event loop (idempotent)."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} try-on job workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending = {}
+        self._depth = 0
+        self._wakeup = None
+
+    def submit(self, work: JobWork, product_id: str, session_id: Optional[str] = None, priority: str = "normal",
+               admission_key: Optional[str] = None) -> TryOnJob:
+        """
+        Queue a job and return it immediately.
+
+        Raises:
+            QueueFullError: If the queue is at its depth limit
+        """
+        return self.submit_many([(work, product_id)], session_id=session_id, priority=priority,
+                                admission_key=admission_key)[0]
+
+    def submit_many(self, items: List[Tuple[JobWork, str]], session_id: Optional[str] = None,
+                    priority: str = "normal", admission_key: Optional[str] = None) -> List[TryOnJob]:
+        """
+        Queue several jobs at once, all of them or none.
+
+        Args:
+            items: (work, product_id) of each job
+            admission_key: Key of an anonymous caller (e.g. its address), defaults to the session
+
+        Raises:
+            QueueFullError: If the queue cannot take every job
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.start()
+        if self.depth + len(items) > self.max_depth:
+            self.rejected += len(items)
+            raise QueueFullError("Virtual try-on queue is full", retry_after=self._estimate_retry_after())
+
+        self._evict_finished()
+        # Jobs of one anonymous request share a key, so a batch is capped like a session's
+        admission_key = session_id or admission_key or f"request:{uuid.uuid4().hex}"
+        return [self._enqueue(work, product_id, session_id, priority, admission_key) for work, product_id in items]
+
+    def _enqueue(self, work: JobWork, product_id: str, session_id: Optional[str], priority: str,
+                 admission_key: Optional[str]) -> TryOnJob:
+        job = TryOnJob(session_id, product_id, priority, admission_key)
+        job._queue = self
+        self._jobs[job.id] = job
+        self._work[job.id] = work
+        sessions = self._pending.setdefault(PRIORITIES[priority], OrderedDict())
+        sessions.setdefault(job.admission_key, deque()).append(job.id)
+        self._depth += 1
+        self._wake_workers()
+        self.submitted += 1
+        logger.info(f"Queued try-on job {job.id} for {product_id} ({priority}, depth {self.depth})")
+        return job
+
+    def get(self, job_id: str) -> Optional[TryOnJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> TryOnJob:
+        """Wait until a job is finished."""
+        job = self._jobs[job_id]
+        if job.done:
+            return job
+        events = self.subscribe(job_id)
+        try:
+            async def until_done():
+                while not job.done:
+                    await events.get()
+            await asyncio.wait_for(until_done(), timeout)
+        finally:
+            self.unsubscribe(job_id, events)
+        return job
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Receive (event, job snapshot) tuples for a job."""
+        events: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(events)
+        return events
+
+    def unsubscribe(self, job_id: str, events: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id, [])
+        if events in subscribers:
+            subscribers.remove(events)
+        if not subscribers:
+            self._subscribers.pop(job_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue latency, run time and worker utilization since the workers started."""
+        now = time.monotonic()
+        busy = self._busy_seconds + sum(now - since for since in self._running_since.values())
+        capacity = self.workers * max(now - self._started_at, 1e-9)
+        return {
+            "workers": self.workers,
+            "running": len(self._running_since),
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "worker_utilization": round(busy / capacity, 3),
+            "queue_wait_seconds": latency_summary(self._queue_waits),
+            "run_time_seconds": latency_summary(self._run_times),
+        }
+
+    def _wake_workers(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_runnable(self) -> Optional[str]:
+        """Pop the highest priority job admission control lets run, sessions of a priority take turns."""
+        for priority in sorted(self._pending):
+            sessions = self._pending[priority]
+            for key, job_ids in sessions.items():
+                if not self._can_dispatch(key):
+                    continue
+                job_id = job_ids.popleft()
+                # Back of the line for this session's next job
+                del sessions[key]
+                if job_ids:
+                    sessions[key] = job_ids
+                if not sessions:
+                    del self._pending[priority]
+                self._depth -= 1
+                return job_id
+        return None
+
+    def _can_dispatch(self, key: str) -> bool:
+        """Whether a job of the key would get an admission slot without waiting once it asks for one."""
+        if self.admission is None:
+            return True
+        return (self._running_by_key.get(key, 0) < self.admission.max_per_session
+                and self.admission.can_run(key))
+
+    async def _next_job(self) -> str:
+        while True:
+            job_id = self._next_runnable()
+            if job_id is not None:
+                return job_id
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._next_job()
+            job = self._jobs.get(job_id)
+            work = self._work.pop(job_id, None)
+            if job is None or work is None:
+                continue
+
+            self._running_by_key[job.admission_key] = self._running_by_key.get(job.admission_key, 0) + 1
+            job.status = RUNNING
+            job.stage = "started"
+            job.started_at = time.time()
+            self._queue_waits.append(job.started_at - job.created_at)
+            self._running_since[job.id] = time.monotonic()
+
+            try:
+                await self._publish(job, "started")
+                job.result = await work(job)
+                job.status = SUCCEEDED
+                job.progress = 1.0
+                self.succeeded += 1
+            except asyncio.CancelledError:
+                job.status = FAILED
+                job.error = "Job cancelled"
+                raise
+            except Exception as e:
+                logger.error(f"Try-on job {job.id} failed: {e}")
+                job.status = FAILED
+                job.error = str(e)
+                if isinstance(e, QueueFullError):
+                    job.retry_after = e.retry_after
+                self.failed += 1
+            finally:
+                remaining = self._running_by_key.pop(job.admission_key) - 1
+                if remaining:
+                    self._running_by_key[job.admission_key] = remaining
+                self._wake_workers()
+                job.stage = job.status
+                job.finished_at = time.time()
+                elapsed = time.monotonic() - self._running_since.pop(job.id)
+                self._busy_seconds += elapsed
+                self._run_times.append(elapsed)
+
+            await self._publish(job, job.status)
+
+    async def _publish(self, job: TryOnJob, event: str) -> None:
+        for events in self._subscribers.get(job.id, []):
+            events.put_nowait((event, job.to_dict()))
+        for listener in self.listeners:
+            try:
+                await listener(job, event)
+            except Exception as e:
+                logger.warning(f"Try-on job listener failed: {e}")
+
+    def _estimate_retry_after(self) -> float:
+        run_time = statistics.median(self._run_times) if self._run_times else 15.0
+        return round(run_time * max(1, self.depth) / max(1, self.workers), 1)
+
+    def _evict_finished(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        finished = [job for job in self._jobs.values() if job.done]
+        excess = len(finished) - self.max_finished
+        for job in finished:
+            if excess > 0 or job.finished_at < cutoff:
+                del self._jobs[job.id]
+                excess -= 1
+
+
+def latency_summary(samples) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "p50": round(statistics.median(ordered), 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+# Global instance for easy importing
+tryon_job_queue = TryOnJobQueue(
+    workers=settings.tryon_job_workers,
+    max_depth=settings.tryon_queue_max_depth,
+    retention_seconds=settings.tryon_job_retention_seconds
+)
@@ -0,0 +1,122 @@
+"""
+Cache of virtual try-on results.
+Results are keyed by the preprocessed person image, the product and the prompt version; each key
+maps to a result in the content-addressed result store, and the key index is persisted next to it.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config.settings import settings
+from services.tryon_result_store import TryOnResultStore, tryon_result_store
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+INDEX_FILENAME = "result_index.json"
+
+
+def result_key(person_digest: str, product_id: str, garment_digest: str, prompt_version: str) -> str:
+    """Cache key of a try-on result, a new version of the product's garment image gets a new key."""
+    return hashlib.sha256(f"{person_digest}|{product_id}|{garment_digest}|{prompt_version}".encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    """Index entry mapping a cache key to a stored result and its preview."""
+
+    def __init__(self, digest: str, created_at: float, preview: Optional[str] = None):
+        self.digest = digest
+        self.created_at = created_at
+        self.preview = preview
+
+
+class TryOnResultCache:
+    """
+    Index of cache keys to results in the result store.
+
+    Entries expire after the TTL, and entries whose result the store's retention removed are
+    dropped on lookup. The index is written to the results directory so it survives restarts.
+    """
+
+    def __init__(self, store: TryOnResultStore, ttl_seconds: float = 7 * 24 * 3600):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.index_path = Path(store.results_dir) / INDEX_FILENAME
+        self._index: Dict[str, CacheEntry] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Live entry of a key, without counting a hit or miss."""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > self.ttl_seconds or self.store.lookup(entry.digest) is None:
+            del self._index[key]
+            return None
+        if entry.preview is not None and self.store.lookup(entry.preview) is None:
+            entry.preview = None
+        return entry
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Cached result entry for a key, or None."""
+        entry = self.lookup(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def put(self, key: str, digest: str, preview: Optional[str] = None) -> None:
+        """Record the stored result (and preview) of a key and persist the index."""
+        self._index[key] = CacheEntry(digest, time.time(), preview)
+        snapshot = {key: [entry.digest, entry.created_at, entry.preview] for key, entry in self._index.items()}
+        try:
+            await asyncio.to_thread(self._write_index, snapshot)
+        except OSError as e:
+            logger.warning(f"Failed to persist try-on result index: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    def _write_index(self, snapshot: Dict[str, list]) -> None:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+
+    def _load_index(self) -> None:
+        try:
+            snapshot = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable try-on result index: {e}")
+            return
+        for key, values in snapshot.items():
+            self._index[key] = CacheEntry(*values)
+        if self._index:
+            logger.info(f"Loaded {len(self._index)} cached try-on result keys")
+
+
+# Global instance for easy importing
+tryon_result_cache = TryOnResultCache(
+    store=tryon_result_store,
+    ttl_seconds=settings.tryon_result_cache_ttl_seconds
+)
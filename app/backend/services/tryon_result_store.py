@@ -0,0 +1,198 @@
+"""
+Content-addressed store of virtual try-on result images.
+Each result is written once under the sha256 of its bytes and served by URL; a background
+retention job keeps the store within its disk quota and age limit.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# Result files are named after the sha256 of their content
+RESULT_FILE_PATTERN = re.compile(r"^tryon_([0-9a-f]{64})\.(png|webp|jpg|avif)$")
+
+# Files written by earlier versions, removed by the retention job once past the age limit
+LEGACY_FILE_PATTERN = re.compile(r"^tryon_.+\.png$")
+
+# File extension of each image format, and content type of each extension
+EXTENSIONS = {"PNG": "png", "WEBP": "webp", "JPEG": "jpg", "AVIF": "avif"}
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg", "avif": "image/avif"}
+
+
+class StoredResult:
+    def __init__(self, size: int, last_access: float, extension: str = "png"):
+        self.size = size
+        self.last_access = last_access
+        self.extension = extension
+
+
+class TryOnResultStore:
+    """
+    Write-once result files in the results directory.
+
+    Files are immutable once written, so they can be served with long-lived cache headers.
+    The index keeps them in least recently used order; retention removes files not used within
+    the age limit, then the least recently used ones beyond the quota.
+    """
+
+    def __init__(self, results_dir: str = "virtual_tryon_results", quota_bytes: int = 500 * 1024 * 1024,
+                 max_age_seconds: float = 7 * 24 * 3600):
+        self.results_dir = Path(results_dir)
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self._index: "OrderedDict[str, StoredResult]" = OrderedDict()
+        self._bytes = 0
+        self.removed = 0
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def filename(self, digest: str) -> str:
+        entry = self._index.get(digest)
+        return f"tryon_{digest}.{entry.extension if entry else 'png'}"
+
+    def content_type(self, digest: str) -> str:
+        entry = self._index.get(digest)
+        return CONTENT_TYPES[entry.extension if entry else "png"]
+
+    def path(self, digest: str) -> Path:
+        return self.results_dir / self.filename(digest)
+
+    def url(self, digest: str) -> str:
+        return f"/api/virtual-tryon-results/{self.filename(digest)}"
+
+    def lookup(self, digest: str) -> Optional[Path]:
+        """Path of a stored result, marking it recently used."""
+        entry = self._index.get(digest)
+        if entry is None:
+            return None
+        entry.last_access = time.time()
+        self._index.move_to_end(digest)
+        return self.path(digest)
+
+    async def read(self, digest: str) -> Optional[bytes]:
+        path = self.lookup(digest)
+        if path is None:
+            return None
+        try:
+            return await asyncio.to_thread(path.read_bytes)
+        except OSError:
+            self._forget(digest)
+            return None
+
+    async def put(self, data: bytes, format: str = "PNG") -> str:
+        """Store a result image and return its digest, identical results are written only once."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.lookup(digest) is None:
+            entry = StoredResult(len(data), time.time(), EXTENSIONS[format])
+            await asyncio.to_thread(self._write, self.results_dir / f"tryon_{digest}.{entry.extension}", data)
+            self._index[digest] = entry
+            self._bytes += len(data)
+        return digest
+
+    async def enforce_retention(self) -> int:
+        """
+        Remove results past the age limit, then least recently used ones beyond the quota.
+        The index is updated on the event loop, only the file removals run in a thread.
+        """
+        cutoff = time.time() - self.max_age_seconds
+        expired = []
+        for digest, entry in list(self._index.items()):
+            if entry.last_access >= cutoff and self._bytes <= self.quota_bytes:
+                break
+            expired.append((digest, self.path(digest)))
+            self._forget(digest)
+        removed = len(expired)
+        removed += await asyncio.to_thread(self._remove_files, [path for _, path in expired], cutoff)
+        # A result stored again while its file was being removed may have lost the file
+        for digest, _ in expired:
+            self._forget(digest)
+        if removed:
+            self.removed += removed
+            logger.info(f"Retention removed {removed} try-on results ({self._bytes} bytes kept)")
+        return removed
+
+    async def run_retention(self, interval: float = 300) -> None:
+        """Enforce retention periodically, runs until cancelled."""
+        while True:
+            try:
+                await self.enforce_retention()
+            except Exception as e:
+                logger.warning(f"Try-on result retention failed: {e}")
+            await asyncio.sleep(interval)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "results": len(self._index),
+            "bytes": self._bytes,
+            "quota_bytes": self.quota_bytes,
+            "removed": self.removed,
+        }
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _forget(self, digest: str) -> None:
+        entry = self._index.pop(digest, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _remove_files(self, paths: List[Path], cutoff: float) -> int:
+        """Remove expired result files and legacy files past the age limit, returns the legacy files removed."""
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return self._remove_legacy_files(cutoff)
+
+    def _remove_legacy_files(self, cutoff: float) -> int:
+        if not self.results_dir.is_dir():
+            return 0
+        removed = 0
+        for path in self.results_dir.iterdir():
+            if LEGACY_FILE_PATTERN.match(path.name) and not RESULT_FILE_PATTERN.match(path.name):
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+        return removed
+
+    def _load_index(self) -> None:
+        if not self.results_dir.is_dir():
+            return
+        files = []
+        for path in self.results_dir.iterdir():
+            match = RESULT_FILE_PATTERN.match(path.name)
+            if match:
+                stat = path.stat()
+                files.append((stat.st_mtime, match.group(1), stat.st_size, match.group(2)))
+        # Oldest first, file age stands in for the last access before the restart
+        for mtime, digest, size, extension in sorted(files):
+            self._index[digest] = StoredResult(size, mtime, extension)
+            self._bytes += size
+        if files:
+            logger.info(f"Loaded {len(files)} stored try-on results ({self._bytes} bytes)")
+
+
+# Global instance for easy importing
+tryon_result_store = TryOnResultStore(
+    results_dir=settings.tryon_results_dir,
+    quota_bytes=settings.tryon_results_quota_mb * 1024 * 1024,
+    max_age_seconds=settings.tryon_results_max_age_seconds
+)
@@ -1,8 +1,11 @@
 """
-Test endpoint for virtual try-on functionality.
-This allows direct testing of the virtual try-on pipeline.
+Virtual try-on HTTP endpoints.
+Try-ons run as queued jobs: clients submit a job and poll it or follow its server-sent events,
+the original synchronous endpoint waits for its job and remains for direct testing.
 """
 
+import asyncio
+import base64
 import json
 import logging
 import os
@@ -13,65 +16,166 @@ from aiohttp import web
 # Add parent directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent))
 
-from ragtools import _virtual_try_on_tool
-from search_manager import SearchManager
+from config.settings import settings
+from exceptions import QueueFullError, VirtualTryOnError
+from ragtools import submit_virtual_try_on, submit_virtual_try_on_batch, virtual_tryon_service
 from image_tools.image_utils import ImageService
+from services.garment_cache import garment_cache
+from services.image_upload import UploadRejected, is_streamed_upload, read_image_upload
+from services.person_photos import person_photo_store
+from services.tryon_jobs import PRIORITIES, tryon_job_queue
+from services.tryon_result_cache import tryon_result_cache
+from services.tryon_result_store import RESULT_FILE_PATTERN, tryon_result_store
+from session_tokens import session_tokens
 
 logger = logging.getLogger("virtual_tryon_endpoint")
 
 
-async def virtual_tryon_handler(request):
-    """Direct endpoint to test virtual try-on functionality."""
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Session-Id',
+}
+
+# Longest time the synchronous endpoint waits for its job
+SYNC_TIMEOUT_SECONDS = 120
+
+_default_image_service = None
+
+
+def _image_service(request):
+    """Image service of the app, or one built from the environment when running standalone."""
+    global _default_image_service
+    image_service = request.app.get('image_service')
+    if image_service is None:
+        if _default_image_service is None:
+            _default_image_service = ImageService(
+                storage_account=os.getenv("AZURE_STORAGE_ACCOUNT_NAME", "zalankoimages"),
+                container=os.getenv("AZURE_STORAGE_CONTAINER_NAME", "product-images")
+            )
+        image_service = _default_image_service
+    return image_service
+
+
+def _session_id(request):
+    """Session of a request, from the session token the realtime connection issued, or None."""
+    return session_tokens.verify(request.headers.get('X-Session-Id'))
+
+
+def _client_key(request):
+    """Admission key of a request without a session, anonymous clients are capped per address."""
+    return f"client:{request.remote}"
+
+
+async def _read_try_on_request(request):
+    """
+    Read the person image and fields of a try-on request.
+
+    Multipart (person_image file) and raw binary uploads are streamed with incremental limits,
+    JSON bodies with person_image_base64 are still accepted. A person_photo_id field (JSON or
+    form field, or query parameter) references a photo the session uploaded earlier instead.
+
+    Returns:
+        Tuple of (person image bytes or preprocessed photo, or None; fields)
+    """
+    streamed = is_streamed_upload(request)
+    data = dict(request.query)
+    if request.content_type == 'multipart/form-data':
+        person_image, data = await read_image_upload(request, file_field='person_image', file_required=False)
+        if 'person_photo_id' not in data:
+            return person_image, data
+    elif streamed and 'person_photo_id' not in request.query:
+        return await read_image_upload(request, file_field='person_image')
+    elif request.can_read_body and not streamed:
+        data.update(await request.json())
+    photo_id = data.pop('person_photo_id', None)
+    if photo_id:
+        photo = person_photo_store.get(_session_id(request), photo_id)
+        if photo is None:
+            raise UploadRejected('Unknown or expired person_photo_id, upload the photo again', status=404)
+        return photo, data
+
+    person_image_base64 = data.pop('person_image_base64', None)
+    if not person_image_base64:
+        return None, data
     try:
-        # Parse request body
-        data = await request.json()
-        product_id = data.get('product_id')
-        person_image_base64 = data.get('person_image_base64')
-        user_message = data.get('user_message', '')
+        return base64.b64decode(person_image_base64), data
+    except Exception:
+        raise UploadRejected('Invalid person_image_base64')
 
-        logger.info(f"🎬 Virtual try-on endpoint called for product: {product_id}")
 
-        if not product_id or not person_image_base64:
-            return web.json_response({
-                'error': 'Missing product_id or person_image_base64'
-            }, status=400)
-
-        # Initialize services (same as in main app)
-        search_manager = SearchManager(
-            service_name=os.getenv("AZURE_SEARCH_SERVICE_NAME"),
-            api_key=os.getenv("AZURE_SEARCH_API_KEY"),
-            index_name=os.getenv("AZURE_SEARCH_INDEX"),
-            embedding_model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL"),
-        )
+def _invalid_priority_response(priority: str):
+    """Error response for a priority outside PRIORITIES, or None if it is valid."""
+    if priority in PRIORITIES:
+        return None
+    return web.json_response({
+        'error': f"Invalid priority, expected one of: {', '.join(PRIORITIES)}"
+    }, status=400, headers=CORS_HEADERS)
 
-        image_service = ImageService(
-            storage_account=os.getenv("AZURE_STORAGE_ACCOUNT_NAME", "zalankoimages"),
-            container=os.getenv("AZURE_STORAGE_CONTAINER_NAME", "product-images")
-        )
 
-        # Call the virtual try-on tool directly
-        args = {
-            'product_id': product_id,
-            'user_image': person_image_base64,  # Map person_image_base64 to user_image
-            'user_message': user_message
-        }
+async def _submit_from_request(request, default_priority: str = "normal"):
+    """
+    Validate a try-on request and queue its job.
+
+    Returns:
+        Tuple of (job, error_response)
+    """
+    try:
+        person_image, fields = await _read_try_on_request(request)
+    except UploadRejected as e:
+        return None, web.json_response({'error': str(e)}, status=e.status, headers=CORS_HEADERS)
 
-        result = await _virtual_try_on_tool(args, image_service)
+    product_id = fields.get('product_id')
+    priority = fields.get('priority', default_priority)
 
-        # Convert ToolResult to JSON response
-        if hasattr(result, 'text'):
-            response_data = json.loads(result.to_text()) if isinstance(result.text, str) else result.text
-        else:
-            response_data = {'error': 'Invalid response from virtual try-on tool'}
+    if not product_id or not person_image:
+        return None, web.json_response({
+            'error': 'Missing product_id or person image'
+        }, status=400, headers=CORS_HEADERS)
+    error_response = _invalid_priority_response(priority)
+    if error_response is not None:
+        return None, error_response
 
-        logger.info(f"✅ Virtual try-on endpoint completed: {response_data.get('action', 'unknown')}")
+    try:
+        job = submit_virtual_try_on(product_id, person_image, _image_service(request),
+                                    session_id=_session_id(request), priority=priority,
+                                    admission_key=_client_key(request))
+    except QueueFullError as e:
+        return None, web.json_response({
+            'error': 'Virtual try-on queue is full',
+            'retry_after': e.retry_after
+        }, status=503, headers={**CORS_HEADERS, 'Retry-After': str(max(1, round(e.retry_after)))})
+    return job, None
+
+
+def _job_links(job) -> dict:
+    return {
+        'status_url': f'/api/virtual-tryon/jobs/{job.id}',
+        'events_url': f'/api/virtual-tryon/jobs/{job.id}/events',
+    }
+
+
+async def virtual_tryon_handler(request):
+    """Synchronous try-on, waits for its queued job to finish."""
+    try:
+        job, error_response = await _submit_from_request(request)
+        if error_response is not None:
+            return error_response
 
-        return web.json_response(response_data, headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        })
+        logger.info(f"🎬 Virtual try-on endpoint called for product: {job.product_id}")
+        job = await tryon_job_queue.wait(job.id, timeout=SYNC_TIMEOUT_SECONDS)
+        if job.retry_after is not None:
+            return web.json_response({
+                'error': job.error,
+                'retry_after': job.retry_after
+            }, status=503, headers={**CORS_HEADERS, 'Retry-After': str(max(1, round(job.retry_after)))})
+        response_data = job.result if job.result is not None else {'error': job.error}
+
+        logger.info(f"✅ Virtual try-on endpoint completed: {response_data.get('action', 'unknown')}")
+        return web.json_response(response_data, headers=CORS_HEADERS)
 
+    except asyncio.TimeoutError:
+        return web.json_response({'error': 'Virtual try-on timed out'}, status=504, headers=CORS_HEADERS)
     except Exception as e:
         logger.error(f"❌ Virtual try-on endpoint error: {e}")
         import traceback
@@ -79,48 +183,211 @@ async def virtual_tryon_handler(request):
 
         return web.json_response({
             'error': f'Server error: {str(e)}'
-        }, status=500, headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        })
+        }, status=500, headers=CORS_HEADERS)
+
+
+async def create_tryon_job_handler(request):
+    """Queue a try-on job and return its id immediately (202)."""
+    try:
+        job, error_response = await _submit_from_request(request)
+        if error_response is not None:
+            return error_response
+        return web.json_response({**job.to_dict(), **_job_links(job)}, status=202, headers=CORS_HEADERS)
+    except Exception as e:
+        logger.error(f"❌ Failed to create try-on job: {e}")
+        return web.json_response({'error': f'Server error: {str(e)}'}, status=500, headers=CORS_HEADERS)
+
+
+def _product_ids(fields) -> list:
+    """Product ids of a batch request, a JSON list or a comma separated form/query field."""
+    product_ids = fields.get('product_ids') or []
+    if isinstance(product_ids, str):
+        product_ids = product_ids.split(',')
+    return list(dict.fromkeys(str(product_id).strip() for product_id in product_ids if str(product_id).strip()))
+
+
+async def batch_tryon_handler(request):
+    """
+    Try one person photo on several products.
+
+    The response streams newline-delimited JSON: first the queued jobs, then each finished job
+    (with its result) as soon as it is ready, in completion order.
+    """
+    try:
+        person_image, fields = await _read_try_on_request(request)
+    except UploadRejected as e:
+        return web.json_response({'error': str(e)}, status=e.status, headers=CORS_HEADERS)
+
+    product_ids = _product_ids(fields)
+    priority = fields.get('priority', 'normal')
+    max_products = settings.tryon_batch_max_products
+    if not product_ids or not person_image:
+        return web.json_response({'error': 'Missing product_ids or person image'}, status=400, headers=CORS_HEADERS)
+    if len(product_ids) > max_products:
+        return web.json_response({'error': f'At most {max_products} products per batch'}, status=400, headers=CORS_HEADERS)
+    error_response = _invalid_priority_response(priority)
+    if error_response is not None:
+        return error_response
+
+    try:
+        jobs = await submit_virtual_try_on_batch(product_ids, person_image, _image_service(request),
+                                                 session_id=_session_id(request), priority=priority,
+                                                 admission_key=_client_key(request))
+    except VirtualTryOnError as e:
+        return web.json_response({'error': str(e)}, status=400, headers=CORS_HEADERS)
+    except QueueFullError as e:
+        return web.json_response({
+            'error': 'Virtual try-on queue is full',
+            'retry_after': e.retry_after
+        }, status=503, headers={**CORS_HEADERS, 'Retry-After': str(max(1, round(e.retry_after)))})
+
+    logger.info(f"🎬 Batch virtual try-on queued for {len(jobs)} products")
+    response = web.StreamResponse(headers={
+        **CORS_HEADERS,
+        'Content-Type': 'application/x-ndjson',
+        'Cache-Control': 'no-cache',
+    })
+    await response.prepare(request)
+
+    async def send(payload: dict) -> None:
+        await response.write((json.dumps(payload) + '\n').encode('utf-8'))
+
+    async def finished(job):
+        try:
+            return await tryon_job_queue.wait(job.id, timeout=SYNC_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return job
+
+    try:
+        await send({'event': 'queued', 'jobs': [{**job.to_dict(), **_job_links(job)} for job in jobs]})
+        for next_finished in asyncio.as_completed([finished(job) for job in jobs]):
+            job = await next_finished
+            await send({'event': job.status if job.done else 'timeout', 'job': job.to_dict()})
+        await send({'event': 'done'})
+    except ConnectionResetError:
+        pass
+    return response
+
+
+async def get_tryon_job_handler(request):
+    """Poll a try-on job."""
+    job = tryon_job_queue.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'error': 'Job not found'}, status=404, headers=CORS_HEADERS)
+    return web.json_response({**job.to_dict(), **_job_links(job)}, headers=CORS_HEADERS)
+
+
+async def tryon_job_events_handler(request):
+    """Stream a try-on job's progress as server-sent events until it finishes."""
+    job = tryon_job_queue.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'error': 'Job not found'}, status=404, headers=CORS_HEADERS)
+
+    response = web.StreamResponse(headers={
+        **CORS_HEADERS,
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+    })
+    await response.prepare(request)
+
+    async def send(event: str, payload: dict) -> None:
+        await response.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+    events = tryon_job_queue.subscribe(job.id)
+    try:
+        await send(job.status, job.to_dict())
+        while not job.done:
+            event, payload = await events.get()
+            await send(event, payload)
+    except ConnectionResetError:
+        pass
+    finally:
+        tryon_job_queue.unsubscribe(job.id, events)
+    return response
+
+
+async def upload_person_photo_handler(request):
+    """
+    Store the session's person photo once, validated and preprocessed, and return its handle.
+    Later try-on requests of the session pass person_photo_id instead of the photo.
+    """
+    session_id = _session_id(request)
+    if not session_id:
+        return web.json_response({'error': 'Missing or invalid X-Session-Id header'}, status=400, headers=CORS_HEADERS)
+    if virtual_tryon_service is None:
+        return web.json_response({'error': 'Virtual try-on service is not configured'}, status=503, headers=CORS_HEADERS)
+
+    try:
+        person_image, _ = await _read_try_on_request(request)
+    except UploadRejected as e:
+        return web.json_response({'error': str(e)}, status=e.status, headers=CORS_HEADERS)
+    if person_image is None:
+        return web.json_response({'error': 'Missing person image'}, status=400, headers=CORS_HEADERS)
+    if isinstance(person_image, bytes):
+        person_image, error = await virtual_tryon_service.prepare_person_image(person_image)
+        if error:
+            return web.json_response({'error': error}, status=400, headers=CORS_HEADERS)
+
+    try:
+        photo_id = person_photo_store.put(session_id, person_image)
+    except VirtualTryOnError as e:
+        return web.json_response({'error': str(e)}, status=413, headers=CORS_HEADERS)
+    return web.json_response({
+        'person_photo_id': photo_id,
+        'width': person_image.width,
+        'height': person_image.height,
+        'expires_in': person_photo_store.ttl_seconds,
+    }, status=201, headers=CORS_HEADERS)
+
+
+async def delete_person_photo_handler(request):
+    """Forget a stored person photo of the session."""
+    if not person_photo_store.delete(_session_id(request) or '', request.match_info['photo_id']):
+        return web.json_response({'error': 'Photo not found'}, status=404, headers=CORS_HEADERS)
+    return web.Response(status=204, headers=CORS_HEADERS)
+
+
+async def tryon_metrics_handler(request):
+    """Try-on queue latency, worker utilization, admission control, backend and cache hit rates."""
+    return web.json_response({
+        'jobs': tryon_job_queue.metrics(),
+        'admission': virtual_tryon_service.admission.metrics() if virtual_tryon_service is not None else None,
+        'backend': virtual_tryon_service.backend.metrics() if virtual_tryon_service is not None else None,
+        'result_store': tryon_result_store.metrics(),
+        'result_cache': tryon_result_cache.metrics(),
+        'garment_cache': garment_cache.metrics(),
+        'person_photos': person_photo_store.metrics(),
+    }, headers=CORS_HEADERS)
 
 
 async def virtual_tryon_options_handler(request):
     """Handle CORS preflight OPTIONS requests."""
-    return web.Response(
-        headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        }
-    )
+    return web.Response(headers=CORS_HEADERS)
 
 async def virtual_tryon_result_handler(request):
-    """Serve virtual try-on result images."""
+    """
+    Serve virtual try-on result images from the result store.
+
+    Results are content addressed and never rewritten, so they are cacheable forever. FileResponse
+    sends the file with sendfile, answers Range requests and derives a strong ETag from the file's
+    modification time and size, which stay fixed for the life of a stored result.
+    """
     try:
         filename = request.match_info['filename']
 
-        # Security: only allow specific pattern
-        if not filename.startswith('tryon_') or not filename.endswith('.png'):
-            return web.Response(status=404, text="File not found")
-
-        # Get the file path
-        results_dir = Path("virtual_tryon_results")
-        file_path = results_dir / filename
-
-        if not file_path.exists():
-            logger.warning(f"Virtual try-on result file not found: {file_path}")
-            return web.Response(status=404, text="File not found")
-
-        logger.info(f"📥 Serving virtual try-on result: {filename} ({file_path.stat().st_size} bytes)")
+        # Security: only content-addressed result files are served
+        stored = RESULT_FILE_PATTERN.match(filename)
+        file_path = tryon_result_store.lookup(stored.group(1)) if stored else None
+        if file_path is None or file_path.name != filename or not file_path.exists():
+            logger.warning(f"Virtual try-on result not found: {filename}")
+            return web.Response(status=404, text="File not found", headers=CORS_HEADERS)
 
         return web.FileResponse(
             file_path,
             headers={
-                'Content-Type': 'image/png',
-                'Access-Control-Allow-Origin': '*',
-                'Content-Disposition': f'attachment; filename="{filename}"'
+                **CORS_HEADERS,
+                'Content-Type': tryon_result_store.content_type(stored.group(1)),
+                'Cache-Control': 'public, max-age=31536000, immutable',
             }
         )
 
@@ -133,6 +400,18 @@ def setup_virtual_tryon_routes(app):
     app.router.add_post('/api/virtual-tryon', virtual_tryon_handler)
     app.router.add_options('/api/virtual-tryon', virtual_tryon_options_handler)
     app.router.add_get('/api/virtual-tryon-results/{filename}', virtual_tryon_result_handler)
+    app.router.add_post('/api/virtual-tryon/jobs', create_tryon_job_handler)
+    app.router.add_options('/api/virtual-tryon/jobs', virtual_tryon_options_handler)
+    app.router.add_post('/api/virtual-tryon/batch', batch_tryon_handler)
+    app.router.add_options('/api/virtual-tryon/batch', virtual_tryon_options_handler)
+    app.router.add_get('/api/virtual-tryon/jobs/{job_id}', get_tryon_job_handler)
+    app.router.add_get('/api/virtual-tryon/jobs/{job_id}/events', tryon_job_events_handler)
+    app.router.add_get('/api/virtual-tryon/metrics', tryon_metrics_handler)
+    app.router.add_post('/api/virtual-tryon/person-photos', upload_person_photo_handler)
+    app.router.add_options('/api/virtual-tryon/person-photos', virtual_tryon_options_handler)
+    app.router.add_delete('/api/virtual-tryon/person-photos/{photo_id}', delete_person_photo_handler)
+    app.router.add_options('/api/virtual-tryon/person-photos/{photo_id}', virtual_tryon_options_handler)
     logger.info("🔗 Virtual try-on test endpoint added: POST /api/virtual-tryon")
     logger.info("🔗 Virtual try-on OPTIONS endpoint added: OPTIONS /api/virtual-tryon")
-    logger.info("🔗 Virtual try-on results endpoint added: GET /api/virtual-tryon-results/{filename}")
\ No newline at end of file
+    logger.info("🔗 Virtual try-on results endpoint added: GET /api/virtual-tryon-results/{filename}")
+    logger.info("🔗 Virtual try-on job endpoints added: /api/virtual-tryon/jobs, /api/virtual-tryon/batch, /api/virtual-tryon/person-photos, /api/virtual-tryon/metrics")
\ No newline at end of file
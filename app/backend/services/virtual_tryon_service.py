@@ -1,52 +1,105 @@
 """
 Virtual Try-On Service for Zalanko Fashion Platform
-Integrates Google Vertex AI Gemini 2.5 Flash Image Preview for virtual try-on functionality.
+Prepares images, caches results and admits generations; the images are generated by a pluggable
+backend, Google Vertex AI Gemini 2.5 Flash Image Preview by default.
 """
 
-import os
-import base64
+import asyncio
+import hashlib
 import logging
-from typing import Optional, Tuple, Dict, Any
-from io import BytesIO
-
-from PIL import Image
-from google import genai
-from google.genai import types
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Any, Union
+
+from config.settings import settings
+from exceptions import ImageProcessingError, QueueFullError
+from image_tools.image_pipeline import (
+    ProcessedImage, encode_variants, inspect_image, process_image, process_image_async, run_in_pool,
+    sniff_format
+)
+from services.admission import AdmissionController
+from services.tryon_backends import TryOnBackend, create_backend
+from services.tryon_result_cache import TryOnResultCache, result_key, tryon_result_cache
+from services.tryon_result_store import TryOnResultStore, tryon_result_store
 
 logger = logging.getLogger("virtual_tryon")
 
+# Bump when the prompt or generation settings change, cached results of older versions are not reused
+PROMPT_VERSION = "1"
+
 
 class VirtualTryOnError(Exception):
     """Custom exception for virtual try-on related errors."""
     pass
 
 
+class TryOnOutcome:
+    """
+    Result of a try-on generation.
+
+    Results are referenced by their digest in the result store, with a small preview variant next to
+    the full-resolution image; image holds the encoded bytes of a freshly generated result (of
+    content_type) and is None when the result was served from the cache.
+    """
+
+    def __init__(self, success: bool, image: Optional[bytes] = None, error: Optional[str] = None,
+                 cache_key: Optional[str] = None, cached: bool = False, result_id: Optional[str] = None,
+                 retry_after: Optional[float] = None, preview_id: Optional[str] = None,
+                 content_type: Optional[str] = None):
+        self.success = success
+        self.image = image
+        self.content_type = content_type
+        self.error = error
+        self.cache_key = cache_key
+        self.cached = cached
+        self.result_id = result_id
+        self.preview_id = preview_id
+        # Set when the call was turned away by admission control
+        self.retry_after = retry_after
+
+
 class VirtualTryOnService:
-    """Service for generating virtual try-on images using Google Vertex AI."""
+    """Service for generating virtual try-on images with a try-on backend."""
 
-    def __init__(self):
-        """Initialize the virtual try-on service with Google Cloud credentials."""
-        self.api_key = os.environ.get("GOOGLE_CLOUD_API_KEY")
-        self.project_id = os.environ.get("GOOGLE_CLOUD_PROJECT_ID")
+    def __init__(self, result_store: Optional[TryOnResultStore] = None,
+                 result_cache: Optional[TryOnResultCache] = None,
+                 admission: Optional[AdmissionController] = None,
+                 backend: Optional[TryOnBackend] = None):
+        """
+        Initialize the virtual try-on service.
 
-        if not self.api_key or not self.project_id:
-            raise VirtualTryOnError("Google Cloud credentials not found in environment")
+        The backend defaults to the one selected by VIRTUAL_TRYON_BACKEND; the Vertex AI backend
+        raises ConfigurationError without Google Cloud credentials.
+        """
+        # Generated results are written to the store and served from it by URL
+        self.result_store = result_store
+        # Results are cached by (preprocessed person image, product, preprocessed garment image, prompt version)
+        self.result_cache = result_cache if result_store is not None else None
+        # Digest of the uploaded bytes -> digest of the preprocessed image, so repeated uploads skip preprocessing
+        self._person_digests: "OrderedDict[str, str]" = OrderedDict()
+        self._garment_digests: "OrderedDict[str, str]" = OrderedDict()
+
+        self.backend = backend or create_backend()
+
+        # Generated images are re-encoded (WEBP, JPEG or PNG) at full resolution plus a preview
+        self.result_format = settings.tryon_result_format
+        self.result_quality = settings.tryon_result_quality
+        self.preview_dimension = settings.tryon_preview_dimension
+        self.preview_quality = settings.tryon_preview_quality
+
+        # Bound the generations in flight per worker, overall and per session: each holds several MB
+        # of images and counts against the Vertex AI quota
+        self.admission = admission or AdmissionController(
+            max_concurrent=settings.tryon_max_concurrency,
+            max_per_session=settings.tryon_max_per_session,
+            max_waiting=settings.tryon_max_waiting
+        )
 
-        try:
-            self.client = genai.Client(
-                vertexai=True,
-                api_key=self.api_key
-            )
-            # Use global location for image generation capability
-            self.model = f"projects/{self.project_id}/locations/global/publishers/google/models/gemini-2.5-flash-image-preview"
-            logger.info("✅ VirtualTryOnService initialized successfully")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize VirtualTryOnService: {e}")
-            raise VirtualTryOnError(f"Failed to initialize Vertex AI client: {e}")
+        logger.info(f"✅ VirtualTryOnService initialized with the {self.backend.name} backend")
 
     def validate_image(self, image_data: bytes, max_size_mb: int = 10) -> bool:
         """
         Validate image data for virtual try-on processing.
+        Only the image header is read, pixels are not decoded.
 
         Args:
             image_data: Raw image bytes
@@ -56,26 +109,11 @@ class VirtualTryOnService:
             True if image is valid, False otherwise
         """
         try:
-            # Check file size
-            if len(image_data) > max_size_mb * 1024 * 1024:
-                logger.warning(f"Image too large: {len(image_data)} bytes")
-                return False
-
-            # Validate image format
-            img = Image.open(BytesIO(image_data))
-
-            # Check dimensions (reasonable size for processing)
-            width, height = img.size
-            if width < 200 or height < 200 or width > 8000 or height > 8000:
-                logger.warning(f"Image dimensions out of range: {width}x{height}")
-                return False
-
+            width, height = inspect_image(image_data, max_size_mb).size
             logger.info(f"✅ Image dimensions valid: {width}x{height}")
-
             return True
-
-        except Exception as e:
-            logger.error(f"Image validation failed: {e}")
+        except ImageProcessingError as e:
+            logger.warning(f"Image validation failed: {e}")
             return False
 
     def preprocess_image(self, image_data: bytes, target_format: str = "JPEG") -> bytes:
@@ -90,31 +128,48 @@ class VirtualTryOnService:
             Preprocessed image bytes
         """
         try:
-            img = Image.open(BytesIO(image_data))
-
-            # Convert to RGB if needed
-            if img.mode != 'RGB' and target_format == "JPEG":
-                img = img.convert('RGB')
-            elif img.mode != 'RGBA' and target_format == "PNG":
-                img = img.convert('RGBA')
-
-            # Resize if too large (maintain aspect ratio)
-            max_dimension = 1024
-            if max(img.size) > max_dimension:
-                ratio = max_dimension / max(img.size)
-                new_size = tuple(int(dim * ratio) for dim in img.size)
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-                logger.info(f"Resized image to {new_size}")
-
-            # Save to bytes
-            buffer = BytesIO()
-            img.save(buffer, format=target_format, quality=90 if target_format == "JPEG" else None)
-            return buffer.getvalue()
-
-        except Exception as e:
+            return process_image(image_data, target_format).data
+        except ImageProcessingError as e:
             logger.error(f"Image preprocessing failed: {e}")
             raise VirtualTryOnError(f"Failed to preprocess image: {e}")
 
+    async def prepare_images(
+        self,
+        person_image: Union[bytes, ProcessedImage],
+        clothing_image: Union[bytes, ProcessedImage]
+    ) -> Tuple[Optional[ProcessedImage], Optional[ProcessedImage], Optional[str]]:
+        """
+        Validate and preprocess both images in the image process pool, each decoded once.
+        Images that are already preprocessed (e.g. a batch's person photo, or a garment from the
+        garment cache) are used as is.
+
+        Returns:
+            Tuple of (person, clothing, error_message)
+        """
+        async def prepared(image, target_format):
+            if isinstance(image, ProcessedImage):
+                return image
+            return await process_image_async(image, target_format)
+
+        person, clothing = await asyncio.gather(
+            prepared(person_image, "JPEG"),
+            prepared(clothing_image, "PNG"),
+            return_exceptions=True
+        )
+        if isinstance(person, ImageProcessingError):
+            logger.warning(f"Invalid person image: {person}")
+            return None, None, "Invalid person image"
+        if isinstance(clothing, ImageProcessingError):
+            logger.warning(f"Invalid clothing image: {clothing}")
+            return None, None, "Invalid clothing image"
+        for result in (person, clothing):
+            if isinstance(result, BaseException):
+                raise result
+
+        logger.info(f"Prepared person image {person.source_width}x{person.source_height} -> "
+                    f"{person.width}x{person.height}, clothing image {clothing.width}x{clothing.height}")
+        return person, clothing, None
+
     async def generate_virtual_tryon(
         self,
         person_image: bytes,
@@ -124,101 +179,148 @@ class VirtualTryOnService:
         """
         Generate virtual try-on image using Vertex AI.
 
-        Args:
-            person_image: Person's photo as bytes
-            clothing_image: Clothing item image as bytes
-            product_info: Optional product information for better prompting
-
         Returns:
             Tuple of (success, image_bytes, error_message)
         """
+        outcome = await self.generate(person_image, clothing_image, product_info)
+        image = outcome.image
+        if image is None and outcome.result_id is not None:
+            image = await self.result_store.read(outcome.result_id)
+        return outcome.success, image, outcome.error
+
+    async def prepare_person_image(self, person_image: bytes) -> Tuple[Optional[ProcessedImage], Optional[str]]:
+        """
+        Preprocess a person photo once for several try-ons.
+
+        Returns:
+            Tuple of (person, error_message)
+        """
         try:
-            logger.info("🔄 Starting virtual try-on generation")
+            return await process_image_async(person_image, "JPEG"), None
+        except ImageProcessingError as e:
+            logger.warning(f"Invalid person image: {e}")
+            return None, "Invalid person image"
+
+    async def generate(
+        self,
+        person_image: Union[bytes, ProcessedImage],
+        clothing_image: Union[bytes, ProcessedImage],
+        product_info: Optional[Dict[str, Any]] = None,
+        admission_key: Optional[str] = None
+    ) -> TryOnOutcome:
+        """
+        Generate a virtual try-on image, serving repeated requests from the result cache.
 
-            # Validate images
-            if not self.validate_image(person_image):
-                return False, None, "Invalid person image"
+        Image preparation runs in the image process pool and the model is called through the async
+        client, so the event loop keeps serving other sessions while a try-on is generated.
 
-            if not self.validate_image(clothing_image):
-                return False, None, "Invalid clothing image"
+        Args:
+            person_image: Person's photo as bytes, or already preprocessed
+            clothing_image: Clothing item image as bytes, or already preprocessed
+            product_info: Optional product information for better prompting
+            admission_key: Session the try-on is for, or the key of an anonymous caller, its
+                concurrent model calls are capped
 
-            # Preprocess images
-            person_processed = self.preprocess_image(person_image, "JPEG")
-            clothing_processed = self.preprocess_image(clothing_image, "PNG")
+        Returns:
+            TryOnOutcome with the image, or the error message
+        """
+        try:
+            logger.info("🔄 Starting virtual try-on generation")
+            product_id = (product_info or {}).get("id")
+
+            # A photo and garment image seen before map straight to their cache key without preprocessing
+            cache_key = None
+            person_upload, garment_upload = self._upload_digest(person_image), self._upload_digest(clothing_image)
+            if self.result_cache is not None and product_id and person_upload in self._person_digests \
+                    and garment_upload in self._garment_digests:
+                cache_key = self._cache_key(self._person_digests[person_upload], product_id,
+                                            self._garment_digests[garment_upload])
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"⚡ Virtual try-on served from cache for {product_id}")
+                    return TryOnOutcome(True, cache_key=cache_key, cached=True,
+                                        result_id=cached.digest, preview_id=cached.preview)
+
+            # Validate and preprocess images
+            person_processed, clothing_processed, error = await self.prepare_images(person_image, clothing_image)
+            if error:
+                return TryOnOutcome(False, error=error)
+
+            if self.result_cache is not None and product_id:
+                self._remember_digest(self._person_digests, person_upload, person_processed.digest)
+                self._remember_digest(self._garment_digests, garment_upload, clothing_processed.digest)
+                if cache_key is None:
+                    cache_key = self._cache_key(person_processed.digest, product_id, clothing_processed.digest)
+                    cached = self.result_cache.get(cache_key)
+                    if cached is not None:
+                        logger.info(f"⚡ Virtual try-on served from cache for {product_id}")
+                        return TryOnOutcome(True, cache_key=cache_key, cached=True,
+                                            result_id=cached.digest, preview_id=cached.preview)
 
             # Create enhanced prompt based on product info
             prompt_text = self._create_enhanced_prompt(product_info)
 
-            # Create content with images and prompt
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part(text=prompt_text),
-                        types.Part(
-                            inline_data=types.Blob(
-                                data=person_processed,
-                                mime_type="image/jpeg"
-                            )
-                        ),
-                        types.Part(
-                            inline_data=types.Blob(
-                                data=clothing_processed,
-                                mime_type="image/png"
-                            )
-                        )
-                    ]
-                )
-            ]
-
-            # Configure generation parameters
-            generate_content_config = types.GenerateContentConfig(
-                temperature=0.7,
-                top_p=0.95,
-                max_output_tokens=32768,
-                response_modalities=["TEXT", "IMAGE"],
-                safety_settings=[
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HATE_SPEECH",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HARASSMENT",
-                        threshold="OFF"
-                    )
-                ]
-            )
-
-            # Generate virtual try-on
-            logger.info("📡 Sending request to Vertex AI...")
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=generate_content_config
-            )
-
-            logger.info("✅ Received response from Vertex AI")
-
-            # Extract image from response
-            result_image = self._extract_image_from_response(response)
+            # Generate virtual try-on, only the model call holds an admission slot
+            async with self.admission.slot(admission_key):
+                result_image = await self.backend.generate(person_processed, clothing_processed, prompt_text)
+
             if result_image:
                 logger.info(f"🎉 Virtual try-on generated successfully: {len(result_image)} bytes")
-                return True, result_image, None
+                full, preview = await self._encode_result(result_image)
+                result_id = preview_id = None
+                if self.result_store is not None:
+                    try:
+                        result_id = await self.result_store.put(full.data, full.format)
+                        if preview is not None:
+                            preview_id = await self.result_store.put(preview.data, preview.format)
+                    except OSError as e:
+                        logger.warning(f"⚠️ Failed to store try-on result: {e}")
+                    if cache_key is not None and result_id is not None:
+                        await self.result_cache.put(cache_key, result_id, preview_id)
+                return TryOnOutcome(True, full.data, cache_key=cache_key, result_id=result_id, preview_id=preview_id,
+                                    content_type=full.mime_type)
             else:
                 logger.warning("⚠️ No image found in response")
-                return False, None, "No image generated in response"
+                return TryOnOutcome(False, error="No image generated in response")
 
+        except QueueFullError as e:
+            return TryOnOutcome(False, error=str(e), retry_after=e.retry_after)
         except Exception as e:
             logger.error(f"❌ Virtual try-on generation failed: {e}")
-            return False, None, f"Generation failed: {str(e)}"
+            return TryOnOutcome(False, error=f"Generation failed: {str(e)}")
+
+    async def _encode_result(self, image: bytes) -> Tuple[ProcessedImage, Optional[ProcessedImage]]:
+        """
+        Re-encode a generated image and its preview in the image process pool.
+        Falls back to the image as generated, without a preview, when it cannot be re-encoded.
+        """
+        try:
+            full, preview = await run_in_pool(encode_variants, image, self.result_format, self.result_quality,
+                                              self.preview_dimension, self.preview_quality)
+            logger.info(f"Encoded try-on result as {full.format}: {len(image)} -> {len(full.data)} bytes, "
+                        f"preview {len(preview.data)} bytes")
+            return full, preview
+        except ImageProcessingError as e:
+            source_format = sniff_format(image)
+            if source_format is None:
+                raise ImageProcessingError(f"Generated image is in an unknown format: {e}")
+            logger.warning(f"⚠️ Failed to re-encode try-on result, keeping it as generated ({source_format}): {e}")
+            return ProcessedImage(image, source_format, 0, 0, source_format, 0, 0, len(image)), None
+
+    def _cache_key(self, person_digest: str, product_id: str, garment_digest: str) -> str:
+        version = f"{PROMPT_VERSION}/{self.backend.version}/{self.result_format}"
+        return result_key(person_digest, product_id, garment_digest, version)
+
+    @staticmethod
+    def _upload_digest(image: Union[bytes, ProcessedImage]) -> str:
+        return image.digest if isinstance(image, ProcessedImage) else hashlib.sha256(image).hexdigest()
+
+    @staticmethod
+    def _remember_digest(digests: "OrderedDict[str, str]", upload_digest: str, processed_digest: str) -> None:
+        digests[upload_digest] = processed_digest
+        digests.move_to_end(upload_digest)
+        while len(digests) > 1024:
+            digests.popitem(last=False)
 
     def _create_enhanced_prompt(self, product_info: Optional[Dict[str, Any]] = None) -> str:
         """Create an enhanced prompt based on product information."""
@@ -244,44 +346,14 @@ class VirtualTryOnService:
 
         return base_prompt
 
-    def _extract_image_from_response(self, response) -> Optional[bytes]:
-        """Extract image data from Vertex AI response."""
-        try:
-            if hasattr(response, 'candidates') and response.candidates:
-                for candidate in response.candidates:
-                    if hasattr(candidate, 'content') and candidate.content:
-                        if hasattr(candidate.content, 'parts'):
-                            for part in candidate.content.parts:
-                                if hasattr(part, 'inline_data') and part.inline_data:
-                                    if hasattr(part.inline_data, 'data'):
-                                        image_data = part.inline_data.data
-
-                                        # Handle different data types
-                                        if isinstance(image_data, str):
-                                            # Base64 string
-                                            return base64.b64decode(image_data)
-                                        elif isinstance(image_data, bytes):
-                                            # Already bytes
-                                            return image_data
-                                        else:
-                                            logger.warning(f"Unexpected image data type: {type(image_data)}")
-
-            return None
-
-        except Exception as e:
-            logger.error(f"Failed to extract image from response: {e}")
-            return None
-
     async def health_check(self) -> bool:
         """Check if the virtual try-on service is healthy."""
         try:
-            # Simple API connectivity test
-            # Note: This doesn't actually call the model but verifies client setup
-            return bool(self.client and self.api_key and self.project_id)
+            return await self.backend.health_check()
         except Exception as e:
             logger.error(f"Health check failed: {e}")
             return False
 
 
 # Global instance for easy importing
-virtual_tryon_service = VirtualTryOnService()
\ No newline at end of file
+virtual_tryon_service = VirtualTryOnService(result_store=tryon_result_store, result_cache=tryon_result_cache)
\ No newline at end of file
@@ -0,0 +1,51 @@
+"""
+Server-issued session tokens.
+The realtime middle tier generates every session id itself and hands the client a token binding
+it, which the client presents when reconnecting and on HTTP requests (X-Session-Id) so that
+state, photos and jobs can only be attached to a session the server issued.
+"""
+
+import hashlib
+import hmac
+import os
+import re
+import secrets
+from typing import Optional
+
+# Session ids are generated as uuid4 hex strings
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+SIGNATURE_LENGTH = 32
+
+
+class SessionTokens:
+    """
+    Issues and verifies tokens of the form "<session id>.<signature>", signed with HMAC-SHA256.
+
+    Without a configured secret a random one is used, so tokens do not survive a restart and
+    clients are simply given a new session.
+    """
+
+    def __init__(self, secret: Optional[str] = None):
+        self._key = (secret or secrets.token_hex(32)).encode("utf-8")
+
+    def issue(self, session_id: str) -> str:
+        return f"{session_id}.{self._sign(session_id)}"
+
+    def verify(self, token: Optional[str]) -> Optional[str]:
+        """Session id bound by a token, or None if the token is missing, malformed or forged."""
+        if not token:
+            return None
+        session_id, _, signature = token.partition(".")
+        if not _SESSION_ID_PATTERN.match(session_id):
+            return None
+        if not hmac.compare_digest(signature, self._sign(session_id)):
+            return None
+        return session_id
+
+    def _sign(self, session_id: str) -> str:
+        return hmac.new(self._key, session_id.encode("utf-8"), hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+
+# Global instance for easy importing
+session_tokens = SessionTokens(os.environ.get("SESSION_SECRET"))
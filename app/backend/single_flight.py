@@ -0,0 +1,52 @@
+"""
+Single-flight execution of concurrent async calls.
+Callers asking for the same key while a call is in flight wait for its result instead of
+starting their own, e.g. to download a blob or generate an image only once.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    In-flight calls keyed by what they produce.
+
+    The first caller of a key runs the call, later callers join it through asyncio.shield, so
+    a joiner being cancelled does not cancel the shared call. If the first caller is cancelled
+    the shared call is cancelled for every joiner, if it fails they all receive its exception.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """Run call for a key, or join the call already in flight for it."""
+        in_flight = self._calls.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await call()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody joined the call
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,22 @@
+"""
+Placeholder configuration for running unit tests without Azure or Google Cloud access.
+Settings are validated on import, so this must run before importing backend modules.
+"""
+
+import os
+
+OFFLINE_ENV = {
+    "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "test-key",
+    "AZURE_OPENAI_REALTIME_DEPLOYMENT": "gpt-4o-realtime",
+    "AZURE_SEARCH_SERVICE_NAME": "example-search",
+    "AZURE_SEARCH_API_KEY": "test-key",
+    "GOOGLE_CLOUD_API_KEY": "test-key",
+    "GOOGLE_CLOUD_PROJECT_ID": "test-project",
+}
+
+
+def apply_offline_env() -> None:
+    """Fill in any missing required settings with placeholders."""
+    for key, value in OFFLINE_ENV.items():
+        os.environ.setdefault(key, value)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Unit tests for try-on admission control.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from exceptions import QueueFullError
+from services.admission import AdmissionController
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    """Global and per-session caps, fair wait queue and fast rejection"""
+
+    async def asyncSetUp(self):
+        self.order = []
+        self.in_flight = {}
+        self.max_in_flight = {}
+
+    def call(self, controller, session, name, delay=0.02):
+        async def run():
+            async with controller.slot(session):
+                self.order.append(name)
+                self.in_flight[session] = self.in_flight.get(session, 0) + 1
+                self.max_in_flight[session] = max(self.max_in_flight.get(session, 0), self.in_flight[session])
+                await asyncio.sleep(delay)
+                self.in_flight[session] -= 1
+        return asyncio.create_task(run())
+
+    async def test_caps_global_and_per_session_concurrency(self):
+        controller = AdmissionController(max_concurrent=3, max_per_session=2, max_waiting=16)
+        tasks = [self.call(controller, "a", f"a{i}") for i in range(4)]
+        tasks += [self.call(controller, "b", f"b{i}") for i in range(4)]
+        await asyncio.sleep(0)
+        self.assertEqual(controller.active, 3)
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(self.max_in_flight, {"a": 2, "b": 2})
+        self.assertEqual(controller.metrics()["admitted"], 8)
+        self.assertEqual(controller.active, 0)
+
+    async def test_waiting_sessions_are_served_in_turn(self):
+        controller = AdmissionController(max_concurrent=1, max_per_session=1, max_waiting=16)
+        tasks = [self.call(controller, "burst", f"burst{i}") for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(self.call(controller, "other", "other0"))
+        await asyncio.gather(*tasks)
+
+        # The other session is not starved behind the whole burst
+        self.assertEqual(self.order[:3], ["burst0", "burst1", "other0"])
+
+    async def test_rejects_when_wait_queue_is_full(self):
+        controller = AdmissionController(max_concurrent=1, max_per_session=1, max_waiting=2)
+        tasks = [self.call(controller, f"s{i}", f"s{i}", delay=0.05) for i in range(3)]
+        await asyncio.sleep(0)
+
+        with self.assertRaises(QueueFullError) as ctx:
+            async with controller.slot("late"):
+                pass
+        self.assertGreater(ctx.exception.retry_after, 0)
+        await asyncio.gather(*tasks)
+        metrics = controller.metrics()
+        self.assertEqual(metrics["rejected"], 1)
+        self.assertGreater(metrics["wait_seconds"]["max"], 0)
+
+    async def test_cancelled_waiter_frees_its_place(self):
+        controller = AdmissionController(max_concurrent=1, max_per_session=1, max_waiting=4)
+        running = self.call(controller, "a", "a0", delay=0.05)
+        await asyncio.sleep(0)
+        waiting = self.call(controller, "b", "b0")
+        await asyncio.sleep(0)
+        self.assertEqual(controller.waiting, 1)
+
+        waiting.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(controller.waiting, 0)
+        await running
+        self.assertEqual(controller.active, 0)
+        self.assertEqual(self.order, ["a0"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
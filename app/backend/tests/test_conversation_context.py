@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the realtime conversation context budget.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from conversation_context import ConversationContext, is_own_item, new_item_id
+
+
+def _search_output(count: int) -> str:
+    products = [
+        {"id": f"CLO{i:03d}", "title": f"Product {i}", "price": 10.0 + i, "description": "x" * 400}
+        for i in range(count)
+    ]
+    return "Here is the result" + json.dumps({"products": products})
+
+
+class TestConversationContext(unittest.TestCase):
+    """Pruning behaviour of ConversationContext"""
+
+    def test_no_pruning_within_budget(self):
+        context = ConversationContext(budget_tokens=10_000)
+        context.track(new_item_id(), "call_1", "search", _search_output(2))
+        self.assertEqual(context.prune(), [])
+
+    def test_disabled_budget_never_prunes(self):
+        context = ConversationContext(budget_tokens=None)
+        for i in range(20):
+            context.track(new_item_id(), f"call_{i}", "search", _search_output(10))
+        self.assertEqual(context.prune(), [])
+
+    def test_prunes_oldest_and_keeps_latest_search(self):
+        context = ConversationContext(budget_tokens=1500, keep_recent=1, pinned_tools={"search"})
+        first = context.track(new_item_id(), "call_1", "search", _search_output(10), previous_item_id="fc_1")
+        second = context.track(new_item_id(), "call_2", "search", _search_output(10), previous_item_id="fc_2")
+        third = context.track(new_item_id(), "call_3", "navigate_page", '{"navigate_to": "cart"}')
+
+        events = context.prune()
+        deleted = [e["item_id"] for e in events if e["type"] == "conversation.item.delete"]
+
+        self.assertEqual(deleted, [first.item_id])
+        self.assertIn(second.item_id, context.items)
+        self.assertIn(third.item_id, context.items)
+
+        created = [e for e in events if e["type"] == "conversation.item.create"]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(created[0]["previous_item_id"], "fc_1")
+        self.assertEqual(created[0]["item"]["call_id"], "call_1")
+        self.assertIn("CLO000", created[0]["item"]["output"])
+        self.assertTrue(is_own_item(created[0]["item"]["id"]))
+
+    def test_prune_without_summaries(self):
+        context = ConversationContext(budget_tokens=500, keep_recent=1, summarize=False)
+        for i in range(4):
+            context.track(new_item_id(), f"call_{i}", "search", _search_output(5))
+
+        events = context.prune()
+        self.assertTrue(all(e["type"] == "conversation.item.delete" for e in events))
+        self.assertEqual(len(context.items), 1)
+        self.assertEqual(context.pruned_count, 3)
+
+    def test_long_sessions_stay_within_budget(self):
+        context = ConversationContext(budget_tokens=3000, keep_recent=2, pinned_tools={"search"})
+        for i in range(200):
+            context.track(new_item_id(), f"call_{i}", "search", _search_output(10), previous_item_id=f"fc_{i}")
+            context.prune()
+            self.assertLessEqual(context.estimated_tokens, context.budget_tokens)
+
+        self.assertGreater(context.evicted_summaries, 0)
+        summaries = [item for item in context.items.values() if item.summarized]
+        # The summaries left are those of the most recent pruned calls
+        self.assertTrue(summaries)
+        self.assertEqual(summaries[-1].call_id, "call_197")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
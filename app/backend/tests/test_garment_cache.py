@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the preprocessed garment image cache.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from PIL import Image
+
+from image_tools.image_pipeline import shutdown_executor
+from services.garment_cache import GarmentCache, watch_catalog
+
+
+def make_png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGBA", (width, height), (200, 30, 30, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeImageSource:
+    def __init__(self):
+        self.fetches = []
+
+    async def get_product_image(self, product_id):
+        self.fetches.append(product_id)
+        await asyncio.sleep(0.01)
+        return None if product_id == "MISSING" else make_png(1600, 2000)
+
+
+class TestGarmentCache(unittest.IsolatedAsyncioTestCase):
+    """Garments are downloaded and preprocessed once per product and version"""
+
+    async def asyncSetUp(self):
+        self.cache = GarmentCache()
+        self.source = FakeImageSource()
+
+    async def asyncTearDown(self):
+        shutdown_executor()
+
+    async def test_concurrent_lookups_share_one_load(self):
+        images = await asyncio.gather(*(self.cache.get("CLO001", self.source.get_product_image) for _ in range(3)))
+        again = await self.cache.get("CLO001", self.source.get_product_image)
+
+        self.assertEqual(self.source.fetches, ["CLO001"])
+        self.assertTrue(all(image is again for image in images))
+        self.assertEqual((again.width, again.height, again.format), (819, 1024, "PNG"))
+        self.assertEqual(self.cache.metrics()["hits"], 1)
+
+    async def test_missing_images_are_not_cached(self):
+        self.assertIsNone(await self.cache.get("MISSING", self.source.get_product_image))
+        self.assertEqual(len(self.cache), 0)
+
+    async def test_warm_reloads_changed_versions_only(self):
+        catalog = [{"id": "CLO001", "images": ["CLO001.png"]}, {"id": "CLO002", "images": ["CLO002.png"]}]
+        self.assertEqual(await self.cache.warm(catalog, self.source.get_product_image), 2)
+        self.assertEqual(await self.cache.warm(catalog, self.source.get_product_image), 0)
+
+        catalog[1]["image_version"] = "2"
+        self.assertEqual(await self.cache.warm(catalog, self.source.get_product_image), 1)
+        self.assertEqual(self.source.fetches, ["CLO001", "CLO002", "CLO002"])
+
+    async def test_memory_bound_evicts_least_recently_used(self):
+        await self.cache.get("CLO001", self.source.get_product_image)
+        self.cache.max_bytes = len(self.cache.peek("CLO001").data) + 1
+        await self.cache.get("CLO002", self.source.get_product_image)
+
+        self.assertIsNone(self.cache.peek("CLO001"))
+        self.assertIsNotNone(self.cache.peek("CLO002"))
+        self.assertLessEqual(self.cache.metrics()["bytes"], self.cache.max_bytes)
+
+    async def test_cancelled_load_cancels_joined_lookups(self):
+        first = asyncio.create_task(self.cache.get("CLO001", self.source.get_product_image))
+        await asyncio.sleep(0)
+        joined = asyncio.create_task(self.cache.get("CLO001", self.source.get_product_image))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await joined
+        self.assertIsNotNone(await self.cache.get("CLO001", self.source.get_product_image))
+
+    async def test_watcher_survives_failed_warms(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            catalog = os.path.join(tmp, "clothing_data.json")
+            with open(catalog, "w") as f:
+                f.write('[{"id": "CLO001", "images": ["CLO001.png"]}]')
+            warm = mock.AsyncMock(side_effect=[RuntimeError("blob storage unavailable"), 1])
+
+            with mock.patch.object(self.cache, "warm", warm):
+                watcher = asyncio.create_task(watch_catalog(self.cache, catalog, self.source.get_product_image, 0.01))
+                await asyncio.sleep(0.1)
+                watcher.cancel()
+
+        self.assertEqual(warm.await_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the uploaded garment registry.
+"""
+
+import os
+import sys
+import time
+import unittest
+from io import BytesIO
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from google.genai import errors, types
+from PIL import Image
+
+from image_tools.image_pipeline import process_image
+from services.garment_uploads import GEMINI_FILE_TTL_SECONDS, GarmentHandle, GarmentUploadRegistry, GarmentUploader
+from services.tryon_backends import VertexTryOnBackend
+
+
+def make_image(width: int, height: int, fmt: str, color=(180, 40, 40)) -> bytes:
+    buffer = BytesIO()
+    mode = "RGBA" if fmt == "PNG" else "RGB"
+    Image.new(mode, (width, height), color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class FakeGarmentUploader(GarmentUploader):
+    """In-memory uploader issuing handles that expire after ttl_seconds."""
+
+    def __init__(self, ttl_seconds: float = GEMINI_FILE_TTL_SECONDS, fail: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.fail = fail
+        self.uploads = []
+
+    async def upload(self, data: bytes, mime_type: str, name: str) -> GarmentHandle:
+        if self.fail:
+            raise ConnectionError("upload failed")
+        self.uploads.append(name)
+        return GarmentHandle(f"fake://files/{name}/{len(self.uploads)}", mime_type,
+                             time.time() + self.ttl_seconds, len(data))
+
+
+class RecordingModels:
+    """Stands in for client.aio.models, recording how the garment was sent."""
+
+    def __init__(self):
+        self.garment_parts = []
+        self.reject_files = False
+
+    async def generate_content(self, model, contents, config):
+        garment = contents[0].parts[2]
+        self.garment_parts.append(garment)
+        if garment.file_data is not None and self.reject_files:
+            raise errors.ClientError(404, {"error": {"code": 404, "message": "File not found", "status": "NOT_FOUND"}})
+        image = types.Part(inline_data=types.Blob(data=make_image(64, 64, "PNG"), mime_type="image/png"))
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[image]))])
+
+
+class TestGarmentUploadRegistry(unittest.IsolatedAsyncioTestCase):
+    """Garments are sent inline until their upload is available, then by handle until it expires"""
+
+    def setUp(self):
+        self.garment = process_image(make_image(600, 800, "PNG"), "PNG")
+
+    async def test_first_request_is_inline_and_later_ones_use_the_upload(self):
+        uploader = FakeGarmentUploader()
+        registry = GarmentUploadRegistry(uploader)
+
+        self.assertIsNone(registry.lookup(self.garment))
+        self.assertIsNone(registry.lookup(self.garment))
+        await registry.wait_for_uploads()
+        handle = registry.lookup(self.garment)
+
+        self.assertEqual(len(uploader.uploads), 1)
+        self.assertTrue(handle.uri.startswith("fake://files/"))
+        self.assertEqual(handle.mime_type, "image/png")
+        metrics = registry.metrics()
+        self.assertEqual((metrics["inline"], metrics["hits"]), (2, 1))
+        self.assertEqual(metrics["bytes_saved"], len(self.garment.data))
+
+    async def test_expiring_handles_are_uploaded_again(self):
+        uploader = FakeGarmentUploader(ttl_seconds=3600)
+        registry = GarmentUploadRegistry(uploader, refresh_margin_seconds=600)
+        registry.lookup(self.garment)
+        await registry.wait_for_uploads()
+        registry._handles[registry.key(self.garment)].expires_at = time.time() + 60
+
+        self.assertIsNone(registry.lookup(self.garment))
+        await registry.wait_for_uploads()
+        self.assertIsNotNone(registry.lookup(self.garment))
+        self.assertEqual(len(uploader.uploads), 2)
+        self.assertEqual(registry.metrics()["expired"], 1)
+
+    async def test_failed_and_unsupported_uploads_stay_inline(self):
+        registry = GarmentUploadRegistry(FakeGarmentUploader(fail=True))
+        registry.lookup(self.garment)
+        await registry.wait_for_uploads()
+        self.assertIsNone(registry.lookup(self.garment))
+        self.assertEqual(registry.metrics()["failures"], 1)
+
+        unsupported = GarmentUploadRegistry(GarmentUploader())
+        unsupported.lookup(self.garment)
+        await unsupported.wait_for_uploads()
+        self.assertFalse(unsupported.enabled)
+        self.assertIsNone(unsupported.lookup(self.garment))
+        self.assertEqual(len(unsupported._uploads), 0)
+
+
+class TestBackendGarmentUploads(unittest.IsolatedAsyncioTestCase):
+    """The Gemini backend references uploaded garments and falls back to inline data"""
+
+    async def asyncSetUp(self):
+        self.registry = GarmentUploadRegistry(FakeGarmentUploader())
+        self.backend = VertexTryOnBackend(vertexai=False, garment_uploads=self.registry)
+        self.models = RecordingModels()
+        self.backend.client = type("Client", (), {"aio": type("Aio", (), {"models": self.models})()})()
+        self.person = process_image(make_image(1200, 1600, "JPEG"), "JPEG")
+        self.garment = process_image(make_image(600, 800, "PNG"), "PNG")
+
+    async def test_garment_is_referenced_once_uploaded(self):
+        await self.backend.generate(self.person, self.garment, "prompt")
+        await self.registry.wait_for_uploads()
+        await self.backend.generate(self.person, self.garment, "prompt")
+
+        first, second = self.models.garment_parts
+        self.assertEqual(first.inline_data.data, self.garment.data)
+        self.assertIsNone(second.inline_data)
+        self.assertTrue(second.file_data.file_uri.startswith("fake://files/"))
+
+    async def test_rejected_handle_falls_back_to_inline(self):
+        await self.backend.generate(self.person, self.garment, "prompt")
+        await self.registry.wait_for_uploads()
+        self.models.reject_files = True
+
+        result = await self.backend.generate(self.person, self.garment, "prompt")
+        self.assertIsNotNone(result)
+        self.assertIsNotNone(self.models.garment_parts[-1].inline_data)
+        self.assertEqual(self.registry.metrics()["rejected"], 1)
+
+    def test_vertex_ai_sends_garments_inline(self):
+        self.assertIsNone(VertexTryOnBackend(vertexai=True).garment_uploads)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
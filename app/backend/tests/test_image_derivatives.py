@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Unit tests for resized product image derivatives.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+import image_proxy as image_proxy_module
+from image_proxy import ImageProxy
+from image_tools.image_derivatives import ImageDerivatives
+from image_tools.image_pipeline import shutdown_executor
+from image_tools.image_store import DiskImageCache, ImageStore
+from image_tools.image_utils import ImageService
+from image_tools import generate_image_variants
+from tests.test_image_store import FakeBlobServiceClient
+
+
+def make_png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGBA", (width, height), (200, 60, 60, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestImageDerivatives(unittest.IsolatedAsyncioTestCase):
+    """Derivatives are snapped to allowed sizes, generated once and cached in memory and on disk"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.service = FakeBlobServiceClient({"CLO001.png": make_png(1000, 1500)})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        shutdown_executor()
+
+    def make_derivatives(self, **kwargs):
+        store = ImageStore("account", "container")
+        store._client = self.service
+        return ImageDerivatives(store, disk_cache=DiskImageCache(self.tmp.name), avif=False, **kwargs)
+
+    def test_requests_are_snapped_to_allowed_values(self):
+        derivatives = self.make_derivatives(widths=(160, 320, 640), qualities=(50, 75, 90))
+        self.assertEqual(derivatives.width(100), 160)
+        self.assertEqual(derivatives.width(321), 640)
+        self.assertEqual(derivatives.width(5000), 640)
+        self.assertEqual(derivatives.width(None), 640)
+        self.assertEqual(derivatives.quality(83), 90)
+        self.assertEqual(derivatives.quality(None), 75)
+
+        self.assertEqual(derivatives.negotiate_format("image/avif,image/webp,*/*", "image/png"), "WEBP")
+        self.assertEqual(derivatives.negotiate_format("*/*", "image/png"), "PNG")
+        derivatives.avif = True
+        self.assertEqual(derivatives.negotiate_format("image/avif,image/webp,*/*", "image/png"), "AVIF")
+
+    async def test_derivatives_are_generated_once(self):
+        derivatives = self.make_derivatives()
+        image = await derivatives.get("CLO001.png", 300, 70, "image/webp")
+        again = await derivatives.get("CLO001.png", 310, 80, "image/webp")
+
+        self.assertIs(again, image)
+        self.assertEqual(image.content_type, "image/webp")
+        self.assertEqual(image.etag, '"0x1-320w-q75-webp"')
+        with Image.open(BytesIO(image.data)) as decoded:
+            self.assertEqual(decoded.size, (320, 480))
+        self.assertEqual((derivatives.generated, derivatives.hits), (1, 1))
+
+        # A restart finds it on disk, a new version of the original replaces it
+        restarted = self.make_derivatives()
+        await restarted.get("CLO001.png", 320, 75, "image/webp")
+        self.assertEqual((restarted.generated, restarted.disk_hits), (0, 1))
+
+        self.service.etags["CLO001.png"] = '"0x2"'
+        restarted.store.invalidate()
+        updated = await restarted.get("CLO001.png", 320, 75, "image/webp")
+        self.assertEqual(updated.etag, '"0x2-320w-q75-webp"')
+        self.assertEqual(restarted.generated, 1)
+
+    async def test_missing_original(self):
+        derivatives = self.make_derivatives()
+        self.assertIsNone(await derivatives.get("MISSING.png", 320))
+
+
+class TestDerivativeRoute(unittest.IsolatedAsyncioTestCase):
+    """The proxy serves derivatives for ?w= and ?q= with negotiated formats"""
+
+    async def asyncSetUp(self):
+        self.service = FakeBlobServiceClient({"CLO001.png": make_png(1000, 1500)})
+        store = ImageStore("account", "container")
+        store._client = self.service
+        self.proxy = ImageProxy(store, ImageDerivatives(store, avif=False))
+        patcher = mock.patch.object(image_proxy_module, "image_proxy", self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = web.Application()
+        app.router.add_get('/api/images/{product_id}/{filename}', image_proxy_module.serve_product_image)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        shutdown_executor()
+
+    async def test_thumbnails(self):
+        response = await self.client.get("/api/images/CLO001/CLO001.png?w=300",
+                                         headers={"Accept": "image/webp,*/*"})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["Content-Type"], "image/webp")
+        self.assertEqual(response.headers["Vary"], "Accept")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, '"0x1-320w-q75-webp"')
+        self.assertLess(len(await response.read()), len(self.service.blobs["CLO001.png"]))
+
+        response = await self.client.get("/api/images/CLO001/CLO001.png?w=300",
+                                          headers={"Accept": "image/webp,*/*", "If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+
+        response = await self.client.get("/api/images/CLO001/CLO001.png?w=300")
+        self.assertEqual(response.headers["Content-Type"], "image/png")
+
+        response = await self.client.get("/api/images/CLO001/CLO001.png?w=big")
+        self.assertEqual(response.status, 400)
+        response = await self.client.get("/api/images/MISSING/MISSING.png?w=300")
+        self.assertEqual(response.status, 404)
+        self.assertEqual(self.proxy.metrics()["derivatives"]["generated"], 2)
+
+
+class TestIngestVariants(unittest.IsolatedAsyncioTestCase):
+    """Variants are precomputed incrementally and emitted as srcsets"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.images = Path(self.tmp.name)
+        (self.images / "CLO001.png").write_bytes(make_png(1000, 1500))
+        self.data = self.images / "clothing_data.json"
+        self.data.write_text(json.dumps([{"id": "CLO001", "images": ["CLO001.png"]}]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        shutdown_executor()
+
+    async def run_job(self, **kwargs):
+        options = {"data": self.data, "images": self.images, "widths": "320,640,1200", "formats": "webp",
+                   "quality": 75, "upload": False, "force": False, **kwargs}
+        with mock.patch("builtins.print"):
+            self.assertTrue(await generate_image_variants.generate_variants(argparse.Namespace(**options)))
+        return json.loads(self.data.read_text())[0]
+
+    async def test_variants_are_recorded_and_runs_are_incremental(self):
+        product = await self.run_job()
+        # Wider than the original is not generated
+        self.assertEqual([v["file"] for v in product["image_variants"]], ["CLO001@320w.webp", "CLO001@640w.webp"])
+        written = self.images / "CLO001@320w.webp"
+        self.assertTrue(written.exists())
+
+        written.unlink()
+        await self.run_job()
+        self.assertFalse(written.exists())
+
+        (self.images / "CLO001.png").write_bytes(make_png(800, 1200))
+        await self.run_job()
+        self.assertTrue(written.exists())
+
+    def test_srcsets(self):
+        service = ImageService("account", "container", store=ImageStore("account", "container"))
+        variants = [{"image": "CLO001.png", "file": f"CLO001@{w}w.{f}", "width": w, "format": f}
+                    for w in (640, 320) for f in ("webp", "avif")]
+        with mock.patch.dict(os.environ, {"BACKEND_URL": "http://api"}):
+            product = service.enhance_product_with_images(
+                {"id": "CLO001", "images": ["CLO001.png", "CLO001-back.png"], "image_variants": variants})
+
+        precomputed, negotiated = product["imageSrcsets"]
+        self.assertEqual(precomputed["image/webp"],
+                         "http://api/api/images/CLO001/CLO001@320w.webp 320w, "
+                         "http://api/api/images/CLO001/CLO001@640w.webp 640w")
+        self.assertIn("image/avif", precomputed)
+        self.assertTrue(negotiated["default"].startswith("http://api/api/images/CLO001/CLO001-back.png?w=320 320w"))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
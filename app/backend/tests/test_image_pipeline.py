@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the try-on image preprocessing pipeline.
+"""
+
+import os
+import sys
+import unittest
+from io import BytesIO
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from exceptions import ImageProcessingError
+from image_tools.image_pipeline import (
+    encode_variants, process_image, process_image_async, shutdown_executor, sniff_format
+)
+
+
+def make_jpeg(width: int, height: int, orientation: int = None) -> bytes:
+    buffer = BytesIO()
+    img = Image.new("RGB", (width, height), (20, 120, 200))
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        img.save(buffer, format="JPEG", exif=exif)
+    else:
+        img.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestImagePipeline(unittest.TestCase):
+    """Single-decode preprocessing"""
+
+    def test_downscales_phone_photo(self):
+        result = process_image(make_jpeg(4032, 3024))
+        self.assertEqual((result.width, result.height), (1024, 768))
+        self.assertEqual((result.source_width, result.source_height), (4032, 3024))
+        self.assertEqual(result.mime_type, "image/jpeg")
+        self.assertEqual(Image.open(BytesIO(result.data)).size, (1024, 768))
+
+    def test_applies_exif_orientation(self):
+        # Orientation 6 means the camera was rotated, the upright image is portrait
+        result = process_image(make_jpeg(1600, 1200, orientation=6))
+        self.assertEqual((result.width, result.height), (768, 1024))
+
+    def test_png_target_keeps_alpha(self):
+        result = process_image(make_jpeg(800, 600), "PNG")
+        self.assertEqual(Image.open(BytesIO(result.data)).mode, "RGBA")
+        self.assertEqual(result.mime_type, "image/png")
+
+    def test_rejects_invalid_images(self):
+        with self.assertRaises(ImageProcessingError):
+            process_image(make_jpeg(100, 100))
+        with self.assertRaises(ImageProcessingError):
+            process_image(b"not an image")
+
+    def test_encodes_full_and_preview_variants(self):
+        buffer = BytesIO()
+        Image.effect_noise((768, 1024), 30).convert("RGB").save(buffer, format="PNG")
+        generated = buffer.getvalue()
+
+        full, preview = encode_variants(generated, "WEBP", quality=85, preview_dimension=384)
+        self.assertEqual((full.width, full.height), (768, 1024))
+        self.assertEqual((preview.width, preview.height), (288, 384))
+        self.assertEqual(full.mime_type, "image/webp")
+        self.assertEqual(Image.open(BytesIO(preview.data)).format, "WEBP")
+        self.assertLess(len(full.data), len(generated) // 2)
+        self.assertLess(len(preview.data), len(full.data))
+
+        with self.assertRaises(ImageProcessingError):
+            encode_variants(b"not an image")
+
+    def test_sniffs_format_from_signature(self):
+        for fmt in ("PNG", "JPEG", "WEBP"):
+            buffer = BytesIO()
+            Image.new("RGB", (8, 8)).save(buffer, format=fmt)
+            self.assertEqual(sniff_format(buffer.getvalue()), fmt)
+        self.assertIsNone(sniff_format(b"not an image"))
+
+
+class TestImagePipelineAsync(unittest.IsolatedAsyncioTestCase):
+    """Processing in the process pool"""
+
+    async def asyncTearDown(self):
+        shutdown_executor()
+
+    async def test_process_pool_round_trip(self):
+        result = await process_image_async(make_jpeg(2000, 1000))
+        self.assertEqual((result.width, result.height), (1024, 512))
+
+    async def test_errors_cross_the_process_boundary(self):
+        with self.assertRaises(ImageProcessingError):
+            await process_image_async(b"not an image")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
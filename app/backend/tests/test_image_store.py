@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the shared product image store.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timezone
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from azure.core import MatchConditions
+from azure.core.exceptions import (HttpResponseError, ResourceModifiedError, ResourceNotFoundError,
+                                   ResourceNotModifiedError, ServiceRequestError)
+
+import image_proxy as image_proxy_module
+from image_proxy import ImageProxy
+from image_tools import image_store as image_store_module
+from image_tools.image_store import DiskImageCache, ImageStore, LocalImageStore
+from image_tools.image_utils import ImageService
+
+
+class FakeProperties:
+    def __init__(self, content_type, etag='"0x1"', content_range=None):
+        self.content_settings = type("ContentSettings", (), {"content_type": content_type})()
+        self.etag = etag
+        self.last_modified = datetime(2025, 9, 1, 12, 0, tzinfo=timezone.utc)
+        self.content_range = content_range
+
+
+class FakeDownloader:
+    def __init__(self, data, etag='"0x1"', offset=None, length=None, chunk_size=256):
+        content_range = None
+        if offset is not None:
+            end = len(data) if length is None else min(offset + length, len(data))
+            content_range = f"bytes {offset}-{end - 1}/{len(data)}"
+            data = data[offset:end]
+        self.data = data
+        self.size = len(data)
+        self.chunk_size = chunk_size
+        self.properties = FakeProperties("image/png", etag, content_range)
+
+    async def readall(self):
+        return self.data
+
+    async def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+class FakeBlobClient:
+    def __init__(self, service, blob):
+        self.service = service
+        self.blob = blob
+
+    async def download_blob(self, offset=None, length=None, etag=None, match_condition=None):
+        self.service.downloads.append(self.blob)
+        await asyncio.sleep(0.01)
+        if self.service.unavailable:
+            raise ServiceRequestError("storage unavailable")
+        if self.blob not in self.service.blobs:
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        current = self.service.etags.get(self.blob, '"0x1"')
+        if match_condition == MatchConditions.IfNotModified:
+            if etag != current:
+                raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        elif etag is not None and etag == current:
+            self.service.not_modified.append(self.blob)
+            raise ResourceNotModifiedError("Not modified")
+        data = self.service.blobs[self.blob]
+        if offset is not None and offset >= len(data):
+            raise HttpResponseError("The range specified is invalid for the current size of the resource.",
+                                    response=type("Response", (), {"status_code": 416, "reason": None})())
+        return FakeDownloader(data, current, offset, length)
+
+
+class FakeBlobServiceClient:
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.etags = {}
+        self.downloads = []
+        self.not_modified = []
+        self.unavailable = False
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self, blob)
+
+    async def close(self):
+        pass
+
+
+class TestImageStore(unittest.IsolatedAsyncioTestCase):
+    """One blob client and one cache shared by the proxy, the image service and try-on"""
+
+    def setUp(self):
+        self.store = ImageStore("account", "container", max_cache_bytes=1000)
+        self.blobs = FakeBlobServiceClient({"CLO001.png": b"a" * 400, "CLO002.png": b"b" * 400, "CLO003.png": b"c" * 400})
+        self.store._client = self.blobs
+
+    async def test_concurrent_requests_share_one_download(self):
+        images = await asyncio.gather(*(self.store.get("CLO001.png") for _ in range(3)))
+        self.assertEqual(self.blobs.downloads, ["CLO001.png"])
+        self.assertEqual(images[0].content_type, "image/png")
+        self.assertEqual(images[0].etag, '"0x1"')
+
+    async def test_cache_is_bounded_by_bytes(self):
+        for name in ("CLO001.png", "CLO002.png", "CLO003.png"):
+            await self.store.get(name)
+        self.assertEqual(self.store.metrics()["bytes"], 800)
+        await self.store.get("CLO001.png")  # evicted, downloaded again
+        self.assertEqual(self.blobs.downloads.count("CLO001.png"), 2)
+
+    async def test_missing_blob_returns_none(self):
+        self.assertIsNone(await self.store.get("MISSING.png"))
+
+    async def test_downloads_are_fetched_chunk_by_chunk(self):
+        store = ImageStore("account", "container", max_cache_bytes=4 * 1024 * 1024, chunk_size=1024)
+        self.addAsyncCleanup(store.close)
+        self.assertEqual(store.client._config.max_single_get_size, 1024)
+        self.assertEqual(store.client._config.max_chunk_get_size, 1024)
+
+    async def test_proxy_and_image_service_read_the_same_store(self):
+        proxy = ImageProxy(self.store)
+        service = ImageService("account", "container", store=self.store)
+
+        content, content_type = await proxy.get_blob_stream("CLO001", "CLO001.png")
+        self.assertEqual(content_type, "image/png")
+        self.assertEqual(await service.get_product_image("CLO001"), content)
+        self.assertEqual(self.blobs.downloads, ["CLO001.png"])
+        self.assertEqual(self.store.metrics()["hits"], 1)
+
+
+class TestImageStoreTiers(unittest.IsolatedAsyncioTestCase):
+    """Disk tier, conditional revalidation and negative caching"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.blobs = FakeBlobServiceClient({"CLO001.png": b"a" * 400})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_store(self, **kwargs):
+        store = ImageStore("account", "container", max_cache_bytes=1000,
+                           disk_cache=DiskImageCache(self.tmp.name, max_bytes=1000), **kwargs)
+        store._client = self.blobs
+        return store
+
+    async def test_disk_tier_survives_restarts(self):
+        await self.make_store().get("CLO001.png")
+        restarted = self.make_store()
+        image = await restarted.get("CLO001.png")
+
+        self.assertEqual(image.data, b"a" * 400)
+        self.assertEqual(image.etag, '"0x1"')
+        self.assertEqual(image.last_modified, datetime(2025, 9, 1, 12, 0, tzinfo=timezone.utc))
+        self.assertEqual(self.blobs.downloads, ["CLO001.png"])
+        self.assertEqual(restarted.metrics()["disk_hits"], 1)
+
+    async def test_stale_entries_are_revalidated_conditionally(self):
+        store = self.make_store(revalidate_seconds=0)
+        first = await store.get("CLO001.png")
+        second = await store.get("CLO001.png")
+        self.assertIs(second, first)
+        self.assertEqual(self.blobs.not_modified, ["CLO001.png"])
+
+        self.blobs.blobs["CLO001.png"] = b"b" * 400
+        self.blobs.etags["CLO001.png"] = '"0x2"'
+        third = await store.get("CLO001.png")
+        self.assertEqual((third.data, third.etag), (b"b" * 400, '"0x2"'))
+        self.assertEqual(len(store.disk_cache), 1)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+    async def test_cached_copy_is_served_when_storage_is_unavailable(self):
+        store = self.make_store(revalidate_seconds=0)
+        await store.get("CLO001.png")
+        self.blobs.unavailable = True
+        self.assertEqual((await store.get("CLO001.png")).data, b"a" * 400)
+        self.assertEqual(store.metrics()["stale_served"], 1)
+
+    async def test_missing_blobs_are_cached_negatively(self):
+        store = self.make_store()
+        self.assertIsNone(await store.get("MISSING.png"))
+        self.assertIsNone(await store.get("MISSING.png"))
+        self.assertEqual(self.blobs.downloads, ["MISSING.png"])
+        self.assertEqual(store.metrics()["negative_hits"], 1)
+
+
+class TestImageProxyRoute(unittest.IsolatedAsyncioTestCase):
+    """The proxy streams uncached images and answers conditional and range requests"""
+
+    async def asyncSetUp(self):
+        store = ImageStore("account", "container", max_cache_bytes=1024, chunk_size=512)
+        self.blobs = {"CLO001.png": b"a" * 400, "CLO002.png": bytes(range(256)) * 8, "CLO003.png": b"c" * 900}
+        self.service = FakeBlobServiceClient(self.blobs)
+        store._client = self.service
+        self.proxy = ImageProxy(store)
+        patcher = mock.patch.object(image_proxy_module, "image_proxy", self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = web.Application()
+        app.router.add_get('/api/images/{product_id}/{filename}', image_proxy_module.serve_product_image)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_conditional_requests(self):
+        response = await self.client.get("/api/images/CLO001/CLO001.png")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["ETag"], '"0x1"')
+        last_modified = response.headers["Last-Modified"]
+        self.assertEqual(last_modified, "Mon, 01 Sep 2025 12:00:00 GMT")
+
+        response = await self.client.get("/api/images/CLO001/CLO001.png", headers={"If-None-Match": '"0x1"'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(await response.read(), b"")
+        response = await self.client.get("/api/images/CLO001/CLO001.png", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status, 304)
+        response = await self.client.get("/api/images/CLO001/CLO001.png", headers={"If-None-Match": '"0x0"'})
+        self.assertEqual(response.status, 200)
+
+        response = await self.client.get("/api/images/MISSING/MISSING.png")
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=60")
+        self.assertEqual(self.proxy.metrics()["not_modified"], 2)
+
+    async def test_uncached_images_are_streamed_with_one_download(self):
+        response = await self.client.get("/api/images/CLO002/CLO002.png")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.read(), self.blobs["CLO002.png"])
+        self.assertEqual(response.headers["Content-Length"], "2048")
+        self.assertEqual(response.headers["Content-Type"], "image/png")
+        self.assertEqual(response.headers["ETag"], '"0x1"')
+        # Larger than a chunk, so it is not kept and every request streams it again
+        response = await self.client.get("/api/images/CLO002/CLO002.png", headers={"If-None-Match": '"0x1"'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(self.service.downloads, ["CLO002.png", "CLO002.png"])
+        self.assertEqual(self.service.not_modified, ["CLO002.png"])
+        self.assertEqual(self.proxy.metrics()["streamed_bytes"], 2048)
+
+    async def test_only_single_chunk_images_are_kept(self):
+        for _ in range(2):
+            response = await self.client.get("/api/images/CLO001/CLO001.png")
+            self.assertEqual(await response.read(), self.blobs["CLO001.png"])
+            # Within the cache limit but larger than a chunk, so it is streamed again
+            response = await self.client.get("/api/images/CLO003/CLO003.png")
+            self.assertEqual(await response.read(), self.blobs["CLO003.png"])
+        self.assertEqual(self.service.downloads, ["CLO001.png", "CLO003.png", "CLO003.png"])
+
+    async def test_storage_errors_are_bad_gateway(self):
+        self.service.unavailable = True
+        response = await self.client.get("/api/images/CLO002/CLO002.png")
+        self.assertEqual(response.status, 502)
+
+    async def test_range_requests(self):
+        response = await self.client.get("/api/images/CLO002/CLO002.png", headers={"Range": "bytes=256-511"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.headers["Content-Range"], "bytes 256-511/2048")
+        self.assertEqual(await response.read(), bytes(range(256)))
+
+        response = await self.client.get("/api/images/CLO002/CLO002.png", headers={"Range": "bytes=4096-"})
+        self.assertEqual(response.status, 416)
+
+        # Small images are kept after streaming and later ranges are sliced from the cache
+        await self.client.get("/api/images/CLO001/CLO001.png")
+        response = await self.client.get("/api/images/CLO001/CLO001.png", headers={"Range": "bytes=-100"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.headers["Content-Range"], "bytes 300-399/400")
+        self.assertEqual(len(await response.read()), 100)
+        self.assertEqual(self.service.downloads.count("CLO001.png"), 1)
+        self.assertEqual(self.proxy.metrics()["partial"], 2)
+
+    async def test_if_range(self):
+        # Matching validator, streamed and cached
+        response = await self.client.get("/api/images/CLO002/CLO002.png",
+                                         headers={"Range": "bytes=0-9", "If-Range": '"0x1"'})
+        self.assertEqual(response.status, 206)
+        await self.client.get("/api/images/CLO001/CLO001.png")
+        response = await self.client.get("/api/images/CLO001/CLO001.png",
+                                         headers={"Range": "bytes=0-9", "If-Range": '"0x1"'})
+        self.assertEqual(response.status, 206)
+
+        # Changed image or a date that is not its Last-Modified, the whole image is sent
+        for path, size in (("CLO002/CLO002.png", 2048), ("CLO001/CLO001.png", 400)):
+            for if_range in ('"0x0"', "Tue, 02 Sep 2025 12:00:00 GMT"):
+                response = await self.client.get(f"/api/images/{path}",
+                                                 headers={"Range": "bytes=0-9", "If-Range": if_range})
+                self.assertEqual(response.status, 200)
+                self.assertEqual(len(await response.read()), size)
+
+        response = await self.client.get("/api/images/CLO001/CLO001.png",
+                                         headers={"Range": "bytes=0-9", "If-Range": "Mon, 01 Sep 2025 12:00:00 GMT"})
+        self.assertEqual(response.status, 206)
+
+
+class TestLocalImageBackend(unittest.IsolatedAsyncioTestCase):
+    """Images in a local directory are served as files with the same validators as get()"""
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data = bytes(range(256)) * 4
+        with open(os.path.join(self.tmp.name, "CLO001.webp"), "wb") as f:
+            f.write(self.data)
+        with open(os.path.join(self.tmp.name, "variants_manifest.json"), "w") as f:
+            f.write("{}")
+        self.store = LocalImageStore(self.tmp.name)
+        self.proxy = ImageProxy(self.store)
+        patcher = mock.patch.object(image_proxy_module, "image_proxy", self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = web.Application()
+        app.router.add_get('/api/images/{product_id}/{filename}', image_proxy_module.serve_product_image)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_store_reads_files(self):
+        image = await self.store.get("CLO001.webp")
+        self.assertEqual(image.data, self.data)
+        self.assertEqual(image.content_type, "image/webp")
+        self.assertIsNone(await self.store.get("MISSING.png"))
+        self.assertIsNone(await self.store.file_path("../etc/passwd"))
+        self.assertIsNone(await self.store.get("variants_manifest.json"))
+
+    async def test_files_are_served_with_validators_and_ranges(self):
+        etag = (await self.store.get("CLO001.webp")).etag
+
+        response = await self.client.get("/api/images/CLO001/CLO001.webp")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.read(), self.data)
+        self.assertEqual(response.headers["Content-Type"], "image/webp")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = await self.client.get("/api/images/CLO001/CLO001.webp", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        response = await self.client.get("/api/images/CLO001/CLO001.webp", headers={"Range": "bytes=0-9"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(await response.read(), self.data[:10])
+
+        response = await self.client.get("/api/images/MISSING/MISSING.png")
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=0")
+        # Only image files are served from the directory
+        response = await self.client.get("/api/images/CLO001/variants_manifest.json")
+        self.assertEqual(response.status, 404)
+        self.assertEqual(self.proxy.metrics()["files_served"], 3)
+
+    def test_backend_is_chosen_by_the_settings(self):
+        with mock.patch.dict(os.environ, {"IMAGE_STORAGE_BACKEND": "local", "LOCAL_IMAGE_DIR": self.tmp.name}):
+            store = image_store_module._image_store_from_settings()
+        self.assertIsInstance(store, LocalImageStore)
+        self.assertEqual(store.directory, self.store.directory)
+        with mock.patch.dict(os.environ, {"IMAGE_STORAGE_BACKEND": "azure"}):
+            self.assertIsInstance(image_store_module._image_store_from_settings(), ImageStore)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Unit tests for streamed try-on photo uploads.
+"""
+
+import os
+import sys
+import unittest
+from io import BytesIO
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from services.image_upload import UploadRejected, read_image_upload
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (90, 90, 160)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestImageUpload(unittest.IsolatedAsyncioTestCase):
+    """Multipart and raw uploads are streamed with incremental limits"""
+
+    async def asyncSetUp(self):
+        self.received = []
+
+        async def handler(request):
+            try:
+                image, fields = await read_image_upload(request, max_bytes=int(request.query.get("max", 10 * 1024 * 1024)))
+            except UploadRejected as e:
+                return web.json_response({"error": str(e)}, status=e.status)
+            self.received.append(image)
+            return web.json_response({"bytes": len(image), "product_id": fields.get("product_id")})
+
+        app = web.Application()
+        app.router.add_post("/upload", handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_multipart_upload(self):
+        photo = make_jpeg(1200, 900)
+        form = aiohttp.FormData()
+        form.add_field("product_id", "CLO001")
+        form.add_field("person_image", photo, filename="me.jpg", content_type="image/jpeg")
+        response = await self.client.post("/upload", data=form)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.json(), {"bytes": len(photo), "product_id": "CLO001"})
+        self.assertEqual(self.received, [photo])
+
+    async def test_raw_binary_upload(self):
+        photo = make_jpeg(800, 600)
+        response = await self.client.post("/upload?product_id=CLO002", data=photo, headers={"Content-Type": "image/jpeg"})
+        self.assertEqual(await response.json(), {"bytes": len(photo), "product_id": "CLO002"})
+
+    async def test_oversized_upload_is_rejected(self):
+        photo = make_jpeg(1200, 900)
+        form = aiohttp.FormData()
+        form.add_field("person_image", photo, filename="me.jpg", content_type="image/jpeg")
+        response = await self.client.post(f"/upload?max={len(photo) // 2}", data=form)
+        self.assertEqual(response.status, 413)
+
+    async def test_dimensions_are_checked_from_the_header(self):
+        response = await self.client.post("/upload", data=make_jpeg(100, 100), headers={"Content-Type": "image/jpeg"})
+        self.assertEqual(response.status, 400)
+        self.assertIn("dimensions", (await response.json())["error"])
+
+        response = await self.client.post("/upload", data=b"not an image" * 100, headers={"Content-Type": "image/jpeg"})
+        self.assertEqual(response.status, 400)
+
+    async def test_missing_file_field(self):
+        form = aiohttp.FormData()
+        form.add_field("product_id", "CLO001")
+        form.add_field("other", b"x", filename="x.bin")
+        response = await self.client.post("/upload", data=form)
+        self.assertEqual(response.status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
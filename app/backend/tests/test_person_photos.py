@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Unit tests for session-scoped person photo handles.
+"""
+
+import base64
+import os
+import sys
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from azure.core.credentials import AzureKeyCredential
+from PIL import Image
+
+import ragtools
+from conversation_context import ConversationContext
+from image_tools.image_pipeline import ProcessedImage
+from rtmt import RTMiddleTier, RTSession, current_session
+from services import virtual_tryon_endpoint
+from services.person_photos import PersonPhotoStore
+from exceptions import VirtualTryOnError
+from services.tryon_jobs import TryOnJob
+from session_tokens import session_tokens
+
+
+def make_jpeg(width: int, height: int, color=(90, 90, 160)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def photo(size: int, seed: int = 0) -> ProcessedImage:
+    data = bytes([seed]) * size
+    return ProcessedImage(data, "JPEG", 768, 1024, "JPEG", 768, 1024, size)
+
+
+class TestPersonPhotoStore(unittest.TestCase):
+    """Photos are kept per session within a quota and a TTL"""
+
+    def test_handles_are_stable_and_session_scoped(self):
+        store = PersonPhotoStore()
+        first = store.put("a", photo(100))
+        self.assertEqual(store.put("a", photo(100)), first)
+        self.assertTrue(first.startswith("ph_"))
+
+        self.assertEqual(store.get("a", first).data, photo(100).data)
+        self.assertIsNone(store.get("b", first))
+        self.assertEqual(store.metrics()["uploads"], 1)
+
+    def test_latest_photo_is_the_default(self):
+        store = PersonPhotoStore()
+        store.put("a", photo(100, seed=1))
+        store.put("a", photo(100, seed=2))
+        self.assertEqual(store.get("a").data, photo(100, seed=2).data)
+        self.assertIsNone(store.get(None))
+
+    def test_session_quota_evicts_least_recently_used(self):
+        store = PersonPhotoStore(session_quota_bytes=250)
+        first = store.put("a", photo(100, seed=1))
+        second = store.put("a", photo(100, seed=2))
+        store.get("a", first)
+        third = store.put("a", photo(100, seed=3))
+
+        self.assertIsNone(store.get("a", second))
+        self.assertIsNotNone(store.get("a", first))
+        self.assertIsNotNone(store.get("a", third))
+        self.assertEqual(store.metrics()["bytes"], 200)
+
+    def test_photo_evicted_by_the_global_cap_is_rejected(self):
+        store = PersonPhotoStore(session_quota_bytes=250, max_bytes=50)
+        with self.assertRaises(VirtualTryOnError):
+            store.put("a", photo(100, seed=1))
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.metrics()["bytes"], 0)
+
+    def test_expiry_and_session_close(self):
+        store = PersonPhotoStore(ttl_seconds=60)
+        old = store.put("a", photo(100, seed=1))
+        store.put("b", photo(100, seed=2))
+        store._sessions["a"][old].last_access = time.monotonic() - 120
+
+        self.assertEqual(store.evict_expired(), 1)
+        self.assertIsNone(store.get("a", old))
+        self.assertEqual(store.drop_session("b"), 1)
+        self.assertEqual(store.metrics()["bytes"], 0)
+        self.assertEqual(len(store), 0)
+
+
+class TestPersonPhotoReuse(unittest.IsolatedAsyncioTestCase):
+    """Try-ons reference the stored photo instead of uploading it again"""
+
+    async def asyncSetUp(self):
+        self.store = PersonPhotoStore()
+        self.submitted = []
+
+        def submit(product_id, person, image_service=None, session_id=None, priority="normal", admission_key=None):
+            self.submitted.append(person)
+            return TryOnJob(session_id, product_id, priority, admission_key)
+
+        for patcher in (mock.patch.object(ragtools, "person_photo_store", self.store),
+                        mock.patch.object(ragtools, "submit_virtual_try_on", submit),
+                        mock.patch.object(virtual_tryon_endpoint, "person_photo_store", self.store),
+                        mock.patch.object(virtual_tryon_endpoint, "submit_virtual_try_on", submit)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_tool_keeps_the_photo_for_later_try_ons(self):
+        current_session.set(RTSession("session-1", ConversationContext()))
+        user_image = base64.b64encode(make_jpeg(1200, 1600)).decode("ascii")
+
+        first = await ragtools._virtual_try_on_tool({"product_id": "CLO001", "user_image": user_image})
+        second = await ragtools._virtual_try_on_tool({"product_id": "CLO002"})
+
+        self.assertEqual(first.text["action"], "virtual_try_on_started")
+        self.assertEqual(second.text["action"], "virtual_try_on_started")
+        self.assertIsInstance(self.submitted[0], ProcessedImage)
+        self.assertIs(self.submitted[1], self.submitted[0])
+
+        current_session.set(RTSession("session-2", ConversationContext()))
+        other = await ragtools._virtual_try_on_tool({"product_id": "CLO002"})
+        self.assertEqual(other.text["action"], "open_virtual_try_on_modal")
+
+    async def test_tool_continues_when_the_photo_cannot_be_kept(self):
+        current_session.set(RTSession("session-1", ConversationContext()))
+        user_image = base64.b64encode(make_jpeg(1200, 1600)).decode("ascii")
+
+        with mock.patch.object(self.store, "put", side_effect=VirtualTryOnError("full")):
+            result = await ragtools._virtual_try_on_tool({"product_id": "CLO001", "user_image": user_image})
+        self.assertEqual(result.text["action"], "virtual_try_on_started")
+        self.assertEqual(len(self.submitted), 1)
+
+    async def test_upload_route_and_handle_reference(self):
+        app = web.Application()
+        app.router.add_post('/api/virtual-tryon/person-photos', virtual_tryon_endpoint.upload_person_photo_handler)
+        app.router.add_post('/api/virtual-tryon/jobs', virtual_tryon_endpoint.create_tryon_job_handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+
+        s1 = session_tokens.issue("1" * 32)
+        s2 = session_tokens.issue("2" * 32)
+        form = aiohttp.FormData()
+        form.add_field("person_image", make_jpeg(1200, 1600), filename="me.jpg", content_type="image/jpeg")
+        response = await client.post('/api/virtual-tryon/person-photos', data=form, headers={"X-Session-Id": s1})
+        self.assertEqual(response.status, 201)
+        body = await response.json()
+        self.assertEqual((body["width"], body["height"]), (768, 1024))
+
+        response = await client.post('/api/virtual-tryon/jobs', headers={"X-Session-Id": s1},
+                                     json={"product_id": "CLO001", "person_photo_id": body["person_photo_id"]})
+        self.assertEqual(response.status, 202)
+        self.assertIsInstance(self.submitted[0], ProcessedImage)
+
+        form = aiohttp.FormData()
+        form.add_field("product_id", "CLO002")
+        form.add_field("person_photo_id", body["person_photo_id"], content_type="text/plain")
+        response = await client.post('/api/virtual-tryon/jobs', headers={"X-Session-Id": s1}, data=form)
+        self.assertEqual(response.status, 202)
+        self.assertIs(self.submitted[1], self.submitted[0])
+
+        response = await client.post('/api/virtual-tryon/jobs', headers={"X-Session-Id": s2},
+                                     json={"product_id": "CLO001", "person_photo_id": body["person_photo_id"]})
+        self.assertEqual(response.status, 404)
+
+        response = await client.post('/api/virtual-tryon/person-photos', data=make_jpeg(1200, 1600),
+                                     headers={"Content-Type": "image/jpeg"})
+        self.assertEqual(response.status, 400)
+
+        # Session ids the server did not issue are rejected
+        response = await client.post('/api/virtual-tryon/person-photos', data=make_jpeg(1200, 1600),
+                                     headers={"Content-Type": "image/jpeg", "X-Session-Id": "1" * 32})
+        self.assertEqual(response.status, 400)
+
+
+class FakeClientSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+class TestRealtimeSessions(unittest.IsolatedAsyncioTestCase):
+    """Sessions are issued by the server and close handlers run when their websocket closes"""
+
+    def setUp(self):
+        self.rtmt = RTMiddleTier("https://example.openai.azure.com", "gpt-4o-realtime",
+                                 AzureKeyCredential("test-key"))
+
+    async def test_handlers_run_on_close(self):
+        closed = []
+
+        async def on_close(rt_session):
+            closed.append(rt_session.session_id)
+
+        async def relay(ws, rt_session):
+            pass
+
+        self.rtmt.session_close_handlers.append(on_close)
+        ws = FakeClientSocket()
+        with mock.patch.object(self.rtmt, "_relay", relay):
+            await self.rtmt._forward_messages(ws, "session-1")
+        self.assertEqual(closed, ["session-1"])
+        self.assertEqual(ws.sent[0]["type"], "extension.session")
+
+    async def test_only_issued_sessions_are_resumed(self):
+        sessions = []
+
+        async def relay(ws, rt_session):
+            sessions.append(rt_session.session_id)
+
+        app = web.Application()
+        self.rtmt.attach_to_app(app, "/realtime")
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+
+        async def connect(token=None):
+            params = {"session_id": token} if token else {}
+            async with client.ws_connect("/realtime", params=params) as ws:
+                message = await ws.receive_json()
+            self.assertEqual(message["type"], "extension.session")
+            return message["session_id"]
+
+        with mock.patch.object(self.rtmt, "_relay", relay):
+            token = await connect()
+            self.assertEqual(await connect(token), token)
+            await connect(sessions[0])
+            await connect(sessions[0] + ".forged")
+
+        self.assertEqual(session_tokens.verify(token), sessions[0])
+        self.assertEqual(sessions[1], sessions[0])
+        self.assertNotIn(sessions[0], sessions[2:])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
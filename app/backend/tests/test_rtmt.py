@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Unit tests for RTMiddleTier message processing without a realtime backend.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from azure.core.credentials import AzureKeyCredential
+
+from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+
+
+class FakeWebSocket:
+    """Collects the messages the middle tier sends."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def send_str(self, data):
+        self.sent.append(json.loads(data))
+
+
+class FakeMessage:
+    def __init__(self, payload):
+        self.data = json.dumps(payload)
+
+
+async def _products_tool(args):
+    return ToolResult({"products": [{"id": "CLO001", "title": "Jacket"}]}, ToolResultDirection.TO_CLIENT)
+
+
+class TestRTMiddleTier(unittest.IsolatedAsyncioTestCase):
+    """Session configuration and tool handling in RTMiddleTier"""
+
+    def setUp(self):
+        self.rtmt = RTMiddleTier("https://example.openai.azure.com", "gpt-4o-realtime",
+                                 AzureKeyCredential("key"), voice_choice="alloy")
+        self.rtmt.system_message = "You are a test assistant"
+        self.rtmt.temperature = 0.7
+        self.rtmt.tools.register("search", Tool(target=_products_tool, schema={"type": "function", "name": "search"}))
+        self.rtmt.tools.register("add_to_cart", Tool(target=_products_tool, schema={"type": "function", "name": "add_to_cart"},
+                                                     is_available=lambda session: "search" in session.tools_called))
+
+    async def _run_tool_call(self, rt_session, client_ws, server_ws, name="search", call_id="call_1"):
+        await self.rtmt._process_message_to_client(FakeMessage({
+            "type": "conversation.item.created",
+            "previous_item_id": "item_0",
+            "item": {"type": "function_call", "id": f"fc_{call_id}", "call_id": call_id}
+        }), client_ws, server_ws, rt_session)
+        await self.rtmt._process_message_to_client(FakeMessage({
+            "type": "response.output_item.done",
+            "item": {"type": "function_call", "id": f"fc_{call_id}", "call_id": call_id, "name": name, "arguments": "{}"}
+        }), client_ws, server_ws, rt_session)
+        await self.rtmt._process_message_to_client(FakeMessage({
+            "type": "response.done", "response": {"output": []}
+        }), client_ws, server_ws, rt_session)
+
+    async def test_session_update_is_spliced_with_server_fragment(self):
+        rt_session = self.rtmt._create_session()
+        message = FakeMessage({"type": "session.update", "event_id": "evt_1",
+                               "session": {"voice": "echo", "turn_detection": {"type": "server_vad"}}})
+
+        updated = json.loads(await self.rtmt._process_message_to_server(message, None, rt_session))
+
+        self.assertEqual(updated["event_id"], "evt_1")
+        self.assertEqual(updated["session"]["turn_detection"], {"type": "server_vad"})
+        self.assertEqual(updated["session"]["voice"], "alloy")
+        self.assertEqual(updated["session"]["instructions"], "You are a test assistant")
+        self.assertEqual([t["name"] for t in updated["session"]["tools"]], ["search"])
+
+    async def test_audio_messages_pass_through_untouched(self):
+        raw = '{"type": "input_audio_buffer.append", "audio": "AAAA"}'
+        message = FakeMessage({})
+        message.data = raw
+        self.assertIs(await self.rtmt._process_message_to_server(message, None), raw)
+
+    async def test_fragment_recompiled_when_tools_change(self):
+        before = self.rtmt.compile_session_config()
+        self.rtmt.tools["navigate_page"] = Tool(target=_products_tool, schema={"type": "function", "name": "navigate_page"})
+        after = self.rtmt.compile_session_config()
+        self.assertNotEqual(before, after)
+        self.assertIn("navigate_page", after)
+
+    async def test_tool_set_update_sent_once_products_are_shown(self):
+        rt_session = self.rtmt._create_session()
+        await self.rtmt._process_message_to_server(FakeMessage({"type": "session.update", "session": {}}), None, rt_session)
+        client_ws, server_ws = FakeWebSocket(), FakeWebSocket()
+
+        await self._run_tool_call(rt_session, client_ws, server_ws)
+
+        updates = [m for m in server_ws.sent if m["type"] == "session.update"]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual([t["name"] for t in updates[0]["session"]["tools"]], ["search", "add_to_cart"])
+        self.assertEqual(server_ws.sent[-1], {"type": "response.create"})
+
+        await self._run_tool_call(rt_session, client_ws, server_ws, call_id="call_2")
+        self.assertEqual(len([m for m in server_ws.sent if m["type"] == "session.update"]), 1)
+
+    async def test_client_event_refreshes_the_tool_set(self):
+        opened = set()
+
+        async def on_app_state(rt_session, message):
+            opened.add(rt_session.session_id)
+
+        self.rtmt.client_event_handlers["extension.app_state"] = on_app_state
+        self.rtmt.tools["add_to_cart"].is_available = lambda session: session.session_id in opened
+        rt_session = self.rtmt._create_session()
+        await self.rtmt._process_message_to_server(FakeMessage({"type": "session.update", "session": {}}), None, rt_session)
+
+        event = FakeMessage({"type": "extension.app_state", "event": "view_product", "product_id": "CLO001"})
+        update = json.loads(await self.rtmt._process_message_to_server(event, None, rt_session))
+        self.assertEqual([t["name"] for t in update["session"]["tools"]], ["search", "add_to_cart"])
+        self.assertIsNone(await self.rtmt._process_message_to_server(event, None, rt_session))
+
+    async def test_tool_result_forwarded_to_client(self):
+        rt_session = self.rtmt._create_session()
+        client_ws, server_ws = FakeWebSocket(), FakeWebSocket()
+
+        await self._run_tool_call(rt_session, client_ws, server_ws)
+
+        self.assertEqual(client_ws.sent[0]["type"], "extension.middle_tier_tool_response")
+        self.assertEqual(client_ws.sent[0]["tool_name"], "search")
+        outputs = [m for m in server_ws.sent if m["type"] == "conversation.item.create"]
+        self.assertEqual(outputs[0]["item"]["call_id"], "call_1")
+
+    async def test_system_message_waits_for_the_active_response(self):
+        rt_session = self.rtmt._create_session()
+        client_ws, server_ws = FakeWebSocket(), FakeWebSocket()
+        self.assertIsNone(await self.rtmt.add_system_message(rt_session.session_id, "Try-on ready"))
+
+        self.rtmt._sessions[rt_session.session_id] = rt_session
+        rt_session.server_ws = server_ws
+        item_id = await self.rtmt.add_system_message(rt_session.session_id, "Try-on ready")
+        self.assertEqual([m["type"] for m in server_ws.sent], ["conversation.item.create", "response.create"])
+        self.assertEqual(server_ws.sent[0]["item"]["id"], item_id)
+        self.assertEqual(server_ws.sent[0]["item"]["role"], "system")
+
+        # While the assistant is responding the new response is requested once the current one is done
+        server_ws.sent.clear()
+        await self.rtmt._process_message_to_client(FakeMessage({"type": "response.created"}), client_ws, server_ws, rt_session)
+        await self.rtmt.add_system_message(rt_session.session_id, "Try-on failed")
+        self.assertEqual([m["type"] for m in server_ws.sent], ["conversation.item.create"])
+        await self.rtmt._process_message_to_client(FakeMessage({
+            "type": "response.done", "response": {"output": []}
+        }), client_ws, server_ws, rt_session)
+        self.assertEqual(server_ws.sent[-1], {"type": "response.create"})
+        self.assertFalse(rt_session.response_requested)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the search service's selected fields.
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from services.search_service import PRODUCT_FIELDS, SCHEMA_RETRY_SECONDS, SearchService
+
+
+class FakeField:
+    def __init__(self, name):
+        self.name = name
+
+
+class TestSelectedFields(unittest.IsolatedAsyncioTestCase):
+    """Optional fields are only selected once the index has them"""
+
+    def make_service(self, **get_index):
+        service = SearchService()
+        service.index_client = mock.Mock(get_index=mock.AsyncMock(**get_index))
+        return service
+
+    async def test_optional_fields_follow_the_index_schema(self):
+        index = mock.Mock(fields=[FakeField(name) for name in PRODUCT_FIELDS])
+        service = self.make_service(return_value=index)
+        self.assertNotIn("image_variants", await service._select_fields())
+
+        index.fields.append(FakeField("image_variants"))
+        service = self.make_service(return_value=index)
+        self.assertIn("image_variants", await service._select_fields())
+        await service._select_fields()
+        service.index_client.get_index.assert_awaited_once()
+
+    async def test_unreadable_schema_leaves_out_optional_fields(self):
+        service = self.make_service(side_effect=RuntimeError("forbidden"))
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(await service._select_fields(), PRODUCT_FIELDS)
+
+    async def test_unreadable_schema_is_retried_after_a_backoff(self):
+        index = mock.Mock(fields=[FakeField(name) for name in PRODUCT_FIELDS + ["image_variants"]])
+        service = self.make_service(side_effect=[RuntimeError("throttled"), index])
+        with mock.patch.object(sys.modules[SearchService.__module__].time, "monotonic", return_value=1000.0) as clock:
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(await service._select_fields(), PRODUCT_FIELDS)
+            self.assertEqual(await service._select_fields(), PRODUCT_FIELDS)
+            self.assertEqual(service.index_client.get_index.await_count, 1)
+
+            clock.return_value = 1000.0 + SCHEMA_RETRY_SECONDS
+            self.assertIn("image_variants", await service._select_fields())
+            await service._select_fields()
+            self.assertEqual(service.index_client.get_index.await_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the server-side shopping session state.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from services.result_context import ResultContextIndex
+from services.session_state import SessionStateStore
+
+
+class TestSessionStateStore(unittest.TestCase):
+    """State updates, bounds and eviction of SessionStateStore"""
+
+    def test_tool_updates_are_reflected(self):
+        store = SessionStateStore()
+        store.add_to_cart("s1", "CLO001", "M", "black")
+        store.add_to_cart("s1", "CLO001", "M", "black", quantity=2)
+        store.update_wishlist("s1", "CLO002", "add")
+        store.set_current_product("s1", "CLO003")
+        store.set_page("s1", "cart")
+
+        state = store.get("s1").to_dict(include_details=True)
+        self.assertEqual(state["cart"], [{"product_id": "CLO001", "size": "M", "color": "black", "quantity": 3}])
+        self.assertEqual(state["cart_item_count"], 3)
+        self.assertEqual(state["wishlist"], ["CLO002"])
+        self.assertEqual(state["current_product_id"], "CLO003")
+        self.assertEqual(state["current_page"], "cart")
+
+    def test_ui_events(self):
+        store = SessionStateStore()
+        store.add_to_cart("s1", "CLO003")
+        store.apply_ui_event("s1", {"event": "unknown"})
+        self.assertEqual(len(store.get("s1").cart), 1)
+
+        store.apply_ui_event("s1", {"event": "cart_remove", "product_id": "CLO003"})
+        store.apply_ui_event("s1", {"event": "wishlist_add", "product_id": "CLO001"})
+        store.apply_ui_event("s1", {"event": "cart_add", "product_id": "CLO002", "size": "S", "color": "red"})
+        store.apply_ui_event("s1", {"event": "cart_remove", "product_id": "CLO002"})
+        store.apply_ui_event("s1", {"event": "wishlist_remove", "product_id": "CLO001"})
+        self.assertEqual(store.get("s1").to_dict(), {
+            "current_page": "main", "current_product_id": None,
+            "cart": [], "cart_item_count": 0, "wishlist": [], "tryon_product_id": None
+        })
+
+        store.apply_ui_event("s1", {"event": "tryon_open", "product_id": "CLO004"})
+        self.assertEqual(store.get("s1").tryon_product_id, "CLO004")
+        store.apply_ui_event("s1", {"event": "tryon_close"})
+        self.assertIsNone(store.get("s1").tryon_product_id)
+
+        store.apply_ui_event("s1", {"event": "sync", "state": {"wishlist": ["CLO009"], "current_page": "favorites"}})
+        self.assertEqual(store.get("s1").wishlist, ["CLO009"])
+        self.assertEqual(store.get("s1").current_page, "favorites")
+
+    def test_sync_keeps_known_cart_lines(self):
+        store = SessionStateStore()
+        store.add_to_cart("s1", "CLO001", size="M", color="black", quantity=2)
+        store.apply_ui_event("s1", {"event": "sync", "state": {
+            "cart": [{"product_id": "CLO001"}, {"product_id": "CLO002"}], "tryon_product_id": "CLO002"
+        }})
+        state = store.get("s1")
+        self.assertEqual(state.cart, [
+            {"product_id": "CLO001", "size": "M", "color": "black", "quantity": 2},
+            {"product_id": "CLO002"}
+        ])
+        self.assertEqual(state.tryon_product_id, "CLO002")
+
+    def test_has_products(self):
+        store = SessionStateStore()
+        self.assertFalse(store.get("s1").has_products)
+        store.apply_ui_event("s1", {"event": "view_product", "product_id": "CLO001"})
+        self.assertTrue(store.get("s1").has_products)
+
+        store.update_wishlist("s2", "CLO002", "add")
+        self.assertTrue(store.get("s2").has_products)
+        store.get("s3").results.record_results([{"id": "CLO003"}])
+        self.assertTrue(store.get("s3").has_products)
+
+    def test_bounded_sessions_and_items(self):
+        store = SessionStateStore(max_sessions=2, max_items=2)
+        for pid in ("CLO001", "CLO002", "CLO003"):
+            store.update_wishlist("s1", pid, "add")
+        store.get("s2")
+        store.get("s3")
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.peek("s1"))
+        self.assertEqual(len(store.get("s1").wishlist), 0)
+
+    def test_idle_eviction_with_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SessionStateStore(idle_ttl_seconds=60, persist_dir=tmp)
+            store.update_wishlist("s1", "CLO001", "add")
+            store.peek("s1").last_active = time.monotonic() - 120
+
+            store.get("s2")
+            self.assertIsNone(store.peek("s1"))
+            with open(os.path.join(tmp, "s1.json")) as f:
+                self.assertEqual(json.load(f)["wishlist"], ["CLO001"])
+
+            self.assertEqual(store.get("s1").wishlist, ["CLO001"])
+
+    def test_persisted_sessions_expire(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SessionStateStore(persist_dir=tmp, persist_ttl_seconds=3600)
+            store.update_wishlist("s1", "CLO001", "add")
+            store.update_wishlist("s2", "CLO002", "add")
+            store.flush()
+            old = time.time() - 7200
+            os.utime(os.path.join(tmp, "s1.json"), (old, old))
+
+            self.assertEqual(store.purge_persisted(), 1)
+            self.assertEqual(sorted(os.listdir(tmp)), ["s2.json"])
+
+
+class TestResultContextIndex(unittest.TestCase):
+    """Resolving references against shown products"""
+
+    def setUp(self):
+        self.index = ResultContextIndex(max_products=5)
+        self.index.record_results([
+            {"id": "CLO001", "title": "Denim Jacket", "brand": "Levi's", "category": "Outerwear", "colors": ["blue"], "price": 90.0},
+            {"id": "CLO002", "title": "Leather Jacket", "brand": "Zara", "category": "Outerwear", "colors": ["black"], "price": 150.0, "sale_price": 120.0},
+            {"id": "CLO003", "title": "Running Tee", "brand": "Nike", "category": "Sportswear", "colors": ["blue", "white"], "price": 30.0},
+        ])
+
+    def test_ordinal_references(self):
+        self.assertEqual([p.id for p in self.index.resolve(ordinal=2)], ["CLO002"])
+        self.assertEqual([p.id for p in self.index.resolve(ordinal=-1)], ["CLO003"])
+        self.assertEqual(self.index.resolve(ordinal=7), [])
+
+    def test_attribute_references(self):
+        self.assertEqual([p.id for p in self.index.resolve(color="blue")], ["CLO001", "CLO003"])
+        self.assertEqual([p.id for p in self.index.resolve(color="blue", keywords="jacket")], ["CLO001"])
+        self.assertEqual([p.id for p in self.index.resolve(max_price=125)], ["CLO001", "CLO002", "CLO003"])
+        self.assertEqual([p.id for p in self.index.resolve(brand="nike")], ["CLO003"])
+
+    def test_falls_back_to_earlier_results(self):
+        self.index.record_results([{"id": "CLO004", "title": "Wool Scarf", "colors": ["red"], "price": 25.0}])
+        self.assertEqual([p.id for p in self.index.resolve(ordinal=1)], ["CLO004"])
+        self.assertEqual([p.id for p in self.index.resolve(brand="Zara")], ["CLO002"])
+
+    def test_history_is_bounded(self):
+        self.index.record_results([{"id": f"CLO1{i:02d}"} for i in range(4)])
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.resolve(keywords="denim"), [])
+
+    def test_null_fields_from_the_index(self):
+        self.index.record_results([{"id": "CLO005", "title": None, "brand": None, "category": None, "colors": None}])
+        self.assertEqual(self.index.resolve(brand="Zara", color="blue", keywords="scarf"), [])
+        self.assertEqual([p.id for p in self.index.resolve(ordinal=1)], ["CLO005"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
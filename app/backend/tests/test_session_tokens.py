@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Unit tests for server-issued session tokens.
+"""
+
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from session_tokens import SessionTokens
+
+
+class TestSessionTokens(unittest.TestCase):
+    """Tokens bind a generated session id and cannot be forged"""
+
+    def test_issued_tokens_verify(self):
+        tokens = SessionTokens("secret")
+        session_id = "0123456789abcdef0123456789abcdef"
+        token = tokens.issue(session_id)
+        self.assertEqual(tokens.verify(token), session_id)
+        self.assertEqual(SessionTokens("secret").verify(token), session_id)
+
+    def test_forged_tokens_are_rejected(self):
+        tokens = SessionTokens("secret")
+        token = tokens.issue("0123456789abcdef0123456789abcdef")
+        self.assertIsNone(SessionTokens("other").verify(token))
+        self.assertIsNone(tokens.verify(token[:-1] + ("0" if token[-1] != "0" else "1")))
+        self.assertIsNone(tokens.verify("0123456789abcdef0123456789abcdef"))
+        self.assertIsNone(tokens.verify("../../etc/passwd." + token.split(".")[1]))
+        self.assertIsNone(tokens.verify(None))
+        self.assertIsNone(tokens.verify(""))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the tool registry middleware.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tool_registry import Tool, ToolRegistry, ToolResult, ToolResultDirection
+
+
+class CountingTarget:
+    """Tool target that counts calls and optionally sleeps."""
+
+    def __init__(self, delay: float = 0, result=None):
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.result = result if result is not None else {"ok": True}
+
+    async def __call__(self, args):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            return ToolResult(dict(self.result, args=args), ToolResultDirection.TO_CLIENT)
+        finally:
+            self.running -= 1
+
+
+class TestToolRegistry(unittest.IsolatedAsyncioTestCase):
+    """Caching, deduplication, timeouts and concurrency limits"""
+
+    async def test_cacheable_tool_uses_key_fields(self):
+        target = CountingTarget()
+        registry = ToolRegistry()
+        registry.register("search", Tool(target=target, schema={}, cacheable=True, cache_key_fields=("query",)))
+
+        await registry.invoke("search", {"query": "jacket", "request_id": 1})
+        await registry.invoke("search", {"query": "jacket", "request_id": 2})
+        await registry.invoke("search", {"query": "dress"})
+
+        self.assertEqual(target.calls, 2)
+        self.assertEqual(registry.cache.hits, 1)
+
+    async def test_errors_are_not_cached(self):
+        target = CountingTarget(result={"error": "boom"})
+        registry = ToolRegistry()
+        registry.register("search", Tool(target=target, schema={}, cacheable=True))
+
+        await registry.invoke("search", {"query": "jacket"})
+        await registry.invoke("search", {"query": "jacket"})
+        self.assertEqual(target.calls, 2)
+
+    async def test_idempotent_calls_are_deduplicated(self):
+        target = CountingTarget(delay=0.05)
+        registry = ToolRegistry()
+        registry.register("search", Tool(target=target, schema={}, idempotent=True))
+
+        results = await asyncio.gather(*(registry.invoke("search", {"query": "jacket"}) for _ in range(5)))
+
+        self.assertEqual(target.calls, 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    async def test_timeout_returns_error_result(self):
+        registry = ToolRegistry()
+        registry.register("slow", Tool(target=CountingTarget(delay=1), schema={}, timeout=0.01))
+
+        result = await registry.invoke("slow", {})
+        self.assertTrue(result.is_error)
+
+    async def test_max_concurrency(self):
+        target = CountingTarget(delay=0.02)
+        registry = ToolRegistry()
+        registry.register("try_on", Tool(target=target, schema={}, max_concurrency=2))
+
+        await asyncio.gather(*(registry.invoke("try_on", {"n": i}) for i in range(6)))
+        self.assertEqual(target.calls, 6)
+        self.assertEqual(target.max_running, 2)
+
+    async def test_result_metadata(self):
+        seen = []
+        registry = ToolRegistry()
+        tool = Tool(target=CountingTarget(), schema={}, destination=ToolResultDirection.TO_SERVER,
+                    model_visible=False, on_result=lambda session, args, result: seen.append(args))
+        registry.register("state", tool)
+
+        result = await registry.invoke("state", {"x": 1})
+
+        self.assertEqual(result.destination, ToolResultDirection.TO_SERVER)
+        self.assertEqual(seen, [{"x": 1}])
+        self.assertNotIn("args", tool.model_output(result))
+
+    def test_model_hidden_fields(self):
+        tool = Tool(target=CountingTarget(), schema={}, model_hidden_fields=("imageSrcsets", "image_variants"))
+        products = [{"id": "CLO001", "imageUrls": ["a.png"], "imageSrcsets": [{}], "image_variants": []}]
+        result = ToolResult({"products": products}, ToolResultDirection.TO_CLIENT)
+
+        self.assertEqual(json.loads(tool.model_output(result)), {"products": [{"id": "CLO001", "imageUrls": ["a.png"]}]})
+        self.assertIn("imageSrcsets", result.to_text())
+
+    async def test_failing_result_hook(self):
+        def fail(session, args, result):
+            raise KeyError("cart")
+
+        registry = ToolRegistry()
+        registry.register("state", Tool(target=CountingTarget(), schema={}, on_result=fail))
+
+        with self.assertLogs("voicerag", level="ERROR"):
+            result = await registry.invoke("state", {"x": 1})
+        self.assertTrue(result.text["ok"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
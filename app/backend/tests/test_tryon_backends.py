@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pluggable try-on backends.
+"""
+
+import os
+import sys
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from PIL import Image
+
+from exceptions import ConfigurationError
+from image_tools.image_pipeline import process_image
+from services.tryon_backends import LocalTryOnBackend, TryOnBackend, VertexTryOnBackend, create_backend
+from services.virtual_tryon_service import VirtualTryOnService
+
+
+def make_image(width: int, height: int, fmt: str, color=(180, 40, 40)) -> bytes:
+    buffer = BytesIO()
+    mode = "RGBA" if fmt == "PNG" else "RGB"
+    Image.new(mode, (width, height), color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class TestLocalTryOnBackend(unittest.IsolatedAsyncioTestCase):
+    """The local backend composites deterministically after a synthetic delay"""
+
+    def setUp(self):
+        self.person = process_image(make_image(1200, 1600, "JPEG"), "JPEG")
+        self.garment = process_image(make_image(600, 800, "PNG", (20, 200, 20)), "PNG")
+
+    async def test_composites_garment_at_output_size(self):
+        backend = LocalTryOnBackend(output_size=(300, 400))
+        first = await backend.generate(self.person, self.garment, "prompt")
+        second = await backend.generate(self.person, self.garment, "prompt")
+
+        self.assertEqual(first, second)
+        with Image.open(BytesIO(first)) as result:
+            self.assertEqual(result.size, (300, 400))
+            self.assertEqual(result.getpixel((150, 200))[:3], (20, 200, 20))
+            # The person photo went through JPEG, so only approximately its color
+            for channel, expected in zip(result.getpixel((5, 5)), (180, 40, 40)):
+                self.assertAlmostEqual(channel, expected, delta=3)
+
+    async def test_synthetic_latency(self):
+        backend = LocalTryOnBackend(latency_seconds=0.1, jitter_seconds=0.05, output_size=(64, 64))
+        started = time.perf_counter()
+        await backend.generate(self.person, self.garment, "prompt")
+        self.assertGreaterEqual(time.perf_counter() - started, 0.1)
+
+    async def test_service_runs_on_local_backend(self):
+        with mock.patch.dict(os.environ, {"VIRTUAL_TRYON_BACKEND": "local", "LOCAL_TRYON_OUTPUT_SIZE": "96x128"}):
+            service = VirtualTryOnService()
+        self.assertIsInstance(service.backend, LocalTryOnBackend)
+
+        success, image, error = await service.generate_virtual_tryon(make_image(1200, 1600, "JPEG"),
+                                                                     make_image(600, 800, "PNG"))
+        self.assertTrue(success, error)
+        with Image.open(BytesIO(image)) as result:
+            self.assertEqual(result.size, (96, 128))
+
+
+class TestCreateBackend(unittest.TestCase):
+    """Backends are selected by name or VIRTUAL_TRYON_BACKEND"""
+
+    def test_selection(self):
+        self.assertIsInstance(create_backend("vertex"), VertexTryOnBackend)
+        with mock.patch.dict(os.environ, {"VIRTUAL_TRYON_BACKEND": "local", "LOCAL_TRYON_LATENCY_MS": "250"}):
+            backend = create_backend()
+        self.assertIsInstance(backend, LocalTryOnBackend)
+        self.assertEqual(backend.latency_seconds, 0.25)
+        with self.assertRaises(ConfigurationError):
+            create_backend("unknown")
+
+    def test_backends_must_implement_generate(self):
+        class Incomplete(TryOnBackend):
+            name = "incomplete"
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_vertex_requires_credentials(self):
+        with mock.patch.dict(os.environ, {"GOOGLE_CLOUD_API_KEY": ""}):
+            with self.assertRaises(ConfigurationError):
+                create_backend("vertex")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
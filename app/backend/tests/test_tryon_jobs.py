@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the background try-on job queue.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from exceptions import QueueFullError
+from services.admission import AdmissionController
+from services.tryon_jobs import FAILED, SUCCEEDED, TryOnJob, TryOnJobQueue
+
+
+class TestTryOnJobQueue(unittest.IsolatedAsyncioTestCase):
+    """Job submission, ordering, rejection and progress"""
+
+    async def asyncSetUp(self):
+        self.queue = TryOnJobQueue(workers=1, max_depth=3)
+        self.order = []
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+
+    def work(self, name, delay=0.01, fail=False):
+        async def run(job):
+            await job.set_progress("generating", 0.5)
+            await asyncio.sleep(delay)
+            self.order.append(name)
+            if fail:
+                raise RuntimeError("generation failed")
+            return {"name": name}
+        return run
+
+    async def test_submit_returns_immediately_and_completes(self):
+        job = self.queue.submit(self.work("a", delay=0.05), product_id="CLO001")
+        self.assertFalse(job.done)
+        job = await self.queue.wait(job.id, timeout=1)
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertEqual(job.result, {"name": "a"})
+        self.assertEqual(self.queue.get(job.id).to_dict()["progress"], 1.0)
+
+    async def test_higher_priority_runs_first(self):
+        blocker = self.queue.submit(self.work("blocker", delay=0.05), product_id="CLO001")
+        await asyncio.sleep(0.01)  # let the single worker pick up the blocker
+        low = self.queue.submit(self.work("low"), product_id="CLO001", priority="low")
+        high = self.queue.submit(self.work("high"), product_id="CLO001", priority="high")
+        for job in (blocker, low, high):
+            await self.queue.wait(job.id, timeout=1)
+        self.assertEqual(self.order, ["blocker", "high", "low"])
+
+    async def test_rejects_beyond_queue_depth(self):
+        self.queue.submit(self.work("running", delay=0.1), product_id="CLO001")
+        await asyncio.sleep(0.01)
+        for i in range(3):
+            self.queue.submit(self.work(f"queued{i}"), product_id="CLO001")
+        with self.assertRaises(QueueFullError) as ctx:
+            self.queue.submit(self.work("rejected"), product_id="CLO001")
+        self.assertGreater(ctx.exception.retry_after, 0)
+        self.assertEqual(self.queue.metrics()["rejected"], 1)
+
+    async def test_batch_is_queued_all_or_none(self):
+        self.queue.submit(self.work("running", delay=0.1), product_id="CLO001")
+        await asyncio.sleep(0.01)
+        self.queue.submit(self.work("queued"), product_id="CLO001")
+        with self.assertRaises(QueueFullError):
+            self.queue.submit_many([(self.work(f"batch{i}"), "CLO002") for i in range(3)])
+        self.assertEqual(self.queue.depth, 1)
+
+        jobs = self.queue.submit_many([(self.work(f"batch{i}"), "CLO002") for i in range(2)])
+        self.assertEqual(self.queue.depth, 3)
+        for job in jobs:
+            await self.queue.wait(job.id, timeout=1)
+
+    async def test_progress_is_published_to_listeners_and_subscribers(self):
+        pushed = []
+
+        async def listener(job, event):
+            pushed.append((job.session_id, event))
+
+        self.queue.listeners.append(listener)
+        job = self.queue.submit(self.work("a"), product_id="CLO001", session_id="session-1")
+        events = self.queue.subscribe(job.id)
+        await self.queue.wait(job.id, timeout=1)
+
+        received = []
+        while not events.empty():
+            received.append((await events.get())[0])
+        self.assertEqual(received, ["started", "progress", "succeeded"])
+        self.assertEqual(pushed, [("session-1", e) for e in received])
+
+    async def test_failures_and_metrics(self):
+        job = self.queue.submit(self.work("a", fail=True), product_id="CLO001")
+        job = await self.queue.wait(job.id, timeout=1)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.error, "generation failed")
+
+        metrics = self.queue.metrics()
+        self.assertEqual((metrics["submitted"], metrics["failed"]), (1, 1))
+        self.assertIsNotNone(metrics["queue_wait_seconds"]["p50"])
+        self.assertGreater(metrics["worker_utilization"], 0)
+
+
+class TestAdmittedDispatch(unittest.IsolatedAsyncioTestCase):
+    """Workers only take jobs admission control lets run, sessions take turns"""
+
+    async def asyncSetUp(self):
+        self.admission = AdmissionController(max_concurrent=2, max_per_session=1, max_waiting=1)
+        self.queue = TryOnJobQueue(workers=3, max_depth=8, admission=self.admission)
+        self.order = []
+        self.running = {}
+        self.max_running = {}
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+
+    def work(self, name, delay=0.02):
+        async def run(job):
+            # Like the try-on service, only the model call holds the slot
+            async with self.admission.slot(job.admission_key):
+                self.order.append(name)
+                self.running[job.session_id] = self.running.get(job.session_id, 0) + 1
+                self.max_running[job.session_id] = max(self.max_running.get(job.session_id, 0), self.running[job.session_id])
+                await asyncio.sleep(delay)
+                self.running[job.session_id] -= 1
+            return {"name": name}
+        return run
+
+    async def test_sessions_take_turns_within_their_caps(self):
+        jobs = [self.queue.submit(self.work(f"burst{i}"), product_id="CLO001", session_id="burst") for i in range(4)]
+        jobs += [self.queue.submit(self.work(f"other{i}"), product_id="CLO001", session_id="other") for i in range(2)]
+        await asyncio.sleep(0)
+        # The third worker stays free, the waiting jobs do not hold it
+        self.assertEqual((self.admission.active, self.queue.depth), (2, 4))
+
+        for job in jobs:
+            self.assertEqual((await self.queue.wait(job.id, timeout=1)).status, SUCCEEDED)
+        self.assertEqual(self.order[:4], ["burst0", "other0", "burst1", "other1"])
+        self.assertEqual(self.max_running, {"burst": 1, "other": 1})
+        # Waiting in the job queue never counts against the admission wait queue
+        self.assertEqual(self.admission.metrics()["rejected"], 0)
+        self.assertEqual(self.admission.active, 0)
+
+    async def test_priority_comes_before_turns(self):
+        blocker = self.queue.submit(self.work("blocker", delay=0.05), product_id="CLO001", session_id="a")
+        await asyncio.sleep(0)
+        low = self.queue.submit(self.work("low"), product_id="CLO001", session_id="b", priority="low")
+        high = self.queue.submit(self.work("high"), product_id="CLO001", session_id="a", priority="high")
+        for job in (blocker, low, high):
+            await self.queue.wait(job.id, timeout=1)
+        # The high priority job waits for its session's slot, the free slot serves the other session
+        self.assertEqual(self.order, ["blocker", "low", "high"])
+
+    async def test_anonymous_requests_are_capped_separately(self):
+        first = [self.queue.submit(self.work(f"first{i}"), product_id="CLO001") for i in range(2)]
+        second = self.queue.submit(self.work("second"), product_id="CLO001", admission_key="client:10.0.0.2")
+        self.assertNotEqual(first[0].admission_key, first[1].admission_key)
+        self.assertEqual(second.admission_key, "client:10.0.0.2")
+        for job in first + [second]:
+            self.assertEqual((await self.queue.wait(job.id, timeout=1)).status, SUCCEEDED)
+        metrics = self.admission.metrics()
+        self.assertEqual(metrics["admitted"], 3)
+        self.assertIsNotNone(metrics["hold_seconds"]["p50"])
+
+
+
+class FakeMiddleTier:
+    """Records what the job listener sends to the client and the conversation."""
+
+    def __init__(self):
+        self.client = []
+        self.notes = []
+
+    async def send_to_client(self, session_id, message):
+        self.client.append(message)
+        return True
+
+    async def add_system_message(self, session_id, text):
+        self.notes.append(text)
+        return "mt_note"
+
+
+class TestJobEventsPush(unittest.IsolatedAsyncioTestCase):
+    """Finished jobs are announced to the assistant and delivered to the client after that item"""
+
+    async def test_outcomes_are_pushed(self):
+        import ragtools
+        rtmt = FakeMiddleTier()
+        push = ragtools._push_try_on_job_events(rtmt)
+
+        job = TryOnJob("s1", "CLO001")
+        await push(job, "progress")
+        self.assertEqual([m["type"] for m in rtmt.client], ["extension.tryon_job"])
+        self.assertEqual(rtmt.notes, [])
+
+        job.status, job.result = SUCCEEDED, {"action": "virtual_try_on_result", "product_id": "CLO001"}
+        await push(job, "succeeded")
+        self.assertIn("CLO001 is ready", rtmt.notes[0])
+        self.assertEqual(rtmt.client[-1]["previous_item_id"], "mt_note")
+
+        failed = TryOnJob("s1", "CLO002")
+        failed.status, failed.error = FAILED, "generation failed"
+        await push(failed, "failed")
+        self.assertIn("failed: generation failed", rtmt.notes[-1])
+        self.assertIn('"action": "virtual_try_on_error"', rtmt.client[-1]["tool_result"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the try-on result cache index.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from services.tryon_result_cache import TryOnResultCache, result_key
+from services.tryon_result_store import TryOnResultStore
+
+
+class TestTryOnResultCache(unittest.IsolatedAsyncioTestCase):
+    """Cache keys map to stored results, with a TTL and a persisted index"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = TryOnResultStore(self.tmp.name)
+        self.keys = [result_key(f"person{i}", "CLO001", "garment", "1") for i in range(3)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_key_depends_on_every_component(self):
+        base = result_key("person", "CLO001", "garment", "1")
+        self.assertNotEqual(base, result_key("person", "CLO002", "garment", "1"))
+        self.assertNotEqual(base, result_key("person", "CLO001", "garment", "2"))
+        self.assertNotEqual(base, result_key("person", "CLO001", "garment-v2", "1"))
+        self.assertNotEqual(base, result_key("other", "CLO001", "garment", "1"))
+
+    async def test_keys_share_identical_results(self):
+        cache = TryOnResultCache(self.store)
+        digest = await self.store.put(b"image")
+        await cache.put(self.keys[0], digest)
+        await cache.put(self.keys[1], digest)
+
+        self.assertEqual(cache.get(self.keys[0]).digest, digest)
+        self.assertEqual(cache.get(self.keys[1]).digest, digest)
+        self.assertIsNone(cache.get(self.keys[2]))
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(cache.metrics()["hit_rate"], 0.667)
+
+    async def test_expired_entries_are_dropped(self):
+        cache = TryOnResultCache(self.store, ttl_seconds=60)
+        await cache.put(self.keys[0], await self.store.put(b"image"))
+        cache._index[self.keys[0]].created_at = time.time() - 120
+        self.assertIsNone(cache.lookup(self.keys[0]))
+        self.assertEqual(len(cache), 0)
+
+    async def test_entries_removed_by_retention_are_dropped(self):
+        cache = TryOnResultCache(self.store)
+        digest = await self.store.put(b"image")
+        await cache.put(self.keys[0], digest)
+        self.store._index[digest].last_access = 0
+        await self.store.enforce_retention()
+        self.assertIsNone(cache.get(self.keys[0]))
+
+    async def test_index_is_persisted(self):
+        cache = TryOnResultCache(self.store)
+        digest = await self.store.put(b"image", "WEBP")
+        preview = await self.store.put(b"preview", "WEBP")
+        await cache.put(self.keys[0], digest, preview)
+
+        reloaded = TryOnResultCache(TryOnResultStore(self.tmp.name))
+        self.assertEqual(len(reloaded), 1)
+        entry = reloaded.get(self.keys[0])
+        self.assertEqual((entry.digest, entry.preview), (digest, preview))
+
+    async def test_removed_preview_is_forgotten(self):
+        cache = TryOnResultCache(self.store)
+        digest = await self.store.put(b"image")
+        preview = await self.store.put(b"preview")
+        await cache.put(self.keys[0], digest, preview)
+        self.store._index[preview].last_access = 0
+        self.store._index.move_to_end(preview, last=False)
+        await self.store.enforce_retention()
+
+        entry = cache.get(self.keys[0])
+        self.assertEqual(entry.digest, digest)
+        self.assertIsNone(entry.preview)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the content-addressed try-on result store and the results route.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from services import virtual_tryon_endpoint
+from services.tryon_result_store import StoredResult, TryOnResultStore
+
+
+class TestTryOnResultStore(unittest.IsolatedAsyncioTestCase):
+    """Write-once results with quota and age retention"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_identical_results_are_written_once(self):
+        store = TryOnResultStore(self.tmp.name)
+        first = await store.put(b"image")
+        mtime = store.path(first).stat().st_mtime_ns
+        second = await store.put(b"image")
+
+        self.assertEqual(first, second)
+        self.assertEqual(store.path(first).stat().st_mtime_ns, mtime)
+        self.assertEqual(store.metrics()["bytes"], 5)
+        self.assertEqual(await store.read(first), b"image")
+
+    async def test_retention_enforces_quota_in_lru_order(self):
+        store = TryOnResultStore(self.tmp.name, quota_bytes=250)
+        digests = [await store.put(bytes([i]) * 100) for i in range(3)]
+        store.lookup(digests[0])  # digests[1] is now least recently used
+
+        self.assertEqual(await store.enforce_retention(), 1)
+        self.assertIsNone(store.lookup(digests[1]))
+        self.assertFalse(store.path(digests[1]).exists())
+        self.assertIsNotNone(store.lookup(digests[0]))
+        self.assertEqual(store.metrics()["bytes"], 200)
+
+    async def test_retention_enforces_age_limit(self):
+        store = TryOnResultStore(self.tmp.name, max_age_seconds=60)
+        old = await store.put(b"old")
+        recent = await store.put(b"recent")
+        store._index[old].last_access = time.time() - 120
+        legacy = os.path.join(self.tmp.name, "tryon_CLO001_1758107702.png")
+        with open(legacy, "wb") as f:
+            f.write(b"unmanaged result")
+        os.utime(legacy, (time.time() - 120, time.time() - 120))
+
+        self.assertEqual(await store.enforce_retention(), 2)
+        self.assertIsNone(store.lookup(old))
+        self.assertIsNotNone(store.lookup(recent))
+        self.assertFalse(os.path.exists(legacy))
+
+    async def test_results_stored_during_retention_are_not_left_without_file(self):
+        store = TryOnResultStore(self.tmp.name, max_age_seconds=60)
+        old = await store.put(b"old")
+        store._index[old].last_access = time.time() - 120
+        remove_files = store._remove_files
+
+        def put_again_while_removing(paths, cutoff):
+            store._index[old] = StoredResult(3, time.time(), "png")
+            store._bytes += 3
+            return remove_files(paths, cutoff)
+
+        with mock.patch.object(store, "_remove_files", put_again_while_removing):
+            self.assertEqual(await store.enforce_retention(), 1)
+        self.assertIsNone(store.lookup(old))
+        self.assertEqual(store.metrics()["bytes"], 0)
+
+    async def test_index_is_rebuilt_from_disk(self):
+        store = TryOnResultStore(self.tmp.name)
+        digest = await store.put(b"image")
+
+        reloaded = TryOnResultStore(self.tmp.name)
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual(await reloaded.read(digest), b"image")
+
+    async def test_format_sets_extension_and_content_type(self):
+        store = TryOnResultStore(self.tmp.name)
+        digest = await store.put(b"webp image", "WEBP")
+        self.assertEqual(store.filename(digest), f"tryon_{digest}.webp")
+        self.assertEqual(store.content_type(digest), "image/webp")
+
+        reloaded = TryOnResultStore(self.tmp.name)
+        self.assertEqual(reloaded.url(digest), f"/api/virtual-tryon-results/tryon_{digest}.webp")
+
+
+class TestTryOnResultRoute(unittest.IsolatedAsyncioTestCase):
+    """Results are served from the store with immutable caching, ETags and ranges"""
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = TryOnResultStore(self.tmp.name)
+        self.digest = await self.store.put(b"0123456789" * 10)
+        patcher = mock.patch.object(virtual_tryon_endpoint, "tryon_result_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = web.Application()
+        app.router.add_get('/api/virtual-tryon-results/{filename}', virtual_tryon_endpoint.virtual_tryon_result_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.tmp.cleanup()
+
+    async def test_result_is_served_with_cache_headers(self):
+        response = await self.client.get(self.store.url(self.digest))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.read(), b"0123456789" * 10)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response.headers["Content-Type"], "image/png")
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        revalidated = await self.client.get(self.store.url(self.digest), headers={"If-None-Match": etag})
+        self.assertEqual(revalidated.status, 304)
+
+    async def test_webp_result_is_served_under_its_extension(self):
+        digest = await self.store.put(b"webp image", "WEBP")
+        response = await self.client.get(self.store.url(digest))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["Content-Type"], "image/webp")
+
+        response = await self.client.get(f"/api/virtual-tryon-results/tryon_{digest}.png")
+        self.assertEqual(response.status, 404)
+
+    async def test_range_request(self):
+        response = await self.client.get(self.store.url(self.digest), headers={"Range": "bytes=10-19"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(await response.read(), b"0123456789")
+
+    async def test_unknown_and_unmanaged_files_are_not_served(self):
+        with open(os.path.join(self.tmp.name, "tryon_CLO001_1758107702.png"), "wb") as f:
+            f.write(b"unmanaged result")
+        for filename in ("tryon_CLO001_1758107702.png", f"tryon_{'0' * 64}.png", "result_index.json"):
+            response = await self.client.get(f"/api/virtual-tryon-results/{filename}")
+            self.assertEqual(response.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
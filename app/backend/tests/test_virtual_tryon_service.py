@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Unit tests for VirtualTryOnService that run without Vertex AI.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.offline_env import apply_offline_env
+apply_offline_env()
+
+from PIL import Image
+from google.genai import types
+
+import ragtools
+from config.settings import Settings
+from exceptions import ImageProcessingError
+from image_tools import image_pipeline
+from services import virtual_tryon_service as virtual_tryon_service_module
+from services.admission import AdmissionController
+from services.tryon_jobs import FAILED, SUCCEEDED, TryOnJobQueue
+from services.tryon_result_cache import TryOnResultCache
+from services.tryon_result_store import TryOnResultStore
+from services.virtual_tryon_service import VirtualTryOnService
+
+
+def make_image(width: int, height: int, fmt: str, color=(180, 40, 40)) -> bytes:
+    buffer = BytesIO()
+    mode = "RGBA" if fmt == "PNG" else "RGB"
+    Image.new(mode, (width, height), color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class FakeAsyncModels:
+    """Stands in for client.aio.models, answering after a fixed latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        image = types.Part(inline_data=types.Blob(data=make_image(512, 512, "PNG"), mime_type="image/png"))
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[image]))])
+
+
+class FakeClient:
+    def __init__(self, latency: float):
+        self.aio = type("Aio", (), {})()
+        self.aio.models = FakeAsyncModels(latency)
+        self.models = None  # the blocking client must not be used
+
+
+class TestVirtualTryOnService(unittest.IsolatedAsyncioTestCase):
+    """Try-on generation must not block the event loop"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {"VIRTUAL_TRYON_MAX_CONCURRENCY": "2"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = VirtualTryOnService()
+        self.service.backend.client = FakeClient(latency=0.3)
+        self.person = make_image(3024, 4032, "JPEG")
+        self.garment = make_image(1200, 1600, "PNG")
+
+    async def test_event_loop_lag_stays_low_during_tryons(self):
+        lags = []
+        stop = asyncio.Event()
+
+        async def monitor(interval: float = 0.01):
+            while not stop.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                lags.append(time.perf_counter() - started - interval)
+
+        monitor_task = asyncio.create_task(monitor())
+        results = await asyncio.gather(*(
+            self.service.generate_virtual_tryon(self.person, self.garment, {"id": f"CLO00{i}"})
+            for i in range(4)
+        ))
+        stop.set()
+        await monitor_task
+
+        self.assertTrue(all(success for success, _, _ in results), results)
+        self.assertLess(max(lags), 0.1, f"event loop blocked for {max(lags) * 1000:.0f}ms")
+
+    async def test_concurrency_is_bounded(self):
+        await asyncio.gather(*(
+            self.service.generate_virtual_tryon(self.person, self.garment, {"id": "CLO001"})
+            for _ in range(5)
+        ))
+        self.assertEqual(self.service.backend.client.aio.models.calls, 5)
+        self.assertEqual(self.service.backend.client.aio.models.max_in_flight, 2)
+
+    async def test_invalid_person_image(self):
+        success, image, error = await self.service.generate_virtual_tryon(make_image(50, 50, "JPEG"), self.garment)
+        self.assertFalse(success)
+        self.assertIsNone(image)
+        self.assertEqual(error, "Invalid person image")
+
+    async def test_unencodable_result_keeps_its_real_format(self):
+        generated = make_image(300, 400, "JPEG")
+        with mock.patch.object(virtual_tryon_service_module, "run_in_pool",
+                               side_effect=ImageProcessingError("encoder unavailable")):
+            full, preview = await self.service._encode_result(generated)
+            self.assertEqual((full.format, full.mime_type, preview), ("JPEG", "image/jpeg", None))
+
+            with self.assertRaises(ImageProcessingError):
+                await self.service._encode_result(b"not an image")
+
+    def test_result_format_is_validated(self):
+        with mock.patch.dict(os.environ, {"VIRTUAL_TRYON_RESULT_FORMAT": "gif"}):
+            with self.assertRaises(ValueError):
+                Settings()
+
+    def test_tuning_settings_are_validated(self):
+        for key, value in (("VIRTUAL_TRYON_RESULT_QUALITY", "0"), ("VIRTUAL_TRYON_MAX_CONCURRENCY", "many"),
+                           ("VIRTUAL_TRYON_BACKEND", "remote"), ("LOCAL_TRYON_OUTPUT_SIZE", "768"),
+                           ("IMAGE_CACHE_MAX_MB", "-1"), ("IMAGE_DERIVATIVE_WIDTHS", "320,wide")):
+            with self.subTest(key=key), mock.patch.dict(os.environ, {key: value}):
+                with self.assertRaises(ValueError):
+                    Settings()
+
+        with mock.patch.dict(os.environ, {"VIRTUAL_TRYON_PREVIEW_QUALITY": "55", "IMAGE_DERIVATIVE_WIDTHS": "320, 640"}):
+            self.assertEqual(Settings().tryon_preview_quality, 55)
+
+
+class TestVirtualTryOnResultCache(unittest.IsolatedAsyncioTestCase):
+    """Repeated try-ons of the same photo and product are served from the result cache"""
+
+    async def test_repeated_tryon_is_a_cache_hit(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            store = TryOnResultStore(results_dir)
+            cache = TryOnResultCache(store)
+            service = VirtualTryOnService(result_store=store, result_cache=cache)
+            service.backend.client = FakeClient(latency=0.3)
+            person = make_image(1200, 1600, "JPEG")
+            garment = make_image(800, 800, "PNG")
+
+            first = await service.generate(person, garment, {"id": "CLO001"})
+            started = time.perf_counter()
+            second = await service.generate(person, garment, {"id": "CLO001"})
+            elapsed = time.perf_counter() - started
+            other_product = await service.generate(person, garment, {"id": "CLO002"})
+
+            self.assertFalse(first.cached)
+            self.assertTrue(second.cached)
+            self.assertEqual(second.result_id, first.result_id)
+            self.assertEqual(await store.read(second.result_id), first.image)
+            self.assertLess(elapsed, 0.05)
+            self.assertFalse(other_product.cached)
+            self.assertEqual(service.backend.client.aio.models.calls, 2)
+            self.assertTrue(store.path(first.result_id).exists())
+            self.assertEqual(cache.metrics()["hits"], 1)
+
+            # Results are stored as WebP next to a preview, and cache hits return both
+            self.assertEqual(store.content_type(first.result_id), "image/webp")
+            self.assertEqual(second.preview_id, first.preview_id)
+            preview = Image.open(BytesIO(await store.read(first.preview_id)))
+            self.assertEqual(preview.size, (384, 384))
+
+    async def test_new_garment_image_is_a_cache_miss(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            store = TryOnResultStore(results_dir)
+            service = VirtualTryOnService(result_store=store, result_cache=TryOnResultCache(store))
+            service.backend.client = FakeClient(latency=0.01)
+            person = make_image(1200, 1600, "JPEG")
+            garment = image_pipeline.process_image(make_image(800, 800, "PNG"), "PNG")
+
+            first = await service.generate(person, garment, {"id": "CLO001"})
+            again = await service.generate(person, garment, {"id": "CLO001"})
+            updated = await service.generate(person, make_image(800, 600, "PNG"), {"id": "CLO001"})
+
+            self.assertTrue(again.cached)
+            self.assertFalse(updated.cached)
+            self.assertNotEqual(updated.cache_key, first.cache_key)
+            self.assertEqual(service.backend.client.aio.models.calls, 2)
+
+
+class TestVirtualTryOnBatch(unittest.IsolatedAsyncioTestCase):
+    """A batch preprocesses the person photo once and generates every product"""
+
+    async def test_batch_preprocesses_person_once(self):
+        service = VirtualTryOnService()
+        service.backend.client = FakeClient(latency=0.05)
+        garment = image_pipeline.process_image(make_image(800, 800, "PNG"), "PNG")
+        preprocessed = []
+
+        async def counting_process_image_async(data, *args, **kwargs):
+            preprocessed.append(len(data))
+            return await image_pipeline.process_image_async(data, *args, **kwargs)
+
+        async def fetch_garment(product_id, image_service=None):
+            return garment
+
+        queue = TryOnJobQueue(workers=3, max_depth=8, admission=service.admission)
+        with mock.patch.object(ragtools, "virtual_tryon_service", service), \
+                mock.patch.object(ragtools, "tryon_job_queue", queue), \
+                mock.patch.object(ragtools, "_fetch_clothing_image", fetch_garment), \
+                mock.patch.object(virtual_tryon_service_module, "process_image_async", counting_process_image_async):
+            jobs = await ragtools.submit_virtual_try_on_batch(
+                ["CLO001", "CLO002", "CLO003"], make_image(1200, 1600, "JPEG"))
+            finished = [await queue.wait(job.id, timeout=5) for job in jobs]
+        await queue.stop()
+
+        self.assertEqual([job.status for job in finished], [SUCCEEDED] * 3)
+        self.assertEqual(len(preprocessed), 1)
+        self.assertEqual(service.backend.client.aio.models.calls, 3)
+        self.assertLessEqual(service.backend.client.aio.models.max_in_flight, 2)
+        self.assertEqual(service.admission.metrics()["admitted"], 3)
+
+    async def test_jobs_turned_away_by_admission_carry_a_retry_hint(self):
+        service = VirtualTryOnService(admission=AdmissionController(max_concurrent=1, max_waiting=0))
+        service.backend.client = FakeClient(latency=0.2)
+        garment = image_pipeline.process_image(make_image(800, 800, "PNG"), "PNG")
+
+        async def fetch_garment(product_id, image_service=None):
+            return garment
+
+        queue = TryOnJobQueue(workers=2, max_depth=8)
+        with mock.patch.object(ragtools, "virtual_tryon_service", service), \
+                mock.patch.object(ragtools, "tryon_job_queue", queue), \
+                mock.patch.object(ragtools, "_fetch_clothing_image", fetch_garment):
+            jobs = [ragtools.submit_virtual_try_on("CLO001", make_image(1200, 1600, "JPEG"), admission_key=f"client:{i}")
+                    for i in range(2)]
+            finished = [await queue.wait(job.id, timeout=5) for job in jobs]
+        await queue.stop()
+
+        self.assertEqual(sorted(job.status for job in finished), [FAILED, SUCCEEDED])
+        rejected = next(job for job in finished if job.status == FAILED)
+        self.assertIsNotNone(rejected.retry_after)
+        self.assertEqual(service.admission.metrics()["rejected"], 1)
+
+    async def test_failed_preprocessing_cancels_garment_fetches(self):
+        service = VirtualTryOnService()
+        fetches = []
+
+        async def slow_fetch_garment(product_id, image_service=None):
+            fetches.append(asyncio.current_task())
+            await asyncio.sleep(10)
+
+        async def failing_prepare_person_image(data):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("decoder crashed")
+
+        with mock.patch.object(ragtools, "virtual_tryon_service", service), \
+                mock.patch.object(ragtools, "_fetch_clothing_image", slow_fetch_garment), \
+                mock.patch.object(service, "prepare_person_image", failing_prepare_person_image):
+            with self.assertRaises(RuntimeError):
+                await ragtools.submit_virtual_try_on_batch(["CLO001", "CLO002"], b"person")
+            await asyncio.sleep(0)
+
+        self.assertEqual(len(fetches), 2)
+        self.assertTrue(all(fetch.cancelled() for fetch in fetches))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,248 @@
+"""
+Tool registry for the realtime middle tier.
+Tools declare how they may be executed (caching, deduplication, timeouts, concurrency, result
+routing) and the registry applies that behaviour through a middleware chain.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional
+
+from single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    from rtmt import RTSession
+
+logger = logging.getLogger("voicerag")
+
+class ToolResultDirection(Enum):
+    TO_SERVER = 1
+    TO_CLIENT = 2
+
+class ToolResult:
+    text: str
+    destination: ToolResultDirection
+
+    def __init__(self, text: str, destination: ToolResultDirection):
+        self.text = text
+        self.destination = destination
+
+    def to_text(self) -> str:
+        if self.text is None:
+            return ""
+        return self.text if type(self.text) == str else json.dumps(self.text)
+
+    @property
+    def is_error(self) -> bool:
+        return isinstance(self.text, dict) and "error" in self.text
+
+class Tool:
+    target: Callable[..., ToolResult]
+    schema: Any
+    # Optional availability policy, the tool is only offered to sessions for which it returns True
+    is_available: Optional[Callable[["RTSession"], bool]]
+
+    # Execution metadata applied by the registry middleware
+    cacheable: bool
+    cache_key_fields: Optional[tuple[str, ...]]  # None means all arguments
+    cache_scope: str  # "session" or "global"
+    cache_ttl: float
+    idempotent: bool  # identical in-flight calls share one execution
+    timeout: Optional[float]
+    max_concurrency: Optional[int]
+    destination: Optional[ToolResultDirection]  # overrides the destination chosen by the target
+    model_visible: bool  # when False the model only receives a short acknowledgement
+    model_hidden_fields: tuple[str, ...]  # result fields only the client needs, left out of the model's copy
+    # Called with every result, including cached ones, for session side effects
+    on_result: Optional[Callable[[Optional["RTSession"], dict[str, Any], ToolResult], None]]
+
+    def __init__(
+        self,
+        target: Any,
+        schema: Any,
+        is_available: Optional[Callable[["RTSession"], bool]] = None,
+        cacheable: bool = False,
+        cache_key_fields: Optional[tuple[str, ...]] = None,
+        cache_scope: str = "session",
+        cache_ttl: float = 300,
+        idempotent: bool = False,
+        timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        destination: Optional[ToolResultDirection] = None,
+        model_visible: bool = True,
+        model_hidden_fields: tuple[str, ...] = (),
+        on_result: Optional[Callable[[Optional["RTSession"], dict[str, Any], ToolResult], None]] = None
+    ):
+        self.target = target
+        self.schema = schema
+        self.is_available = is_available
+        self.cacheable = cacheable
+        self.cache_key_fields = cache_key_fields
+        self.cache_scope = cache_scope
+        self.cache_ttl = cache_ttl
+        self.idempotent = idempotent
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.destination = destination
+        self.model_visible = model_visible
+        self.model_hidden_fields = model_hidden_fields
+        self.on_result = on_result
+
+    def model_output(self, result: ToolResult) -> str:
+        """Text the model receives for a result of this tool."""
+        if self.model_visible or result.is_error:
+            if self.model_hidden_fields and isinstance(result.text, (dict, list)):
+                return json.dumps(_without_fields(result.text, frozenset(self.model_hidden_fields)))
+            return result.to_text()
+        return "The result was delivered to the user's screen."
+
+def _without_fields(value: Any, fields: frozenset[str]) -> Any:
+    """Copy of a JSON value with the given keys removed at every level."""
+    if isinstance(value, dict):
+        return {k: _without_fields(v, fields) for k, v in value.items() if k not in fields}
+    if isinstance(value, list):
+        return [_without_fields(v, fields) for v in value]
+    return value
+
+class ToolInvocation:
+    """A single tool call travelling through the middleware chain."""
+    name: str
+    tool: Tool
+    args: dict[str, Any]
+    session: Optional["RTSession"]
+
+    def __init__(self, name: str, tool: Tool, args: dict[str, Any], session: Optional["RTSession"] = None):
+        self.name = name
+        self.tool = tool
+        self.args = args
+        self.session = session
+
+    def key(self, fields: Optional[tuple[str, ...]] = None) -> str:
+        """Stable key of the call, scoped to the session unless the tool caches globally."""
+        args = self.args if fields is None else {f: self.args.get(f) for f in fields}
+        scope = "" if self.tool.cache_scope == "global" or self.session is None else self.session.session_id
+        return f"{self.name}|{scope}|{json.dumps(args, sort_keys=True, default=str)}"
+
+ToolHandler = Callable[[ToolInvocation], Awaitable[ToolResult]]
+ToolMiddleware = Callable[[ToolInvocation, ToolHandler], Awaitable[ToolResult]]
+
+class CacheMiddleware:
+    """Serves results of cacheable tools from a bounded TTL cache, errors are never cached."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, ToolResult]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def __call__(self, invocation: ToolInvocation, call_next: ToolHandler) -> ToolResult:
+        tool = invocation.tool
+        if not tool.cacheable:
+            return await call_next(invocation)
+
+        key = invocation.key(tool.cache_key_fields)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info("Tool cache hit for %s", invocation.name)
+            return entry[1]
+
+        self.misses += 1
+        result = await call_next(invocation)
+        if not result.is_error:
+            self._entries[key] = (time.monotonic() + tool.cache_ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+class DeduplicationMiddleware:
+    """Identical in-flight calls of idempotent tools share a single execution."""
+
+    def __init__(self):
+        self._in_flight: SingleFlight[ToolResult] = SingleFlight()
+
+    async def __call__(self, invocation: ToolInvocation, call_next: ToolHandler) -> ToolResult:
+        if not invocation.tool.idempotent:
+            return await call_next(invocation)
+
+        key = invocation.key()
+        if key in self._in_flight:
+            logger.info("Joining in-flight call of %s", invocation.name)
+        return await self._in_flight.run(key, lambda: call_next(invocation))
+
+class ConcurrencyLimitMiddleware:
+    """Limits concurrent executions per tool to the tool's max_concurrency."""
+
+    def __init__(self):
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    async def __call__(self, invocation: ToolInvocation, call_next: ToolHandler) -> ToolResult:
+        limit = invocation.tool.max_concurrency
+        if not limit:
+            return await call_next(invocation)
+
+        semaphore = self._semaphores.get(invocation.name)
+        if semaphore is None:
+            semaphore = self._semaphores[invocation.name] = asyncio.Semaphore(limit)
+        async with semaphore:
+            return await call_next(invocation)
+
+async def timeout_middleware(invocation: ToolInvocation, call_next: ToolHandler) -> ToolResult:
+    """Turns calls exceeding the tool's timeout into error results."""
+    timeout = invocation.tool.timeout
+    if timeout is None:
+        return await call_next(invocation)
+    try:
+        return await asyncio.wait_for(call_next(invocation), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Tool %s timed out after %.1fs", invocation.name, timeout)
+        return ToolResult({"error": f"The {invocation.name} tool timed out, please try again."},
+                          invocation.tool.destination or ToolResultDirection.TO_SERVER)
+
+class ToolRegistry(dict[str, Tool]):
+    """
+    Registered tools by name. Calls go through the middleware chain, outermost first:
+    caching, deduplication, concurrency limits and timeouts.
+    """
+
+    def __init__(self, middlewares: Optional[list[ToolMiddleware]] = None):
+        super().__init__()
+        self.cache = CacheMiddleware()
+        self.middlewares: list[ToolMiddleware] = middlewares if middlewares is not None else [
+            self.cache,
+            DeduplicationMiddleware(),
+            ConcurrencyLimitMiddleware(),
+            timeout_middleware,
+        ]
+
+    def register(self, name: str, tool: Tool) -> None:
+        self[name] = tool
+
+    async def invoke(self, name: str, args: dict[str, Any], session: Optional["RTSession"] = None) -> ToolResult:
+        """Run a tool through the middleware chain and apply its result metadata."""
+        tool = self[name]
+        invocation = ToolInvocation(name, tool, args, session)
+
+        async def call_target(call: ToolInvocation) -> ToolResult:
+            return await call.tool.target(call.args)
+
+        handler: ToolHandler = call_target
+        for middleware in reversed(self.middlewares):
+            handler = (lambda m, nxt: lambda call: m(call, nxt))(middleware, handler)
+
+        result = await handler(invocation)
+        if tool.destination is not None and tool.destination != result.destination:
+            result = ToolResult(result.text, tool.destination)
+        if tool.on_result is not None:
+            try:
+                tool.on_result(session, args, result)
+            except Exception:
+                # Result hooks only update side state, a failing hook must not fail the tool call
+                logger.exception("Result hook of %s failed", name)
+        return result
@@ -37,7 +37,8 @@ function App() {
         onToolResponse: (message: any) => {
             // This will be handled by the tool response handler once it's created
             toolResponseHandlerRef.current?.handleToolResponse(message);
-        }
+        },
+        onTryOnJob: virtualTryOn.handleTryOnJobEvent
     });
 
     // Create a ref to store the tool response handler
@@ -60,18 +61,29 @@ function App() {
         handleVoiceTryOnModal: virtualTryOn.handleVoiceTryOnModal,
         handleTryOnResult: virtualTryOn.handleTryOnResult,
         handleTryOnError: virtualTryOn.handleTryOnError,
+        handleTryOnStarted: virtualTryOn.handleTryOnStarted,
 
         // Messages
         setActiveContact,
-
-        // Note: State synchronization is now handled by the AI asking the user directly
     });
 
     // Store the handler in the ref for the callback
     toolResponseHandlerRef.current = toolResponseHandler;
 
     // Extract voice interface properties
-    const { isRecording, onToggleListening } = voiceInterface;
+    const { isRecording, onToggleListening, sendAppState } = voiceInterface;
+
+    // Report the selected product, cart, favorites, page and try-on modal to the backend session
+    const tryOnProductId = virtualTryOn.showTryOnModal ? virtualTryOn.tryOnProduct?.id ?? null : null;
+    useEffect(() => {
+        sendAppState({
+            current_page: shoppingFeatures.page,
+            current_product_id: productManagement.highlightedListingId || null,
+            cart: shoppingFeatures.cartItems.map(id => ({ product_id: id })),
+            wishlist: shoppingFeatures.favorites,
+            tryon_product_id: tryOnProductId
+        });
+    }, [shoppingFeatures.page, productManagement.highlightedListingId, shoppingFeatures.cartItems, shoppingFeatures.favorites, tryOnProductId]);
 
     // Product display logic using shopping features
     const displayedListings = shoppingFeatures.page === "favorites"
@@ -533,6 +545,7 @@ function App() {
                 onGenerateTryOn={virtualTryOn.handleGenerateTryOn}
                 isGenerating={virtualTryOn.isGeneratingTryOn}
                 tryOnResult={virtualTryOn.tryOnResult}
+                tryOnJob={virtualTryOn.tryOnJob}
             />
         </div>
     );
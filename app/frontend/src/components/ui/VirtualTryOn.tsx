@@ -1,6 +1,6 @@
 import { useState, useCallback, useRef } from "react";
 import { Upload, X, Camera, Loader2, Download, Share2, RefreshCw } from "lucide-react";
-import { Listing } from "@/types";
+import { Listing, TryOnJobStatus } from "@/types";
 
 interface VirtualTryOnProps {
     isOpen: boolean;
@@ -12,15 +12,27 @@ interface VirtualTryOnProps {
         imageUrl: string;
         timestamp: Date;
     } | null;
+    // Progress of a try-on the assistant started in the background
+    tryOnJob?: TryOnJobStatus | null;
 }
 
+// File extension of a try-on result, from the type of its data URL or the name of its file
+const resultExtension = (imageUrl: string): string => {
+    const match = imageUrl.startsWith('data:')
+        ? imageUrl.match(/^data:image\/([a-z0-9]+)[;,]/i)
+        : new URL(imageUrl, window.location.href).pathname.match(/\.([a-z0-9]+)$/i);
+    const extension = match ? match[1].toLowerCase() : 'png';
+    return extension === 'jpeg' ? 'jpg' : extension;
+};
+
 export default function VirtualTryOn({
     isOpen,
     onClose,
     product,
     onGenerateTryOn,
     isGenerating = false,
-    tryOnResult = null
+    tryOnResult = null,
+    tryOnJob = null
 }: VirtualTryOnProps) {
     const [userPhoto, setUserPhoto] = useState<string | null>(null);
     const [dragActive, setDragActive] = useState(false);
@@ -89,7 +101,7 @@ export default function VirtualTryOn({
         if (tryOnResult) {
             const link = document.createElement('a');
             link.href = tryOnResult.imageUrl;
-            link.download = `virtual-tryon-${product?.id}-${Date.now()}.png`;
+            link.download = `virtual-tryon-${product?.id}-${Date.now()}.${resultExtension(tryOnResult.imageUrl)}`;
             document.body.appendChild(link);
             link.click();
             document.body.removeChild(link);
@@ -281,6 +293,7 @@ export default function VirtualTryOn({
                                     <>
                                         <Loader2 className="w-5 h-5 animate-spin" />
                                         Generating Virtual Try-On...
+                                        {tryOnJob && ` ${Math.round(tryOnJob.progress * 100)}%`}
                                     </>
                                 ) : (
                                     <>
@@ -1,6 +1,9 @@
+import { useCallback } from "react";
 import useWebSocket from "react-use-websocket";
 
 import {
+    AppStateSnapshot,
+    ExtensionAppStateCommand,
     InputAudioBufferAppendCommand,
     InputAudioBufferClearCommand,
     Message,
@@ -9,8 +12,11 @@ import {
     ResponseDone,
     SessionUpdateCommand,
     ExtensionMiddleTierToolResponse,
+    ExtensionSession,
+    ExtensionTryOnJob,
     ResponseInputAudioTranscriptionCompleted
 } from "@/types";
+import { getSessionToken, setSessionToken } from "@/lib/session";
 
 type Parameters = {
     useDirectAoaiApi?: boolean; // If true, the middle tier will be skipped and the AOAI ws API will be called directly
@@ -28,6 +34,7 @@ type Parameters = {
     onReceivedInputAudioBufferSpeechStarted?: (message: Message) => void;
     onReceivedResponseDone?: (message: ResponseDone) => void;
     onReceivedExtensionMiddleTierToolResponse?: (message: ExtensionMiddleTierToolResponse) => void;
+    onReceivedExtensionTryOnJob?: (message: ExtensionTryOnJob) => void;
     onReceivedResponseAudioTranscriptDelta?: (message: ResponseAudioTranscriptDelta) => void;
     onReceivedInputAudioTranscriptionCompleted?: (message: ResponseInputAudioTranscriptionCompleted) => void;
     onReceivedError?: (message: Message) => void;
@@ -48,12 +55,18 @@ export default function useRealTime({
     onReceivedResponseAudioTranscriptDelta,
     onReceivedInputAudioBufferSpeechStarted,
     onReceivedExtensionMiddleTierToolResponse,
+    onReceivedExtensionTryOnJob,
     onReceivedInputAudioTranscriptionCompleted,
     onReceivedError
 }: Parameters) {
-    const wsEndpoint = useDirectAoaiApi
-        ? `${aoaiEndpointOverride}/openai/realtime?api-key=${aoaiApiKeyOverride}&deployment=${aoaiModelOverride}&api-version=2024-10-01-preview`
-        : `/realtime`;
+    // Evaluated on every (re)connect, so a reconnect resumes the session the backend issued
+    const wsEndpoint = useCallback(() => {
+        if (useDirectAoaiApi) {
+            return `${aoaiEndpointOverride}/openai/realtime?api-key=${aoaiApiKeyOverride}&deployment=${aoaiModelOverride}&api-version=2024-10-01-preview`;
+        }
+        const token = getSessionToken();
+        return token ? `/realtime?session_id=${encodeURIComponent(token)}` : `/realtime`;
+    }, [useDirectAoaiApi, aoaiEndpointOverride, aoaiApiKeyOverride, aoaiModelOverride]);
 
     const { sendJsonMessage } = useWebSocket(wsEndpoint, {
         onOpen: () => onWebSocketOpen?.(),
@@ -99,6 +112,17 @@ export default function useRealTime({
         sendJsonMessage(command);
     };
 
+    // Mirrors the UI state into the backend session so the assistant sees what the user sees
+    const sendAppState = (state: AppStateSnapshot) => {
+        const command: ExtensionAppStateCommand = {
+            type: "extension.app_state",
+            event: "sync",
+            state
+        };
+
+        sendJsonMessage(command);
+    };
+
     const onMessageReceived = (event: MessageEvent<any>) => {
         onWebSocketMessage?.(event);
 
@@ -126,14 +150,20 @@ export default function useRealTime({
             case "conversation.item.input_audio_transcription.completed":
                 onReceivedInputAudioTranscriptionCompleted?.(message as ResponseInputAudioTranscriptionCompleted);
                 break;
+            case "extension.session":
+                setSessionToken((message as ExtensionSession).session_id);
+                break;
             case "extension.middle_tier_tool_response":
                 onReceivedExtensionMiddleTierToolResponse?.(message as ExtensionMiddleTierToolResponse);
                 break;
+            case "extension.tryon_job":
+                onReceivedExtensionTryOnJob?.(message as ExtensionTryOnJob);
+                break;
             case "error":
                 onReceivedError?.(message);
                 break;
         }
     };
 
-    return { startSession, addUserAudio, inputAudioBufferClear };
+    return { startSession, addUserAudio, inputAudioBufferClear, sendAppState };
 }
@@ -16,11 +16,10 @@ interface ToolResponseHandlerConfig {
     handleVoiceTryOnModal: (productId: string, listings: Listing[]) => void;
     handleTryOnResult: (result: any) => void;
     handleTryOnError: (error: string) => void;
+    handleTryOnStarted: (result: any, listings: Listing[]) => void;
 
     // Messages
     setActiveContact: (contact: any) => void;
-
-    // Note: State synchronization is now handled by the AI asking the user directly
 }
 
 /**
@@ -74,6 +73,10 @@ export const useToolResponseHandler = (config: ToolResponseHandlerConfig) => {
                 config.handleVoiceTryOnModal(result.product_id, config.listings);
                 break;
 
+            case "virtual_try_on_started":
+                config.handleTryOnStarted(result, config.listings);
+                break;
+
             case "virtual_try_on_result":
                 config.handleTryOnResult(result);
                 break;
@@ -82,9 +85,8 @@ export const useToolResponseHandler = (config: ToolResponseHandlerConfig) => {
                 config.handleTryOnError(result.error);
                 break;
 
-            // Note: get_application_state is now handled by the backend directly
-            // The AI will ask the user about their current state instead of trying
-            // to gather it automatically from the frontend
+            // Note: get_application_state is answered by the backend from the session state,
+            // which App keeps in sync by sending extension.app_state on every UI state change
 
             default:
                 console.log("🤷‍♂️ Unknown tool response action:", result.action);
@@ -1,5 +1,6 @@
 import { useState } from "react";
-import { Listing } from "@/types";
+import { Listing, TryOnJobStatus } from "@/types";
+import { sessionHeaders } from "@/lib/session";
 
 /**
  * Custom hook for managing virtual try-on functionality
@@ -13,6 +14,8 @@ export const useVirtualTryOn = () => {
         imageUrl: string;
         timestamp: Date;
     } | null>(null);
+    // Background try-on job started by the assistant, until its result arrives
+    const [tryOnJob, setTryOnJob] = useState<TryOnJobStatus | null>(null);
 
     /**
      * Open virtual try-on modal for a specific product
@@ -57,6 +60,7 @@ export const useVirtualTryOn = () => {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
+                        ...sessionHeaders(),
                     },
                     body: JSON.stringify(requestBody)
                 });
@@ -67,7 +71,7 @@ export const useVirtualTryOn = () => {
 
                     if (result.tryon_image) {
                         // Convert base64 image to data URL for display
-                        const fullImageUrl = `data:image/png;base64,${result.tryon_image}`;
+                        const fullImageUrl = `data:${result.tryon_image_type || 'image/png'};base64,${result.tryon_image}`;
 
                         console.log("🖼️ Generated virtual try-on image (base64)");
 
@@ -125,11 +129,17 @@ export const useVirtualTryOn = () => {
     const handleTryOnResult = (result: any) => {
         console.log("🎉 VIRTUAL TRY-ON RESULT:", result);
         setIsGeneratingTryOn(false);
+        setTryOnJob(null);
         if (result.image_url) {
             setTryOnResult({
                 imageUrl: result.image_url,
                 timestamp: new Date()
             });
+        } else if (result.tryon_image) {
+            setTryOnResult({
+                imageUrl: `data:${result.tryon_image_type || 'image/png'};base64,${result.tryon_image}`,
+                timestamp: new Date()
+            });
         }
     };
 
@@ -139,6 +149,35 @@ export const useVirtualTryOn = () => {
     const handleTryOnError = (errorMessage: string) => {
         console.log("❌ VIRTUAL TRY-ON ERROR:", errorMessage);
         setIsGeneratingTryOn(false);
+        setTryOnJob(null);
+    };
+
+    /**
+     * Handle a try-on queued by the assistant: show the modal in its pending state until the result arrives
+     */
+    const handleTryOnStarted = (result: any, listings: Listing[]) => {
+        console.log("⏳ VIRTUAL TRY-ON STARTED:", result.job_id, result.product_id);
+        const product = listings.find(l => l.id === result.product_id);
+        if (product) {
+            setTryOnProduct(product);
+            setShowTryOnModal(true);
+        }
+        setTryOnResult(null);
+        setIsGeneratingTryOn(true);
+        setTryOnJob({
+            job_id: result.job_id,
+            product_id: result.product_id,
+            status: "queued",
+            stage: "queued",
+            progress: 0
+        });
+    };
+
+    /**
+     * Handle progress events of the background try-on job
+     */
+    const handleTryOnJobEvent = (job: TryOnJobStatus) => {
+        setTryOnJob(current => (current && current.job_id === job.job_id ? job : current));
     };
 
     /**
@@ -176,6 +215,7 @@ export const useVirtualTryOn = () => {
         setTryOnProduct(null);
         setTryOnResult(null);
         setIsGeneratingTryOn(false);
+        setTryOnJob(null);
         console.log("❌ Try-on modal closed");
     };
 
@@ -185,6 +225,7 @@ export const useVirtualTryOn = () => {
         tryOnProduct,
         isGeneratingTryOn,
         tryOnResult,
+        tryOnJob,
 
         // Actions
         handleTryOn,
@@ -194,6 +235,8 @@ export const useVirtualTryOn = () => {
         // Tool response handlers
         handleTryOnResult,
         handleTryOnError,
+        handleTryOnStarted,
+        handleTryOnJobEvent,
         handleTryOnRequest,
         handleVoiceTryOnModal
     };
@@ -2,14 +2,17 @@ import { useState } from "react";
 import useRealTime from "@/hooks/useRealtime";
 import useAudioRecorder from "@/hooks/useAudioRecorder";
 import useAudioPlayer from "@/hooks/useAudioPlayer";
+import { AppStateSnapshot, TryOnJobStatus } from "@/types";
 
 export interface VoiceInterfaceState {
     isRecording: boolean;
     onToggleListening: () => Promise<void>;
+    sendAppState: (state: AppStateSnapshot) => void;
 }
 
 export interface VoiceInterfaceConfig {
     onToolResponse?: (message: any) => void;
+    onTryOnJob?: (job: TryOnJobStatus) => void;
 }
 
 /**
@@ -20,7 +23,7 @@ export const useVoiceInterface = (config: VoiceInterfaceConfig = {}): VoiceInter
     const [isRecording, setIsRecording] = useState(false);
 
     // Setup real-time communication with Azure OpenAI
-    const { startSession, addUserAudio, inputAudioBufferClear } = useRealTime({
+    const { startSession, addUserAudio, inputAudioBufferClear, sendAppState } = useRealTime({
         onWebSocketOpen: () => {
             console.log("🔌 Voice: WebSocket connection opened");
         },
@@ -50,6 +53,10 @@ export const useVoiceInterface = (config: VoiceInterfaceConfig = {}): VoiceInter
             if (config.onToolResponse) {
                 config.onToolResponse(message);
             }
+        },
+        onReceivedExtensionTryOnJob: (message) => {
+            // Progress of try-ons running in the background, the result arrives as a tool response
+            config.onTryOnJob?.(message.job);
         }
     });
 
@@ -107,7 +114,8 @@ export const useVoiceInterface = (config: VoiceInterfaceConfig = {}): VoiceInter
 
     return {
         isRecording,
-        onToggleListening
+        onToggleListening,
+        sendAppState
     };
 };
 
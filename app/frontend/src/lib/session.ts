@@ -0,0 +1,18 @@
+const SESSION_TOKEN_KEY = "zalanko.session";
+
+/**
+ * Token of the realtime session issued by the backend (extension.session message).
+ * It is presented again when reconnecting and on HTTP requests so both reach the same session.
+ */
+export function getSessionToken(): string | null {
+    return sessionStorage.getItem(SESSION_TOKEN_KEY);
+}
+
+export function setSessionToken(token: string) {
+    sessionStorage.setItem(SESSION_TOKEN_KEY, token);
+}
+
+export function sessionHeaders(): Record<string, string> {
+    const token = getSessionToken();
+    return token ? { "X-Session-Id": token } : {};
+}
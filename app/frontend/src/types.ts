@@ -50,6 +50,41 @@ export type ResponseDone = {
     };
 };
 
+export type ExtensionSession = {
+    type: "extension.session";
+    session_id: string;
+};
+
+export type AppStateSnapshot = {
+    current_page: string;
+    current_product_id: string | null;
+    cart: { product_id: string }[];
+    wishlist: string[];
+    tryon_product_id: string | null;
+};
+
+export type ExtensionAppStateCommand = {
+    type: "extension.app_state";
+    event: "sync";
+    state: AppStateSnapshot;
+};
+
+export type TryOnJobStatus = {
+    job_id: string;
+    product_id: string;
+    status: "queued" | "running" | "succeeded" | "failed";
+    stage: string;
+    progress: number;
+    error?: string;
+    retry_after?: number;
+};
+
+export type ExtensionTryOnJob = {
+    type: "extension.tryon_job";
+    event: string;
+    job: TryOnJobStatus;
+};
+
 export type ExtensionMiddleTierToolResponse = {
     type: "extension.middle_tier_tool.response";
     previous_item_id: string;